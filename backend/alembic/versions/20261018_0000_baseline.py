@@ -0,0 +1,210 @@
+"""Esquema base (tabelas de antes das migrations)
+
+Revision ID: 0000
+Revises:
+Create Date: 2026-10-18
+
+Até aqui as tabelas eram criadas só pelo setup_database.py (create_all). Esta revisão cria as que
+faltarem, do jeito que eram antes de 0001, para que `alembic upgrade head` sozinho monte um banco vazio.
+Bancos já existentes: nada é recriado; só as colunas antigas que o setup_database remendava
+(unread_count, is_opt_out, opt_in) são adicionadas se faltarem.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0000"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _created_at():
+    return sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True)
+
+
+def _updated_at():
+    return sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True)
+
+
+def _tenant_id():
+    return sa.Column("tenant_id", sa.Uuid(), sa.ForeignKey("tenants.id"), nullable=True)
+
+
+# Ordem respeita as chaves estrangeiras
+TABLES = [
+    ("tenants", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("document_id", sa.String(20), nullable=True),
+        sa.Column("status", sa.String(20), nullable=True),
+        sa.Column("config", sa.JSON(), nullable=True),
+        _created_at(),
+    ]),
+    ("users", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("name", sa.String(255), nullable=True),
+        sa.Column("email", sa.String(255), nullable=False),
+        sa.Column("hashed_password", sa.String(255), nullable=False),
+        sa.Column("role", sa.String(20), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        _created_at(),
+        sa.Column("last_login_at", sa.DateTime(timezone=True), nullable=True),
+    ]),
+    ("audit_logs", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("user_id", sa.Uuid(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("action", sa.String(50), nullable=False),
+        sa.Column("resource", sa.String(50), nullable=False),
+        sa.Column("resource_id", sa.String(100), nullable=True),
+        sa.Column("details", sa.JSON(), nullable=True),
+        sa.Column("ip_address", sa.String(50), nullable=True),
+        sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    ]),
+    ("contacts", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("full_name", sa.String(255), nullable=True),
+        sa.Column("phone_e164", sa.String(20), nullable=False),
+        sa.Column("email", sa.String(255), nullable=True),
+        sa.Column("cpf", sa.String(14), nullable=True),
+        sa.Column("source", sa.String(50), nullable=True),
+        sa.Column("type", sa.String(20), nullable=True),
+        _created_at(),
+        _updated_at(),
+        sa.Column("last_interaction_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("opt_in", sa.Boolean(), nullable=True),
+        sa.Column("is_opt_out", sa.Boolean(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+    ]),
+    ("leads_pipeline", lambda: [
+        sa.Column("contact_id", sa.Uuid(), sa.ForeignKey("contacts.id"), primary_key=True),
+        sa.Column("stage", sa.String(50), nullable=False),
+        sa.Column("temperature", sa.String(20), nullable=True),
+        sa.Column("score", sa.Integer(), nullable=True),
+        sa.Column("assigned_to", sa.Uuid(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("unread_count", sa.Integer(), nullable=True),
+        sa.Column("notes", sa.Text(), nullable=True),
+    ]),
+    ("conversations", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("contact_id", sa.Uuid(), sa.ForeignKey("contacts.id"), nullable=True),
+        sa.Column("status", sa.String(20), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("closed_at", sa.DateTime(timezone=True), nullable=True),
+    ]),
+    ("messages", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("conversation_id", sa.Uuid(), sa.ForeignKey("conversations.id"), nullable=True),
+        sa.Column("external_id", sa.String(100), nullable=True),
+        sa.Column("direction", sa.String(10), nullable=False),
+        sa.Column("content", sa.Text(), nullable=True),
+        sa.Column("content_type", sa.String(20), nullable=True),
+        sa.Column("status", sa.String(20), nullable=True),
+        sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    ]),
+    ("procedures", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("contact_id", sa.Uuid(), sa.ForeignKey("contacts.id"), nullable=True),
+        sa.Column("external_id", sa.String(100), nullable=True),
+        sa.Column("procedure_name", sa.String(255), nullable=False),
+        sa.Column("category", sa.String(100), nullable=True),
+        sa.Column("performed_at", sa.Date(), nullable=False),
+        sa.Column("value", sa.DECIMAL(10, 2), nullable=True),
+        sa.Column("next_maintenance_date", sa.Date(), nullable=True),
+    ]),
+    ("campaigns", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("name", sa.String(255), nullable=False),
+        sa.Column("status", sa.String(20), nullable=True),
+        sa.Column("audience_rules", sa.JSON(), nullable=True),
+        sa.Column("message_template", sa.Text(), nullable=True),
+        sa.Column("media_url", sa.String(500), nullable=True),
+        sa.Column("excluded_contacts", sa.JSON(), nullable=True),
+        _created_at(),
+        sa.Column("scheduled_at", sa.DateTime(timezone=True), nullable=True),
+    ]),
+    ("campaign_events", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("campaign_id", sa.Uuid(), sa.ForeignKey("campaigns.id"), nullable=True),
+        sa.Column("contact_id", sa.Uuid(), sa.ForeignKey("contacts.id"), nullable=True),
+        sa.Column("status", sa.String(20), nullable=True),
+        sa.Column("processed_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("replied_at", sa.DateTime(timezone=True), nullable=True),
+    ]),
+    ("system_settings", lambda: [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _tenant_id(),
+        sa.Column("daily_limit", sa.Integer(), nullable=True),
+        sa.Column("hourly_limit", sa.Integer(), nullable=True),
+        sa.Column("min_interval_seconds", sa.Integer(), nullable=True),
+        sa.Column("max_interval_seconds", sa.Integer(), nullable=True),
+        sa.Column("working_hours_start", sa.String(5), nullable=True),
+        sa.Column("working_hours_end", sa.String(5), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        _updated_at(),
+    ]),
+    ("ai_config", lambda: [
+        sa.Column("id", sa.Integer(), primary_key=True),
+        _tenant_id(),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("system_prompt", sa.Text(), nullable=True),
+        sa.Column("model_name", sa.String(), nullable=True),
+        sa.Column("whitelist_numbers", sa.JSON(), nullable=True),
+        _updated_at(),
+    ]),
+    ("knowledge_documents", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        _tenant_id(),
+        sa.Column("title", sa.String(255), nullable=False),
+        sa.Column("file_path", sa.String(500), nullable=True),
+        sa.Column("raw_content", sa.Text(), nullable=True),
+        sa.Column("is_processed", sa.Boolean(), nullable=True),
+        _created_at(),
+    ]),
+    ("knowledge_chunks", lambda: [
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("document_id", sa.Uuid(), sa.ForeignKey("knowledge_documents.id"), nullable=True),
+        sa.Column("chunk_text", sa.Text(), nullable=False),
+        sa.Column("embedding", sa.JSON(), nullable=True),
+        sa.Column("chunk_index", sa.Integer(), nullable=True),
+    ]),
+]
+
+# Colunas que o setup_database.py antigo adicionava em bancos mais velhos
+LEGACY_COLUMNS = [
+    ("leads_pipeline", lambda: sa.Column("unread_count", sa.Integer(), server_default="0", nullable=True)),
+    ("contacts", lambda: sa.Column("is_opt_out", sa.Boolean(), server_default=sa.false(), nullable=True)),
+    ("contacts", lambda: sa.Column("opt_in", sa.Boolean(), server_default=sa.false(), nullable=True)),
+]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    for name, columns in TABLES:
+        if name not in existing:
+            op.create_table(name, *columns())
+    if "users" not in existing:
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    for table, column in LEGACY_COLUMNS:
+        col = column()
+        if table in existing and col.name not in {c["name"] for c in inspector.get_columns(table)}:
+            op.add_column(table, col)
+
+
+def downgrade() -> None:
+    # Esquema base: descer daqui apagaria os dados. Sem downgrade.
+    raise NotImplementedError("0000 é a revisão base; não há downgrade.")
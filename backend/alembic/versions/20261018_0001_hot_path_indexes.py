@@ -0,0 +1,91 @@
+"""Índices dos caminhos quentes (webhook, dispatcher, histórico) e telefone único por tenant
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-18
+
+Antes dos índices, adiciona as colunas novas do dispatcher (claim/lease, retry, instância),
+da fila justa (campaigns.priority/updated_at) e da atribuição de número (contacts.assigned_instance),
+se faltarem. Índices com IF NOT EXISTS: bancos criados pelo create_all mais novo já os têm.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0001"
+down_revision: Union[str, None] = "0000"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+QUEUED = sa.text("status = 'queued'")
+CLAIMED = sa.text("status = 'claimed'")
+
+# (tabela, coluna) - sem default de função: o SQLite não aceita em ADD COLUMN
+COLUMNS = [
+    ("campaign_events", lambda: sa.Column("claimed_by", sa.String(100), nullable=True)),
+    ("campaign_events", lambda: sa.Column("claim_expires_at", sa.DateTime(timezone=True), nullable=True)),
+    ("campaign_events", lambda: sa.Column("attempts", sa.Integer(), server_default="0", nullable=True)),
+    ("campaign_events", lambda: sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=True)),
+    ("campaign_events", lambda: sa.Column("last_error", sa.String(500), nullable=True)),
+    ("campaign_events", lambda: sa.Column("instance", sa.String(100), nullable=True)),
+    ("campaigns", lambda: sa.Column("priority", sa.Integer(), server_default="1", nullable=True)),
+    ("campaigns", lambda: sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True)),
+    ("contacts", lambda: sa.Column("assigned_instance", sa.String(100), nullable=True)),
+]
+
+# (nome, tabela, colunas, kwargs)
+INDEXES = [
+    ("ix_contacts_phone_e164", "contacts", ["phone_e164"], {}),
+    ("ix_conversations_contact_status", "conversations", ["contact_id", "status"], {}),
+    ("ix_conversations_tenant_id", "conversations", ["tenant_id"], {}),
+    ("ix_messages_external_id", "messages", ["external_id"], {}),
+    ("ix_messages_conversation_timestamp", "messages", ["conversation_id", "timestamp"], {}),
+    ("ix_messages_tenant_id", "messages", ["tenant_id"], {}),
+    ("ix_procedures_contact_performed", "procedures", ["contact_id", "performed_at"], {}),
+    ("ix_campaigns_tenant_created", "campaigns", ["tenant_id", "created_at"], {}),
+    ("ix_users_tenant_id", "users", ["tenant_id"], {}),
+    ("ix_campaign_events_status_sent_at", "campaign_events", ["status", "sent_at"], {}),
+    ("ix_campaign_events_campaign_contact", "campaign_events", ["campaign_id", "contact_id"], {}),
+    ("ix_campaign_events_contact_status", "campaign_events", ["contact_id", "status"], {}),
+    ("ix_campaign_events_queue", "campaign_events", ["campaign_id", "processed_at"],
+     {"postgresql_where": QUEUED, "sqlite_where": QUEUED}),
+    ("ix_campaign_events_claims", "campaign_events", ["claim_expires_at"],
+     {"postgresql_where": CLAIMED, "sqlite_where": CLAIMED}),
+]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table, column in COLUMNS:
+        col = column()
+        if col.name not in {c["name"] for c in inspector.get_columns(table)}:
+            op.add_column(table, col)
+
+    for name, table, columns, kwargs in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True, **kwargs)
+
+    # Telefone único por tenant: falha com mensagem clara se já houver duplicados
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        "SELECT tenant_id, phone_e164, COUNT(*) FROM contacts "
+        "WHERE tenant_id IS NOT NULL GROUP BY tenant_id, phone_e164 HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        sample = ", ".join(str(row[1]) for row in duplicates[:5])
+        raise RuntimeError(
+            f"{len(duplicates)} telefone(s) duplicado(s) no mesmo tenant (ex: {sample}). "
+            "Mescle os contatos antes de criar uq_contacts_tenant_phone."
+        )
+    op.create_index("uq_contacts_tenant_phone", "contacts", ["tenant_id", "phone_e164"], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("uq_contacts_tenant_phone", table_name="contacts", if_exists=True)
+    for name, table, _, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
+    for table, column in reversed(COLUMNS):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column(column().name)
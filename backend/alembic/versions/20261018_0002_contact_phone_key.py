@@ -0,0 +1,52 @@
+"""Chave canônica de telefone (contacts.phone_key) indexada
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+O webhook resolve o contato com uma única consulta por phone_key
+(dígitos com DDI, celular brasileiro sem o 9º dígito). Preenche os contatos existentes.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.phone import phone_key
+
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    columns = {c["name"] for c in sa.inspect(conn).get_columns("contacts")}
+    if "phone_key" not in columns:
+        op.add_column("contacts", sa.Column("phone_key", sa.String(20), nullable=True))
+
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT id, phone_e164 FROM contacts WHERE phone_key IS NULL AND phone_e164 IS NOT NULL LIMIT :n"
+        ), {"n": BATCH_SIZE}).fetchall()
+        if rows:
+            # Telefone inválido fica com chave '' para não voltar no próximo lote
+            conn.execute(
+                sa.text("UPDATE contacts SET phone_key = :key WHERE id = :id"),
+                [{"id": row[0], "key": phone_key(row[1]) or ""} for row in rows]
+            )
+        if len(rows) < BATCH_SIZE:
+            break
+
+    op.create_index("ix_contacts_phone_key", "contacts", ["phone_key"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_contacts_phone_key", table_name="contacts", if_exists=True)
+    with op.batch_alter_table("contacts") as batch_op:
+        batch_op.drop_column("phone_key")
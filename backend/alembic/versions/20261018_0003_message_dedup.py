@@ -0,0 +1,49 @@
+"""Mensagem única por (tenant_id, external_id) para o webhook idempotente
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+Remove duplicados já gravados (mantém a primeira entrega) e cria os índices únicos usados
+pelo INSERT ... ON CONFLICT DO NOTHING do webhook. As respostas da IA gravavam o mesmo
+external_id ('ai-now()'); esses ficam sem external_id.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NO_TENANT = sa.text("tenant_id IS NULL")
+
+DEDUPE_SQL = """
+DELETE FROM messages WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY tenant_id, external_id ORDER BY timestamp, id
+        ) AS rn
+        FROM messages WHERE external_id IS NOT NULL
+    ) ranked WHERE rn > 1
+)
+"""
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(sa.text("UPDATE messages SET external_id = NULL WHERE external_id = 'ai-now()'"))
+    conn.execute(sa.text(DEDUPE_SQL))
+    op.create_index("uq_messages_tenant_external", "messages", ["tenant_id", "external_id"],
+                    unique=True, if_not_exists=True)
+    op.create_index("uq_messages_external_no_tenant", "messages", ["external_id"], unique=True, if_not_exists=True,
+                    postgresql_where=NO_TENANT, sqlite_where=NO_TENANT)
+
+
+def downgrade() -> None:
+    op.drop_index("uq_messages_external_no_tenant", table_name="messages", if_exists=True)
+    op.drop_index("uq_messages_tenant_external", table_name="messages", if_exists=True)
@@ -0,0 +1,34 @@
+"""Reserva de orçamento por instância (campaign_events.reserved_at)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+Os limites de envio (dia/hora/intervalo) passam a ser conferidos no banco, contando envios feitos
+e reservados por todos os dispatchers; o índice cobre a contagem por instância.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("campaign_events")}
+    if "reserved_at" not in columns:
+        op.add_column("campaign_events", sa.Column("reserved_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index("ix_campaign_events_instance_budget", "campaign_events", ["instance", "status", "reserved_at"],
+                    if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_campaign_events_instance_budget", table_name="campaign_events", if_exists=True)
+    with op.batch_alter_table("campaign_events") as batch_op:
+        batch_op.drop_column("reserved_at")
@@ -0,0 +1,47 @@
+"""Um evento por (campaign_id, contact_id)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+Com vários workers o scheduler podia disparar a mesma campanha mais de uma vez e enfileirar o lead
+em dobro. Remove os duplicados já gravados (mantém o que avançou mais: enviado > em andamento > fila)
+e troca o índice do anti-join por um único, usado pelo INSERT ... ON CONFLICT DO NOTHING.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEDUPE_SQL = """
+DELETE FROM campaign_events WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY campaign_id, contact_id
+            ORDER BY CASE status WHEN 'sent' THEN 0 WHEN 'claimed' THEN 1 WHEN 'queued' THEN 3 ELSE 2 END,
+                     processed_at, id
+        ) AS rn
+        FROM campaign_events WHERE campaign_id IS NOT NULL AND contact_id IS NOT NULL
+    ) ranked WHERE rn > 1
+)
+"""
+
+
+def upgrade() -> None:
+    op.get_bind().execute(sa.text(DEDUPE_SQL))
+    op.create_index("uq_campaign_events_campaign_contact", "campaign_events", ["campaign_id", "contact_id"],
+                    unique=True, if_not_exists=True)
+    op.drop_index("ix_campaign_events_campaign_contact", table_name="campaign_events", if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index("ix_campaign_events_campaign_contact", "campaign_events", ["campaign_id", "contact_id"],
+                    if_not_exists=True)
+    op.drop_index("uq_campaign_events_campaign_contact", table_name="campaign_events", if_exists=True)
@@ -0,0 +1,43 @@
+"""Telefone único também para contatos sem tenant
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+uq_contacts_tenant_phone não cobre tenant_id NULL (NULL não conflita em índice único), e é
+exatamente assim que o webhook cria contatos novos. Índice único parcial em phone_e164 para eles.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NO_TENANT = sa.text("tenant_id IS NULL")
+
+
+def upgrade() -> None:
+    # Falha com mensagem clara se já houver duplicados (mesma regra do 0001)
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        "SELECT phone_e164, COUNT(*) FROM contacts "
+        "WHERE tenant_id IS NULL GROUP BY phone_e164 HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        sample = ", ".join(str(row[0]) for row in duplicates[:5])
+        raise RuntimeError(
+            f"{len(duplicates)} telefone(s) duplicado(s) em contatos sem tenant (ex: {sample}). "
+            "Mescle os contatos antes de criar uq_contacts_phone_no_tenant."
+        )
+    op.create_index("uq_contacts_phone_no_tenant", "contacts", ["phone_e164"], unique=True, if_not_exists=True,
+                    postgresql_where=NO_TENANT, sqlite_where=NO_TENANT)
+
+
+def downgrade() -> None:
+    op.drop_index("uq_contacts_phone_no_tenant", table_name="contacts", if_exists=True)
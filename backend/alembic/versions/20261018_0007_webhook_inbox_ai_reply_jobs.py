@@ -0,0 +1,85 @@
+"""Tabelas das filas duráveis: webhook_inbox e ai_reply_jobs
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+webhook_inbox: payloads do webhook gravados na chegada e processados em background.
+ai_reply_jobs: respostas da IA como jobs (debounce, limite por tenant, timeout, prompt_tokens).
+Bancos criados pelo setup_database.py mais novo já têm as tabelas: cria só o que faltar.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PENDING = sa.text("status = 'pending'")
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table("webhook_inbox"):
+        op.create_table(
+            "webhook_inbox",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("remote_jid", sa.String(100), nullable=False, server_default=""),
+            sa.Column("event", sa.String(50), nullable=True),
+            sa.Column("payload", sa.JSON(), nullable=False),
+            sa.Column("status", sa.String(20), nullable=True),
+            sa.Column("attempts", sa.Integer(), nullable=True),
+            sa.Column("last_error", sa.String(500), nullable=True),
+            sa.Column("claimed_by", sa.String(100), nullable=True),
+            sa.Column("claim_expires_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("received_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("processed_at", sa.DateTime(timezone=True), nullable=True),
+        )
+    op.create_index("ix_webhook_inbox_pending", "webhook_inbox", ["id"], if_not_exists=True,
+                    postgresql_where=PENDING, sqlite_where=PENDING)
+    op.create_index("ix_webhook_inbox_jid_status", "webhook_inbox", ["remote_jid", "status"], if_not_exists=True)
+
+    if not inspector.has_table("ai_reply_jobs"):
+        op.create_table(
+            "ai_reply_jobs",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("tenant_id", sa.Uuid(), sa.ForeignKey("tenants.id"), nullable=True),
+            sa.Column("conversation_id", sa.Uuid(), sa.ForeignKey("conversations.id"), nullable=False),
+            sa.Column("contact_id", sa.Uuid(), sa.ForeignKey("contacts.id"), nullable=False),
+            sa.Column("instance", sa.String(100), nullable=True),
+            sa.Column("status", sa.String(20), nullable=True),
+            sa.Column("messages", sa.Integer(), nullable=True),
+            sa.Column("first_message_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("run_after", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("attempts", sa.Integer(), nullable=True),
+            sa.Column("last_error", sa.String(500), nullable=True),
+            sa.Column("claimed_by", sa.String(100), nullable=True),
+            sa.Column("claim_expires_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("duration_ms", sa.Integer(), nullable=True),
+            sa.Column("prompt_tokens", sa.Integer(), nullable=True),
+        )
+    else:
+        columns = {c["name"] for c in inspector.get_columns("ai_reply_jobs")}
+        if "prompt_tokens" not in columns:
+            op.add_column("ai_reply_jobs", sa.Column("prompt_tokens", sa.Integer(), nullable=True))
+    op.create_index("ix_ai_reply_jobs_due", "ai_reply_jobs", ["run_after"], if_not_exists=True,
+                    postgresql_where=PENDING, sqlite_where=PENDING)
+    op.create_index("ix_ai_reply_jobs_conversation_status", "ai_reply_jobs", ["conversation_id", "status"],
+                    if_not_exists=True)
+    op.create_index("ix_ai_reply_jobs_tenant_status", "ai_reply_jobs", ["tenant_id", "status"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table in ("ai_reply_jobs", "webhook_inbox"):
+        if inspector.has_table(table):
+            op.drop_table(table)
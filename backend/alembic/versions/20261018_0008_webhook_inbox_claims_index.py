@@ -0,0 +1,31 @@
+"""Índice dos leases do webhook_inbox
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+Parcial (status = 'processing'): a conferência do claim no SQLite e o release de leases vencidos
+deixam de varrer o inbox inteiro (itens 'done' ficam até o purge).
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PROCESSING = sa.text("status = 'processing'")
+
+
+def upgrade() -> None:
+    op.create_index("ix_webhook_inbox_claims", "webhook_inbox", ["claim_expires_at"], if_not_exists=True,
+                    postgresql_where=PROCESSING, sqlite_where=PROCESSING)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_webhook_inbox_claims", table_name="webhook_inbox", if_exists=True)
@@ -0,0 +1,32 @@
+"""Intervalo aleatório por instância (campaign_events.next_allowed_at)
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+
+Cada reserva de envio grava quando a instância pode enviar de novo (reserva + intervalo sorteado
+entre min_interval_seconds e max_interval_seconds); a reserva seguinte espera o maior deles.
+Lido junto com a contagem de orçamento (mesmo índice por instância).
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0009"
+down_revision: Union[str, None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("campaign_events")}
+    if "next_allowed_at" not in columns:
+        op.add_column("campaign_events", sa.Column("next_allowed_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("campaign_events") as batch_op:
+        batch_op.drop_column("next_allowed_at")
@@ -1,8 +1,11 @@
+from typing import List, Optional
+from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db.session import get_db
-from app.models.models import AIConfig
-from app.schemas.ai import AIConfigSchema, AIConfigUpdate
+from app.models.models import AIConfig, AIReplyJob
+from app.schemas.ai import AIConfigSchema, AIConfigUpdate, AIReplyJobSchema
+from app.services.ai_reply_scheduler import ai_reply_scheduler
 
 router = APIRouter()
 
@@ -33,3 +36,33 @@ def update_ai_config(update: AIConfigUpdate, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(config)
     return config
+
+@router.get("/jobs", response_model=List[AIReplyJobSchema])
+def list_ai_jobs(
+    status: Optional[str] = None,
+    tenant_id: Optional[UUID] = None,
+    conversation_id: Optional[UUID] = None,
+    limit: int = 50,
+    db: Session = Depends(get_db)
+):
+    """Jobs de resposta da IA, mais recentes primeiro."""
+    query = db.query(AIReplyJob)
+    if status:
+        query = query.filter(AIReplyJob.status == status)
+    if tenant_id:
+        query = query.filter(AIReplyJob.tenant_id == tenant_id)
+    if conversation_id:
+        query = query.filter(AIReplyJob.conversation_id == conversation_id)
+    return query.order_by(AIReplyJob.id.desc()).limit(max(1, min(limit, 500))).all()
+
+@router.get("/jobs/stats")
+def ai_jobs_stats(db: Session = Depends(get_db)):
+    """Fila por status, jobs em andamento por tenant, duração e tokens médios, atraso do job vencido mais antigo."""
+    return ai_reply_scheduler.stats(db)
+
+@router.get("/jobs/{job_id}", response_model=AIReplyJobSchema)
+def get_ai_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(AIReplyJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
@@ -3,6 +3,9 @@ from sqlalchemy.orm import Session
 from app.db.session import get_db
 from app.schemas.campaign import CampaignPreviewRequest, CampaignPreviewResponse, CampaignCreate, CampaignSchema, ContactSample, CampaignUpdate
 from app.services.campaign_service import campaign_service
+from app.services.dispatcher_service import campaign_dispatcher
+from app.services.campaign_scheduler import campaign_scheduler
+from app.services.template_service import template_service, TEMPLATE_VARIABLES
 from app.models.models import Campaign, Contact, CampaignEvent, LeadPipeline, User
 from app.api import deps
 from sqlalchemy import func
@@ -11,6 +14,20 @@ import uuid
 
 router = APIRouter()
 
+def validate_template(template: str):
+    unknown = template_service.unknown_placeholders(template)
+    if unknown:
+        allowed = ", ".join("{" + v + "}" for v in TEMPLATE_VARIABLES)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Variáveis desconhecidas no template: {', '.join('{' + v + '}' for v in unknown)}. Disponíveis: {allowed}"
+        )
+
+@router.get("/template-variables")
+def list_template_variables():
+    """Variáveis aceitas no message_template (ex: {primeiro_nome})."""
+    return TEMPLATE_VARIABLES
+
 @router.post("/preview", response_model=CampaignPreviewResponse)
 def preview_audience(request: CampaignPreviewRequest, db: Session = Depends(get_db)):
     start_time = time.time()
@@ -53,6 +70,8 @@ def create_campaign(
     db: Session = Depends(get_db),
     current_user: User = Depends(deps.get_current_user)
 ):
+    validate_template(campaign_in.message_template)
+
     # Serializa regras para o banco (Pydantic -> Dict -> JSON Column)
     rules_dump = campaign_in.audience_rules.model_dump()
     
@@ -64,12 +83,14 @@ def create_campaign(
         media_url=campaign_in.media_url,
         excluded_contacts=campaign_in.excluded_contacts,
         scheduled_at=campaign_in.scheduled_at,
+        priority=max(campaign_in.priority or 1, 1), # Mesmo piso do update (DRR exige peso positivo)
         status='draft'
     )
     
     db.add(new_campaign)
     db.commit()
     db.refresh(new_campaign)
+    campaign_scheduler.notify(new_campaign)
     return new_campaign
 
 @router.get("", response_model=list[CampaignSchema])
@@ -90,6 +111,7 @@ def execute_campaign_endpoint(campaign_id: str, force: bool = False, db: Session
         result = campaign_service.execute_campaign(db, campaign_id, force_resend=force)
         if "error" in result:
              raise HTTPException(status_code=400, detail=result["error"])
+        campaign_dispatcher.wake()
         return result
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -120,16 +142,22 @@ def update_campaign(campaign_id: str, update: CampaignUpdate, db: Session = Depe
     if not camp:
         raise HTTPException(status_code=404, detail="Campanha não encontrada")
         
+    if update.message_template is not None: validate_template(update.message_template)
+
     if update.name is not None: camp.name = update.name
     if update.message_template is not None: camp.message_template = update.message_template
     if update.media_url is not None: camp.media_url = update.media_url
     if update.excluded_contacts is not None: camp.excluded_contacts = update.excluded_contacts
     if update.scheduled_at is not None: camp.scheduled_at = update.scheduled_at
+    if update.priority is not None:
+        camp.priority = max(update.priority, 1)
+        campaign_service.fair_queue.invalidate() # Vale inclusive para campanha já em disparo
     if update.audience_rules is not None:
         camp.audience_rules = update.audience_rules.model_dump()
         
     db.commit()
     db.refresh(camp)
+    campaign_scheduler.notify(camp)
     return camp
 
 @router.delete("/{campaign_id}")
@@ -145,8 +173,7 @@ def delete_campaign(campaign_id: str, db: Session = Depends(get_db)):
         
     db.delete(camp)
     db.commit()
-    db.delete(camp)
-    db.commit()
+    campaign_scheduler.cancel(cid)
     return {"status": "deleted"}
 
 @router.post("/{campaign_id}/clone", response_model=CampaignSchema)
@@ -167,6 +194,7 @@ def clone_campaign(campaign_id: str, db: Session = Depends(get_db), current_user
         message_template=original.message_template,
         media_url=original.media_url,
         excluded_contacts=original.excluded_contacts,
+        priority=original.priority,
         status='draft'
     )
     
@@ -218,6 +246,8 @@ def get_campaign_leads(campaign_id: str, db: Session = Depends(get_db)):
             "full_name": contact.full_name,
             "phone": contact.phone_e164,
             "status": event.status,
+            "attempts": event.attempts or 0,
+            "last_error": event.last_error,
             "replied": event.replied_at is not None,
             "replied_at": event.replied_at,
             "temperature": pipeline.temperature if pipeline else None,
@@ -7,6 +7,8 @@ from pydantic import BaseModel
 from app.db.session import get_db
 from sqlalchemy.sql import func, text
 from app.models.models import Contact, LeadPipeline, Conversation, Message
+from app.core.phone import normalize_phone, phone_key
+from app.services.ai_reply_scheduler import ai_reply_scheduler
 from app.schemas.lead import ContactSchema
 from app.services.import_service import process_excel_import
 import os
@@ -52,16 +54,19 @@ async def import_leads_file(file: UploadFile = File(...), db: Session = Depends(
         # Como o db pode ser grande, melhor fazer exists() por item ou carregar apenas hashset dos phones.
         # Para simplicidade e segurança (race conditions), faremos verificação row-by-row ou insert ignore.
         
-        # Vamos row-by-row com clean_phone
+        # Vamos row-by-row com normalize_phone (mesma normalização do webhook)
         for idx, row in df.iterrows():
             try:
                 raw_phone = str(row[col_phone]) if pd.notna(row[col_phone]) else ""
                 if not raw_phone or raw_phone.lower() == 'nan': continue
                 
-                clean = clean_phone(raw_phone)
+                clean = normalize_phone(raw_phone)
+                if not clean:
+                    stats["errors"].append(f"Linha {idx+2}: telefone inválido ({raw_phone})")
+                    continue
                 
-                # Check duplication
-                exists = db.query(Contact.id).filter(Contact.phone_e164 == clean).first()
+                # Check duplication (chave canônica: com/sem 9º dígito é o mesmo contato)
+                exists = db.query(Contact.id).filter(Contact.phone_key == phone_key(clean)).first()
                 if exists:
                     stats["ignored"] += 1
                     continue
@@ -175,7 +180,8 @@ def send_lead_message(lead_id: UUID, request: SendMessageRequest, db: Session =
     result = evolution_service.send_message(
         phone=contact.phone_e164,
         text=request.message,
-        media_url=request.media_url
+        media_url=request.media_url,
+        instance=contact.assigned_instance # Mesmo número que já conversa com o lead
     )
     
     # 1. Busca ou cria conversa aberta
@@ -208,6 +214,7 @@ def send_lead_message(lead_id: UUID, request: SendMessageRequest, db: Session =
     )
     db.add(new_msg)
     contact.last_interaction_at = func.now()
+    ai_reply_scheduler.cancel(db, conversation.id) # Atendente respondeu: IA não responde a mesma rajada
     db.commit()
 
     return result
@@ -336,7 +343,10 @@ def update_lead(lead_id: UUID, lead_data: LeadUpdate, db: Session = Depends(get_
     if lead_data.email:
         contact.email = lead_data.email
     if lead_data.phone:
-        contact.phone_e164 = lead_data.phone
+        phone = normalize_phone(lead_data.phone)
+        if not phone:
+            raise HTTPException(status_code=400, detail="Telefone inválido")
+        contact.phone_e164 = phone
         
     db.commit()
     db.refresh(contact)
@@ -348,26 +358,15 @@ class LeadCreate(BaseModel):
     phone: str
     email: Optional[str] = None
 
-def clean_phone(phone: str) -> str:
-    import re
-    digits = re.sub(r'\D', '', phone)
-    # Se não tiver dígitos suficientes, retorna o original (vai falhar ou salvar sujo)
-    if len(digits) < 8:
-        return phone
-        
-    # Assume Brasil (+55) se não começar com 55 e tiver 10 ou 11 dígitos
-    if len(digits) in [10, 11]:
-        digits = '55' + digits
-        
-    return f"+{digits}"
-
 @router.post("/", response_model=ContactSchema)
 def create_lead(lead: LeadCreate, db: Session = Depends(get_db)):
     # Limpa telefone
-    phone_clean = clean_phone(lead.phone)
+    phone_clean = normalize_phone(lead.phone)
+    if not phone_clean:
+        raise HTTPException(status_code=400, detail="Telefone inválido")
 
-    # Verifica duplicidade
-    existing = db.query(Contact).filter(Contact.phone_e164 == phone_clean).first()
+    # Verifica duplicidade (chave canônica: com/sem 9º dígito é o mesmo contato)
+    existing = db.query(Contact).filter(Contact.phone_key == phone_key(phone_clean)).first()
     if existing:
         raise HTTPException(
             status_code=400, 
@@ -1,8 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.db.session import get_db
-from app.models.models import SystemSettings
+from app.models.models import SystemSettings, Tenant
 from pydantic import BaseModel
+from typing import List, Optional
+from app.services.campaign_service import campaign_service
+from app.services.instance_pool import instance_pool
+from app.services.optout_matcher import optout_registry, fold
+import uuid
 
 router = APIRouter()
 
@@ -18,22 +23,30 @@ class CampaignSettings(BaseModel):
     class Config:
         from_attributes = True
 
+def parse_tenant_id(tenant_id: Optional[str]):
+    if not tenant_id:
+        return None
+    try:
+        return uuid.UUID(str(tenant_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="tenant_id inválido")
+
 @router.get("/campaign", response_model=CampaignSettings)
-def get_campaign_settings(db: Session = Depends(get_db)):
-    settings = db.query(SystemSettings).first()
-    if not settings:
-        settings = SystemSettings()
-        db.add(settings)
-        db.commit()
-        db.refresh(settings)
-    return settings
+def get_campaign_settings(tenant_id: Optional[str] = None, db: Session = Depends(get_db)):
+    # Sem tenant_id: limites globais (lane padrão). Com tenant_id: os do tenant, ou o global se não tiver próprios.
+    return campaign_service.get_settings(db, parse_tenant_id(tenant_id))
 
 @router.put("/campaign", response_model=CampaignSettings)
-def update_campaign_settings(payload: CampaignSettings, db: Session = Depends(get_db)):
-    settings = db.query(SystemSettings).first()
-    if not settings:
-        settings = SystemSettings()
-        db.add(settings)
+def update_campaign_settings(payload: CampaignSettings, tenant_id: Optional[str] = None, db: Session = Depends(get_db)):
+    # Com tenant_id grava limites próprios do tenant (valem para a lane da instância dele, ver Tenant.config["evolution_instance"])
+    tid = parse_tenant_id(tenant_id)
+    if tid is not None:
+        settings = db.query(SystemSettings).filter(SystemSettings.tenant_id == tid).first()
+        if not settings:
+            settings = SystemSettings(tenant_id=tid)
+            db.add(settings)
+    else:
+        settings = campaign_service.get_settings(db)
     
     settings.daily_limit = payload.daily_limit
     settings.hourly_limit = payload.hourly_limit
@@ -47,6 +60,33 @@ def update_campaign_settings(payload: CampaignSettings, db: Session = Depends(ge
     db.refresh(settings)
     return settings
 
+class OptOutSettings(BaseModel):
+    keywords: List[str] # Mensagem inteira (ex: "SAIR")
+    phrases: List[str]  # Em qualquer ponto do texto (ex: "não quero mais")
+
+@router.get("/optout", response_model=OptOutSettings)
+def get_optout_settings(tenant_id: Optional[str] = None, db: Session = Depends(get_db)):
+    # Sem tenant_id (ou tenant sem lista própria): padrões globais
+    tid = parse_tenant_id(tenant_id)
+    tenant = db.get(Tenant, tid) if tid else None
+    keywords, phrases = optout_registry.patterns_of(tenant.config if tenant else None)
+    return {"keywords": keywords, "phrases": phrases}
+
+@router.put("/optout", response_model=OptOutSettings)
+def update_optout_settings(payload: OptOutSettings, tenant_id: str, db: Session = Depends(get_db)):
+    # Grava em Tenant.config; acento/pontuação/maiúsculas não importam (o matcher normaliza)
+    tenant = db.get(Tenant, parse_tenant_id(tenant_id))
+    if not tenant:
+        raise HTTPException(status_code=404, detail="Tenant não encontrado")
+
+    config = dict(tenant.config or {})
+    config["optout_keywords"] = [k.strip() for k in payload.keywords if fold(k)]
+    config["optout_phrases"] = [p.strip() for p in payload.phrases if fold(p)]
+    tenant.config = config # Reatribui: JSON não rastreia mutação in-place
+    db.commit()
+    optout_registry.invalidate(tenant.id)
+    return {"keywords": config["optout_keywords"], "phrases": config["optout_phrases"]}
+
 from app.core.security import verify_password
 from app.api import deps
 from app.models.models import User
@@ -66,6 +106,13 @@ def get_evolution_config(current_user: User = Depends(deps.get_current_user)):
         "instance": evolution_service.instance
     }
 
+@router.get("/evolution/stats", response_model=dict)
+def get_evolution_stats(current_user: User = Depends(deps.get_current_user)):
+    """Latência e erros por endpoint da Evolution (desde o start do processo) e saúde/uso de cada instância."""
+    stats = evolution_service.get_stats()
+    stats["instances"] = instance_pool.stats()
+    return stats
+
 @router.put("/evolution")
 def update_evolution_config(payload: EvolutionConfig, current_user: User = Depends(deps.get_current_user), db: Session = Depends(get_db)):
     # 1. Verify Password
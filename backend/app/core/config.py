@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -13,10 +13,66 @@ class Settings(BaseSettings):
     EVOLUTION_API_URL: Optional[str] = None
     EVOLUTION_API_KEY: Optional[str] = None
     EVOLUTION_INSTANCE_NAME: str = "clinica_principal"
+    EVOLUTION_MAX_IN_FLIGHT: int = 4 # Envios simultâneos por lane (typing delay não bloqueia o dispatcher)
+    EVOLUTION_SEND_THREADS: int = 16 # Threads do pool de envio (somando todas as lanes)
+    EVOLUTION_POOL_SIZE: int = 16 # Conexões keep-alive reutilizadas por host
+    EVOLUTION_CONNECT_TIMEOUT: float = 5.0
+    EVOLUTION_READ_TIMEOUT: float = 30.0 # Somado ao typing delay nos envios
+    MEDIA_CACHE_MAX_MB: int = 64 # Mídias locais já em Base64, reaproveitadas entre destinatários
 
     # AI Config
     OPENAI_API_KEY: Optional[str] = None
     AI_MODEL: str = "gpt-4o"
+    OPENAI_API_URL: str = "https://api.openai.com/v1/chat/completions" # Aponte para um stub local em testes
+    OPENAI_POOL_SIZE: int = 8 # Conexões keep-alive reutilizadas (>= AI_REPLY_WORKERS)
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_READ_TIMEOUT: float = 20.0 # Sem streaming: resposta inteira; com streaming: intervalo entre pedaços
+    OPENAI_STREAM: bool = True # Resposta em streaming (digitando... no WhatsApp já no primeiro token)
+    OPENAI_MAX_RETRIES: int = 3 # Novas tentativas em 429/5xx/falha de conexão
+    OPENAI_RETRY_BACKOFF_SECONDS: float = 1.0 # Base do backoff exponencial quando não há Retry-After
+    OPENAI_RETRY_MAX_WAIT_SECONDS: float = 20.0 # Teto da espera entre tentativas (inclusive Retry-After)
+
+    # Contexto da IA (orçamento de tokens do prompt, por modelo)
+    AI_CONTEXT_BUDGETS: Dict[str, int] = {"gpt-4o": 6000, "gpt-4o-mini": 6000, "gpt-4-turbo": 6000, "gpt-3.5-turbo": 3000}
+    AI_CONTEXT_DEFAULT_BUDGET: int = 4000 # Modelo fora da lista acima
+    AI_CONTEXT_HISTORY_LIMIT: int = 40 # Mensagens lidas do banco (o orçamento decide quantas entram)
+    AI_CONTEXT_RECENT_TURNS: int = 6 # Últimas mensagens: entram antes do RAG
+    AI_CONTEXT_MAX_MESSAGE_TOKENS: int = 400 # Mensagem maior é truncada
+    AI_CONTEXT_RAG_CHUNK_TOKENS: int = 200 # Cada trecho da base de conhecimento
+
+    # Campaign Dispatcher
+    RUN_EMBEDDED_WORKER: bool = True # False quando o dispatcher roda à parte (python -m app.worker)
+    CAMPAIGN_DISPATCH_MODE: str = "bucket" # "bucket" (token bucket) ou "tick" (legado: 1 envio a cada 10s)
+    DISPATCH_IDLE_SECONDS: float = 30.0 # Sono máximo quando a fila está vazia/bloqueada
+    DISPATCH_LEASE_SECONDS: int = 300 # Validade do claim de um CampaignEvent (crash -> volta para a fila)
+    CAMPAIGN_MAX_ATTEMPTS: int = 5 # Tentativas por mensagem antes de marcar 'failed'
+    CAMPAIGN_RETRY_BASE_SECONDS: float = 30.0 # Backoff exponencial com jitter
+    CAMPAIGN_RETRY_MAX_SECONDS: float = 1800.0
+    SCHEDULER_SYNC_SECONDS: float = 60.0 # Sync incremental de agendamentos feitos por outro processo
+    SCHEDULER_MISFIRE_GRACE_SECONDS: float = 3600.0 # Atraso máximo para ainda disparar uma campanha agendada
+    DISPATCH_TRACKER_RESYNC_SECONDS: float = 60 # Ressincroniza os contadores locais com o banco (os limites valem pela reserva no banco)
+    INSTANCE_HEALTH_TTL_SECONDS: float = 60.0 # Cache do connectionState de cada instância do pool
+    INSTANCE_MAX_FAILURES: int = 3 # Falhas de conexão seguidas para tirar a instância do pool (failover)
+    FAIR_QUEUE_REFRESH_SECONDS: float = 10.0 # Recarrega o backlog de campanhas ativas (novas campanhas entram na rodada)
+
+    # Webhook Inbox (ACK imediato, processamento em background)
+    WEBHOOK_WORKERS: int = 4 # Threads de processamento (mesmo contato sempre na mesma thread = em ordem)
+    WEBHOOK_POLL_SECONDS: float = 1.0 # Verificação do inbox quando a API roda em outro processo
+    WEBHOOK_LEASE_SECONDS: int = 120
+    WEBHOOK_MAX_ATTEMPTS: int = 3
+    WEBHOOK_RETENTION_HOURS: int = 72 # Itens processados são apagados depois disso
+    WEBHOOK_CACHE_MAX_ENTRIES: int = 5000 # Contatos em memória (LRU) por processo
+    WEBHOOK_CACHE_TTL_SECONDS: int = 300 # 0 = desliga o cache
+
+    # Respostas da IA: jobs fora do webhook (rajada de mensagens do lead = 1 resposta)
+    AI_REPLY_DEBOUNCE_SECONDS: float = 8.0 # Silêncio do lead antes de responder (0 = responde na hora)
+    AI_REPLY_MAX_WAIT_SECONDS: float = 30.0 # Lead que não para de escrever recebe resposta mesmo assim
+    AI_REPLY_WORKERS: int = 4 # Respostas geradas em paralelo (por processo)
+    AI_REPLY_MAX_PER_TENANT: int = 2 # Respostas simultâneas por tenant (todos os processos)
+    AI_REPLY_TIMEOUT_SECONDS: int = 60 # Resposta que passar disso não é mais enviada
+    AI_REPLY_MAX_ATTEMPTS: int = 2
+    AI_REPLY_POLL_SECONDS: float = 1.0 # Verificação da fila quando o job nasceu em outro processo
+    AI_REPLY_RETENTION_HOURS: int = 72 # Jobs finalizados são apagados depois disso
 
     # Security (JWT)
     SECRET_KEY: str = "sua_chave_secreta_super_segura_troque_isso_em_producao"
@@ -0,0 +1,12 @@
+from datetime import datetime
+from typing import Optional
+
+# O código grava datetime.now() (horário local, sem fuso), mas o Postgres devolve as colunas
+# DateTime(timezone=True) com fuso. Comparar os dois em Python dá TypeError: normalize antes.
+
+
+def to_local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """Datetime com fuso -> horário local do servidor sem fuso (sem fuso: inalterado)."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
@@ -0,0 +1,49 @@
+import re
+from typing import Optional
+
+# Normalização única de telefone (webhook, cadastro manual, importações).
+# - normalize_phone: formato gravado em Contact.phone_e164 (+55DDDxxxxxxxxx)
+# - phone_key: chave canônica só com dígitos e sem a ambiguidade do 9º dígito,
+#   gravada em Contact.phone_key (indexada) para achar o contato com 1 consulta.
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone(phone_raw) -> Optional[str]:
+    """
+    Padroniza telefones para o formato E.164 (+55DDDxxxxxxxxx).
+    Com '+' o DDI já veio informado; sem '+', 10 ou 11 dígitos = Brasil sem DDI.
+    Retorna None se não houver dígitos suficientes.
+    """
+    if phone_raw is None:
+        return None
+
+    phone_str = str(phone_raw).strip()
+    if phone_str.endswith('.0'): # Planilhas: número lido como float
+        phone_str = phone_str[:-2]
+    digits = _NON_DIGITS.sub('', phone_str)
+
+    if len(digits) < 10:
+        return None
+
+    # Assume Brasil (+55) se não vier com DDI e tiver 10 ou 11 dígitos
+    if not phone_str.startswith('+') and len(digits) in [10, 11]:
+        digits = '55' + digits
+
+    return f"+{digits}"
+
+
+def phone_key(phone_raw) -> Optional[str]:
+    """
+    Chave de busca: dígitos com DDI, celular brasileiro sem o 9º dígito.
+    +55 11 91234-5678 e +55 11 1234-5678 (número antigo, sem o 9) geram a mesma chave.
+    """
+    phone = normalize_phone(phone_raw)
+    if not phone:
+        return None
+
+    digits = phone[1:]
+    # Brasil: 55 + DDD + 9 + 8 dígitos (celular) -> remove o 9
+    if len(digits) == 13 and digits.startswith('55') and digits[4] == '9':
+        digits = digits[:4] + digits[5:]
+    return digits
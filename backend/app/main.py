@@ -24,6 +24,10 @@ from app.core.config import settings
 from app.db.session import engine
 from app.db.session import SessionLocal
 from app.services.campaign_service import campaign_service
+from app.services.dispatcher_service import campaign_dispatcher
+from app.services.campaign_scheduler import campaign_scheduler
+from app.services.webhook_worker import webhook_worker
+from app.services.ai_reply_scheduler import ai_reply_scheduler
 from app.db.base import Base
 from app.models import models 
 
@@ -37,21 +41,36 @@ def run_campaign_worker():
     # Executa verificação da fila
     db = SessionLocal()
     try:
-        campaign_service.process_queue(db)
+        campaign_service.process_queue(db, worker_id=campaign_dispatcher.worker_id)
     except Exception as e:
         print(f"Worker Error: {e}")
     finally:
         db.close()
 
-# Roda worker a cada 10 segundos
-scheduler.add_job(run_campaign_worker, 'interval', seconds=10)
+# Modo legado: roda worker a cada 10 segundos
+if settings.CAMPAIGN_DISPATCH_MODE == "tick":
+    scheduler.add_job(run_campaign_worker, 'interval', seconds=10)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("🚀 Inicializando Worker de Disparos...")
+    if not settings.RUN_EMBEDDED_WORKER:
+        print("ℹ️ Worker de Disparos desabilitado neste processo (use: python -m app.worker)")
+        yield
+        return
+
+    print(f"🚀 Inicializando Worker de Disparos (modo {settings.CAMPAIGN_DISPATCH_MODE})...")
     scheduler.start()
+    if settings.CAMPAIGN_DISPATCH_MODE != "tick":
+        campaign_dispatcher.start()
+    campaign_scheduler.start()
+    webhook_worker.start() # Inbox do webhook
+    ai_reply_scheduler.start() # Respostas da IA (jobs)
     yield
     print("🛑 Encerrando Worker...")
+    webhook_worker.stop()
+    ai_reply_scheduler.stop()
+    campaign_scheduler.stop()
+    campaign_dispatcher.stop()
     scheduler.shutdown()
 
 # --- APP SETUP ---
@@ -101,7 +120,7 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "db": "not_connected_yet", "worker": "active"}
+    return {"status": "ok", "db": "not_connected_yet", "worker": "active" if settings.RUN_EMBEDDED_WORKER else "external"}
 
 from app.api.v1.api import api_router
 app.include_router(api_router, prefix="/api/v1")
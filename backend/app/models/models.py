@@ -1,8 +1,9 @@
 import uuid
-from sqlalchemy import Column, String, Boolean, DateTime, Text, Integer, ForeignKey, DECIMAL, ARRAY, Date, Uuid, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Boolean, DateTime, Text, Integer, ForeignKey, DECIMAL, ARRAY, Date, Uuid, JSON, Index, text
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from app.db.base import Base
+from app.core.phone import phone_key
 
 # ==========================================
 # Core Multi-tenant Models
@@ -35,6 +36,10 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login_at = Column(DateTime(timezone=True), nullable=True)
 
+    __table_args__ = (
+        Index("ix_users_tenant_id", "tenant_id"),
+    )
+
     tenant = relationship("Tenant", back_populates="users")
 
 
@@ -64,6 +69,7 @@ class Contact(Base):
     
     full_name = Column(String(255))
     phone_e164 = Column(String(20), nullable=False) # Unique constraint deve ser composta com tenant_id (future)
+    phone_key = Column(String(20), nullable=True) # Chave canônica (dígitos, sem o 9º dígito) - mantida pelo validates abaixo
     email = Column(String(255))
     cpf = Column(String(14))
     source = Column(String(50))
@@ -74,6 +80,22 @@ class Contact(Base):
     opt_in = Column(Boolean, default=False)
     is_opt_out = Column(Boolean, default=False)     # ⛔ Stop / Sair
     is_active = Column(Boolean, default=True)
+    assigned_instance = Column(String(100), nullable=True) # Número (instância Evolution) que falou com o contato primeiro
+
+    __table_args__ = (
+        # Telefone único por tenant (índice único: funciona igual no SQLite e no Postgres)
+        Index("uq_contacts_tenant_phone", "tenant_id", "phone_e164", unique=True),
+        # NULL não conflita no índice acima: contatos sem tenant (webhook) têm o próprio índice parcial
+        Index("uq_contacts_phone_no_tenant", "phone_e164", unique=True,
+              postgresql_where=text("tenant_id IS NULL"), sqlite_where=text("tenant_id IS NULL")),
+        Index("ix_contacts_phone_e164", "phone_e164"),
+        Index("ix_contacts_phone_key", "phone_key"),  # Webhook resolve o contato com 1 consulta
+    )
+
+    @validates("phone_e164")
+    def _sync_phone_key(self, key, value):
+        self.phone_key = phone_key(value)
+        return value
 
     # Relationships
     lead_pipeline = relationship("LeadPipeline", back_populates="contact", uselist=False)
@@ -107,6 +129,11 @@ class Conversation(Base):
     started_at = Column(DateTime(timezone=True), server_default=func.now())
     closed_at = Column(DateTime(timezone=True))
 
+    __table_args__ = (
+        Index("ix_conversations_contact_status", "contact_id", "status"),
+        Index("ix_conversations_tenant_id", "tenant_id"),
+    )
+
     contact = relationship("Contact", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation")
 
@@ -125,6 +152,17 @@ class Message(Base):
     status = Column(String(20), default='queued')
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_messages_external_id", "external_id"),
+        # Deduplicação do webhook (INSERT ... ON CONFLICT DO NOTHING). NULL não conflita no índice
+        # composto, então mensagens sem tenant têm um índice único parcial próprio.
+        Index("uq_messages_tenant_external", "tenant_id", "external_id", unique=True),
+        Index("uq_messages_external_no_tenant", "external_id", unique=True,
+              postgresql_where=text("tenant_id IS NULL"), sqlite_where=text("tenant_id IS NULL")),
+        Index("ix_messages_conversation_timestamp", "conversation_id", "timestamp"),  # Histórico do chat
+        Index("ix_messages_tenant_id", "tenant_id"),
+    )
+
     conversation = relationship("Conversation", back_populates="messages")
 
 
@@ -142,6 +180,10 @@ class Procedure(Base):
     value = Column(DECIMAL(10, 2))
     next_maintenance_date = Column(Date)
 
+    __table_args__ = (
+        Index("ix_procedures_contact_performed", "contact_id", "performed_at"),
+    )
+
     contact = relationship("Contact", back_populates="procedures")
 
 
@@ -157,9 +199,15 @@ class Campaign(Base):
     message_template = Column(Text, nullable=True)
     media_url = Column(String(500), nullable=True)
     excluded_contacts = Column(JSON, nullable=True, default=[])
+    priority = Column(Integer, default=1) # Peso no fair queuing: prioridade 5 = 5 envios para cada 1 de prioridade 1
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     scheduled_at = Column(DateTime(timezone=True), nullable=True)
 
+    __table_args__ = (
+        Index("ix_campaigns_tenant_created", "tenant_id", "created_at"),
+    )
+
     events = relationship("CampaignEvent", back_populates="campaign")
 
 
@@ -172,11 +220,40 @@ class CampaignEvent(Base):
 
     campaign_id = Column(Uuid(as_uuid=True), ForeignKey("campaigns.id"))
     contact_id = Column(Uuid(as_uuid=True), ForeignKey("contacts.id"))
-    status = Column(String(20), default='queued')
+    status = Column(String(20), default='queued') # queued, claimed, sent, failed, skipped_optout
     processed_at = Column(DateTime(timezone=True), server_default=func.now())
     sent_at = Column(DateTime(timezone=True), nullable=True)
     replied_at = Column(DateTime(timezone=True), nullable=True)
 
+    # Claim/Lease (vários dispatchers drenando a mesma fila sem envio duplicado)
+    claimed_by = Column(String(100), nullable=True)
+    claim_expires_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Retry com backoff (falhas transitórias da Evolution)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String(500), nullable=True)
+
+    # Instância (número) que efetivamente enviou
+    instance = Column(String(100), nullable=True)
+    # Orçamento da instância reservado no banco antes do envio (limites valem para todos os dispatchers)
+    reserved_at = Column(DateTime(timezone=True), nullable=True)
+    # Próximo envio permitido da instância depois deste (reserva + intervalo sorteado entre min e max)
+    next_allowed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_campaign_events_status_sent_at", "status", "sent_at"),  # Contadores de envio
+        Index("ix_campaign_events_instance_budget", "instance", "status", "reserved_at"),  # Reserva por instância
+        # 1 evento por lead na campanha: enfileiramento idempotente (anti-join + ON CONFLICT DO NOTHING)
+        Index("uq_campaign_events_campaign_contact", "campaign_id", "contact_id", unique=True),
+        Index("ix_campaign_events_contact_status", "contact_id", "status"),  # Resposta do lead -> campanha
+        # Parciais: só a fila viva, não o histórico inteiro
+        Index("ix_campaign_events_queue", "campaign_id", "processed_at",
+              postgresql_where=text("status = 'queued'"), sqlite_where=text("status = 'queued'")),
+        Index("ix_campaign_events_claims", "claim_expires_at",
+              postgresql_where=text("status = 'claimed'"), sqlite_where=text("status = 'claimed'")),
+    )
+
     campaign = relationship("Campaign", back_populates="events")
     contact = relationship("Contact")
 
@@ -236,3 +313,59 @@ class KnowledgeChunk(Base):
     chunk_index = Column(Integer)
 
     document = relationship("KnowledgeDocument", back_populates="chunks")
+
+
+class WebhookInbox(Base):
+    """Inbox durável do webhook da Evolution: grava e responde na hora, processa em background."""
+    __tablename__ = "webhook_inbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True) # Ordem de chegada
+    remote_jid = Column(String(100), nullable=False, default='') # Mensagens do mesmo contato: em ordem
+    event = Column(String(50), nullable=True)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), default='pending') # pending, processing, done, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(500), nullable=True)
+    claimed_by = Column(String(100), nullable=True)
+    claim_expires_at = Column(DateTime(timezone=True), nullable=True)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_webhook_inbox_pending", "id", postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+        Index("ix_webhook_inbox_jid_status", "remote_jid", "status"),
+        # Leases em andamento: conferência do claim (SQLite) e devolução dos vencidos
+        Index("ix_webhook_inbox_claims", "claim_expires_at",
+              postgresql_where=text("status = 'processing'"), sqlite_where=text("status = 'processing'")),
+    )
+
+
+class AIReplyJob(Base):
+    """Resposta da IA como job: fora do webhook, com pool próprio, limite por tenant e timeout."""
+    __tablename__ = "ai_reply_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tenant_id = Column(Uuid(as_uuid=True), ForeignKey("tenants.id"), nullable=True)
+    conversation_id = Column(Uuid(as_uuid=True), ForeignKey("conversations.id"), nullable=False)
+    contact_id = Column(Uuid(as_uuid=True), ForeignKey("contacts.id"), nullable=False)
+    instance = Column(String(100), nullable=True) # Número que recebeu a mensagem (responde pelo mesmo)
+
+    status = Column(String(20), default='pending') # pending, running, sending, done, skipped, cancelled, failed
+    messages = Column(Integer, default=1) # Mensagens do lead agrupadas nesta resposta (debounce)
+    first_message_at = Column(DateTime(timezone=True), nullable=True)
+    run_after = Column(DateTime(timezone=True), nullable=True) # Fim da janela de silêncio
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(500), nullable=True)
+    claimed_by = Column(String(100), nullable=True)
+    claim_expires_at = Column(DateTime(timezone=True), nullable=True) # Timeout do job
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True) # Tokens do prompt (OpenAI; estimativa se não informado)
+
+    __table_args__ = (
+        Index("ix_ai_reply_jobs_due", "run_after", postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+        Index("ix_ai_reply_jobs_conversation_status", "conversation_id", "status"),
+        Index("ix_ai_reply_jobs_tenant_status", "tenant_id", "status"),
+    )
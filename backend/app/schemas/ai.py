@@ -1,5 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime
+from uuid import UUID
 
 class AIConfigBase(BaseModel):
     is_active: bool = False
@@ -18,3 +20,23 @@ class AIConfigSchema(AIConfigBase):
     
     class Config:
         from_attributes = True
+
+class AIReplyJobSchema(BaseModel):
+    id: int
+    tenant_id: Optional[UUID] = None
+    conversation_id: UUID
+    contact_id: UUID
+    instance: Optional[str] = None
+    status: str
+    messages: Optional[int] = None
+    attempts: Optional[int] = None
+    last_error: Optional[str] = None
+    run_after: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+
+    class Config:
+        from_attributes = True
@@ -23,6 +23,7 @@ class CampaignBase(BaseModel):
     media_url: Optional[str] = None
     excluded_contacts: Optional[List[str]] = []
     scheduled_at: Optional[datetime] = None
+    priority: Optional[int] = 1
 
 class CampaignCreate(CampaignBase):
     pass
@@ -34,6 +35,7 @@ class CampaignUpdate(BaseModel):
     media_url: Optional[str] = None
     excluded_contacts: Optional[List[str]] = None
     scheduled_at: Optional[datetime] = None
+    priority: Optional[int] = None
 
 class CampaignSchema(CampaignBase):
     id: UUID
@@ -0,0 +1,484 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql import func
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.models import AIReplyJob, Contact, Conversation, LeadPipeline, Message
+from app.services.ai_service import ai_service
+from app.services.evolution_service import evolution_service
+from app.services.webhook_cache import webhook_cache
+from app.services import retry_policy
+
+# Estágios em que a IA não responde mais (mesma regra do webhook)
+STOPPED_STAGES = ('agendado', 'perdido', 'bloqueado')
+
+# Job ocupando o tenant/conversa (conta no limite por tenant)
+ACTIVE_STATUSES = ('running', 'sending')
+FINISHED_STATUSES = ('done', 'skipped', 'cancelled', 'failed')
+
+# Espera antes de tentar de novo um job que falhou (multiplicada pela tentativa)
+RETRY_DELAY_SECONDS = 5
+
+# Limpeza de jobs finalizados antigos (no máximo a cada 10 min)
+PURGE_INTERVAL_SECONDS = 600
+
+
+class SendError(Exception):
+    """Envio da resposta pela Evolution falhou; `retryable` vem da classificação do retry_policy."""
+    def __init__(self, failure: retry_policy.SendFailure):
+        super().__init__(str(failure))
+        self.retryable = failure.retryable
+
+
+class AIReplyScheduler:
+    """
+    Respostas da IA como jobs (AIReplyJob), fora do caminho do webhook.
+    - Debounce: cada mensagem do lead adia o job pendente da conversa (janela de AI_REPLY_DEBOUNCE_SECONDS,
+      limitada por AI_REPLY_MAX_WAIT_SECONDS); a rajada inteira vira UMA chamada à IA.
+    - Um feeder reserva jobs vencidos e entrega a um pool de AI_REPLY_WORKERS threads.
+      Nunca reserva mais que AI_REPLY_MAX_PER_TENANT jobs em andamento por tenant (contados no banco,
+      vale para todos os processos; entre processos o limite é aproximado) nem dois da mesma conversa.
+    - Timeout (AI_REPLY_TIMEOUT_SECONDS): o envio só acontece se o job ainda estiver dentro do prazo
+      (UPDATE condicional para 'sending'). Resposta atrasada é descartada e o job vira 'failed'.
+    - Resposta humana cancela o job pendente (ou em andamento: a resposta gerada não é enviada).
+    - Falha da IA nunca vira mensagem para o lead; falha da IA ou do envio (retry_policy) vira nova
+      tentativa (até AI_REPLY_MAX_ATTEMPTS) ou 'failed'. A mensagem só é gravada com envio confirmado.
+    - Durável: jobs pendentes sobrevivem a restart; com AI_REPLY_WORKERS=0 o processo só enfileira.
+    """
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._feeder = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_purge = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._feeder and self._feeder.is_alive())
+
+    def start(self):
+        if self.running or settings.AI_REPLY_WORKERS <= 0:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=settings.AI_REPLY_WORKERS, thread_name_prefix="ai-reply")
+        self._feeder = threading.Thread(target=self.run, name="ai-reply-feeder", daemon=True)
+        self._feeder.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._feeder:
+            self._feeder.join(timeout)
+        if self._executor:
+            # Não espera a IA: o que não chegou em 'sending' volta para a fila e a resposta tardia é descartada
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        db = SessionLocal()
+        try:
+            self.release(db, claimed_by=self.worker_id)
+        finally:
+            db.close()
+
+    def notify(self):
+        """Job novo (ou adiado) na fila."""
+        self._wake.set()
+
+    # ---------- Fila ----------
+
+    def schedule(self, db: Session, conversation_id, tenant_id=None, contact_id=None,
+                 instance_name: str = None) -> AIReplyJob:
+        """
+        Mensagem do lead que pede resposta: cria ou adia o job pendente da conversa.
+        Roda na transação do chamador (o job nasce junto com a mensagem); chame notify() depois do commit.
+        """
+        now = datetime.now()
+        job = db.query(AIReplyJob).filter(
+            AIReplyJob.conversation_id == conversation_id,
+            AIReplyJob.status == 'pending'
+        ).order_by(AIReplyJob.id.desc()).first()
+
+        if job is None:
+            job = AIReplyJob(
+                tenant_id=tenant_id,
+                conversation_id=conversation_id,
+                contact_id=contact_id,
+                instance=instance_name,
+                status='pending',
+                messages=1,
+                attempts=0,
+                first_message_at=now
+            )
+            db.add(job)
+        else:
+            job.messages = (job.messages or 0) + 1
+            job.instance = instance_name or job.instance
+
+        debounce = max(settings.AI_REPLY_DEBOUNCE_SECONDS, 0)
+        job.run_after = min(now + timedelta(seconds=debounce),
+                            (job.first_message_at or now) + timedelta(seconds=settings.AI_REPLY_MAX_WAIT_SECONDS))
+        return job
+
+    def cancel(self, db: Session, conversation_id) -> int:
+        """Humano respondeu: cancela o job da conversa (na transação do chamador)."""
+        cancelled = db.query(AIReplyJob).filter(
+            AIReplyJob.conversation_id == conversation_id,
+            AIReplyJob.status.in_(('pending', 'running'))
+        ).update({
+            AIReplyJob.status: 'cancelled',
+            AIReplyJob.finished_at: datetime.now(),
+            AIReplyJob.last_error: 'atendente respondeu'
+        }, synchronize_session=False)
+        if cancelled:
+            logging.info("🙋 Resposta da IA cancelada: atendente respondeu antes.")
+        return cancelled
+
+    def is_sending(self, db: Session, conversation_id) -> bool:
+        """Resposta da IA da conversa sendo enviada agora (o eco fromMe pode chegar antes de ela ser gravada)."""
+        return db.query(exists().where(
+            AIReplyJob.conversation_id == conversation_id,
+            AIReplyJob.status == 'sending'
+        )).scalar()
+
+    # ---------- Feeder ----------
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            db = SessionLocal()
+            claimed = []
+            next_due = None
+            try:
+                self.expire(db)
+                self._purge(db)
+                with self._lock:
+                    free = settings.AI_REPLY_WORKERS - self._active
+                if free > 0:
+                    claimed = self.claim(db, limit=free)
+                for job_id in claimed:
+                    with self._lock:
+                        self._active += 1
+                    self._executor.submit(self._execute, job_id)
+                next_due = db.query(func.min(AIReplyJob.run_after)).filter(AIReplyJob.status == 'pending').scalar()
+            except Exception as e:
+                print(f"AI Reply Worker Error: {e}")
+            finally:
+                db.close()
+
+            if not claimed:
+                wait = settings.AI_REPLY_POLL_SECONDS
+                if isinstance(next_due, datetime):
+                    # Job vencido que não foi reservado = tenant/conversa ocupados: o fim do job acorda o feeder
+                    delay = (next_due - datetime.now()).total_seconds()
+                    if delay > 0:
+                        wait = min(wait, delay)
+                self._wake.wait(wait)
+
+    def claim(self, db: Session, limit: int) -> list:
+        """
+        Reserva até `limit` jobs vencidos (run_after mais antigo primeiro), respeitando
+        AI_REPLY_MAX_PER_TENANT e pulando conversas que já têm job em andamento.
+        """
+        now = datetime.now()
+        running_by_tenant = dict(db.query(AIReplyJob.tenant_id, func.count(AIReplyJob.id)).filter(
+            AIReplyJob.status.in_(ACTIVE_STATUSES)
+        ).group_by(AIReplyJob.tenant_id).all())
+
+        busy = aliased(AIReplyJob)
+        candidates = select(AIReplyJob.id, AIReplyJob.tenant_id).where(
+            AIReplyJob.status == 'pending',
+            AIReplyJob.run_after <= now,
+            ~exists().where(busy.conversation_id == AIReplyJob.conversation_id, busy.status.in_(ACTIVE_STATUSES))
+        ).order_by(AIReplyJob.run_after.asc()).limit(limit * 8)
+        if db.get_bind().dialect.name == "postgresql":
+            candidates = candidates.with_for_update(skip_locked=True, of=AIReplyJob)
+
+        chosen = []
+        for job_id, tenant_id in db.execute(candidates).all():
+            if running_by_tenant.get(tenant_id, 0) >= settings.AI_REPLY_MAX_PER_TENANT:
+                continue # Tenant no limite: fica para quando liberar
+            running_by_tenant[tenant_id] = running_by_tenant.get(tenant_id, 0) + 1
+            chosen.append(job_id)
+            if len(chosen) >= limit:
+                break
+
+        claimed = []
+        expires_at = now + timedelta(seconds=settings.AI_REPLY_TIMEOUT_SECONDS)
+        for job_id in chosen:
+            updated = db.query(AIReplyJob).filter(
+                AIReplyJob.id == job_id,
+                AIReplyJob.status == 'pending'
+            ).update({
+                AIReplyJob.status: 'running',
+                AIReplyJob.claimed_by: self.worker_id,
+                AIReplyJob.claim_expires_at: expires_at,
+                AIReplyJob.started_at: now
+            }, synchronize_session=False)
+            if updated:
+                claimed.append(job_id)
+        db.commit()
+        return claimed
+
+    def expire(self, db: Session) -> int:
+        """Jobs que passaram de AI_REPLY_TIMEOUT_SECONDS (ou cujo processo caiu) viram 'failed'."""
+        now = datetime.now()
+        expired = db.query(AIReplyJob).filter(
+            AIReplyJob.status.in_(ACTIVE_STATUSES),
+            AIReplyJob.claim_expires_at < now
+        ).update({
+            AIReplyJob.status: 'failed',
+            AIReplyJob.last_error: 'timeout',
+            AIReplyJob.finished_at: now
+        }, synchronize_session=False)
+        db.commit()
+        if expired:
+            logging.warning(f"⏱️ {expired} resposta(s) da IA passaram do prazo ({settings.AI_REPLY_TIMEOUT_SECONDS}s).")
+        return expired
+
+    def release(self, db: Session, claimed_by: str) -> int:
+        """No stop: jobs deste processo que ainda não começaram a enviar voltam para a fila."""
+        released = db.query(AIReplyJob).filter(
+            AIReplyJob.status == 'running',
+            AIReplyJob.claimed_by == claimed_by
+        ).update({
+            AIReplyJob.status: 'pending',
+            AIReplyJob.claimed_by: None,
+            AIReplyJob.claim_expires_at: None,
+            AIReplyJob.started_at: None
+        }, synchronize_session=False)
+        db.commit()
+        if released:
+            logging.warning(f"♻️ {released} resposta(s) da IA voltaram para a fila.")
+        return released
+
+    def _purge(self, db: Session):
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = datetime.now() - timedelta(hours=settings.AI_REPLY_RETENTION_HOURS)
+        deleted = db.query(AIReplyJob).filter(
+            AIReplyJob.status.in_(FINISHED_STATUSES),
+            AIReplyJob.finished_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        if deleted:
+            logging.info(f"🧹 {deleted} job(s) antigos de resposta da IA removidos.")
+
+    # ---------- Execução ----------
+
+    def _execute(self, job_id: int):
+        try:
+            self.process(job_id)
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._wake.set() # Slot livre (e a conversa/tenant também)
+
+    def process(self, job_id: int):
+        started = time.monotonic()
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            job = db.get(AIReplyJob, job_id)
+            if not job or job.status != 'running' or job.claimed_by != self.worker_id:
+                return
+            if job.messages and job.messages > 1:
+                logging.info(f"🤖 {job.messages} mensagens agrupadas em 1 resposta da IA.")
+            usage = {}
+            try:
+                status, reason = self.reply(db, job, usage)
+            except Exception as e:
+                db.rollback()
+                logging.exception(f"❌ Erro na resposta da IA (job {job_id}): {e}")
+                self._retry_or_fail(db, job_id, e)
+                return
+
+            if status is None:
+                print(f"🕒 Resposta da IA descartada (job {job_id}): {reason}.")
+                return
+            self._finish(db, job_id, status, reason, started,
+                         prompt_tokens=usage.get("prompt_tokens") or usage.get("prompt_tokens_estimate"))
+        except Exception as e:
+            print(f"AI Reply Worker Error (job {job_id}): {e}")
+        finally:
+            db.close()
+
+    def reply(self, db: Session, job: AIReplyJob, usage: Optional[dict] = None):
+        """
+        Gera a resposta da IA, envia pelo WhatsApp e registra. Revalida o lead (pode ter mudado na espera).
+        Retorna (status, motivo); status None = resposta descartada (cancelada ou fora do prazo).
+        `usage` recebe os tokens do prompt (ai_service).
+        """
+        conversation = db.get(Conversation, job.conversation_id)
+        contact = db.get(Contact, conversation.contact_id) if conversation else None
+        if not contact:
+            return 'skipped', 'contato não encontrado'
+        if contact.is_opt_out:
+            return 'skipped', 'opt-out'
+        pipeline = db.query(LeadPipeline).filter(LeadPipeline.contact_id == contact.id).first()
+        if pipeline and pipeline.stage in STOPPED_STAGES:
+            print(f"🛡️ Lead {contact.full_name} em '{pipeline.stage}'. IA Pausada.")
+            return 'skipped', f"estágio {pipeline.stage}"
+        ai_config = webhook_cache.ai_config(db, contact.tenant_id)
+        if not ai_config or not ai_config.is_active:
+            return 'skipped', 'IA desativada'
+
+        print(f"🤖 Acionando IA para {contact.full_name}...")
+        # Carregar histórico (o context_builder decide quanto cabe no orçamento de tokens)
+        history_objs = db.query(Message).filter(
+            Message.conversation_id == conversation.id
+        ).order_by(Message.timestamp.desc()).limit(settings.AI_CONTEXT_HISTORY_LIMIT).all()
+
+        history = []
+        for m in reversed(history_objs): # Reverte para ordem cronológica (antiga -> nova)
+            role = "user" if m.direction == 'inbound' else "assistant"
+            content = m.content or ""
+            # Ignorar mensagens de sistema/mídia complexa na entrada do prompt por enquanto
+            if content:
+                history.append({"role": role, "content": content})
+
+        # Gerar Resposta
+        # Injetar contexto de nome atual
+        current_prompt = f"{ai_config.system_prompt}\n\nDADO DO SISTEMA: O nome atual deste contato é '{contact.full_name}'."
+
+        instance = job.instance or contact.assigned_instance
+        phone = contact.phone_e164
+        response_text = ai_service.generate_response(
+            history=history,
+            system_prompt=current_prompt,
+            db=db,
+            contact_id=contact.id,
+            # 'digitando...' assim que a OpenAI começa a responder (streaming)
+            on_first_token=lambda: evolution_service.send_presence_async(phone, instance=instance),
+            usage=usage
+        )
+
+        if not response_text:
+            return 'skipped', 'IA sem resposta'
+
+        # Vez de enviar: só se o job ainda é deste processo, não foi cancelado e está no prazo
+        if not self._take_send_turn(db, job.id):
+            return None, 'cancelada ou fora do prazo'
+
+        # Enviar via WhatsApp (falha transitória: nova tentativa do job; permanente: 'failed')
+        result = evolution_service.send_message(phone, response_text, instance=instance)
+        failure = retry_policy.classify_result(result)
+        if failure:
+            raise SendError(failure)
+
+        # Envio confirmado. Salvar no Banco com o id da Evolution: o eco (fromMe) que volta pelo webhook vira duplicata
+        # e não é confundido com resposta humana. Eco que chega antes disto: o job ainda está em
+        # 'sending' (só muda no _finish) e o webhook não o trata como atendente (is_sending)
+        sent_id = ((result or {}).get("key") or {}).get("id") if isinstance(result, dict) else None
+        ai_msg = Message(
+            tenant_id=contact.tenant_id,
+            conversation_id=conversation.id,
+            external_id=sent_id or f"ai-{uuid.uuid4().hex}",
+            direction='outbound',
+            content=response_text,
+            content_type='text',
+            status='sent',
+            timestamp=func.now()
+        )
+        db.add(ai_msg)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback() # O eco chegou antes: a mensagem já está gravada
+        print(f"🤖 Resposta IA enviada: {response_text[:30]}...")
+        return 'done', None
+
+    def _take_send_turn(self, db: Session, job_id: int) -> bool:
+        taken = db.query(AIReplyJob).filter(
+            AIReplyJob.id == job_id,
+            AIReplyJob.status == 'running',
+            AIReplyJob.claimed_by == self.worker_id,
+            AIReplyJob.claim_expires_at > datetime.now()
+        ).update({AIReplyJob.status: 'sending'}, synchronize_session=False)
+        db.commit()
+        return bool(taken)
+
+    def _finish(self, db: Session, job_id: int, status: str, reason: Optional[str], started: float,
+                prompt_tokens: Optional[int] = None):
+        # Enviada vence o 'timeout' marcado enquanto a Evolution respondia: a mensagem saiu
+        current = ACTIVE_STATUSES + ('failed',) if status == 'done' else ACTIVE_STATUSES
+        db.query(AIReplyJob).filter(
+            AIReplyJob.id == job_id,
+            AIReplyJob.claimed_by == self.worker_id,
+            AIReplyJob.status.in_(current)
+        ).update({
+            AIReplyJob.status: status,
+            AIReplyJob.last_error: reason,
+            AIReplyJob.finished_at: datetime.now(),
+            AIReplyJob.duration_ms: int((time.monotonic() - started) * 1000),
+            AIReplyJob.prompt_tokens: prompt_tokens,
+            AIReplyJob.claimed_by: None,
+            AIReplyJob.claim_expires_at: None
+        }, synchronize_session=False)
+        db.commit()
+
+    def _retry_or_fail(self, db: Session, job_id: int, error: Exception):
+        job = db.get(AIReplyJob, job_id)
+        # 'sending' = a Evolution recusou o envio (a mensagem não saiu)
+        if not job or job.status not in ACTIVE_STATUSES or job.claimed_by != self.worker_id:
+            return # Cancelado/expirado enquanto rodava
+        job.attempts = (job.attempts or 0) + 1
+        job.last_error = str(error)[:500]
+        job.claimed_by = None
+        job.claim_expires_at = None
+        # Sem API key / requisição rejeitada / número inválido: tentar de novo não adianta
+        if job.attempts >= settings.AI_REPLY_MAX_ATTEMPTS or not getattr(error, "retryable", True):
+            job.status = 'failed'
+            job.finished_at = datetime.now()
+        else:
+            job.status = 'pending'
+            job.started_at = None
+            job.run_after = datetime.now() + timedelta(seconds=RETRY_DELAY_SECONDS * job.attempts)
+        db.commit()
+
+    # ---------- Status ----------
+
+    def stats(self, db: Session) -> dict:
+        by_status = dict(db.query(AIReplyJob.status, func.count(AIReplyJob.id)).group_by(AIReplyJob.status).all())
+        running_by_tenant = {
+            str(tenant_id) if tenant_id else "global": count
+            for tenant_id, count in db.query(AIReplyJob.tenant_id, func.count(AIReplyJob.id)).filter(
+                AIReplyJob.status.in_(ACTIVE_STATUSES)
+            ).group_by(AIReplyJob.tenant_id).all()
+        }
+        avg_ms, avg_tokens = db.query(
+            func.avg(AIReplyJob.duration_ms), func.avg(AIReplyJob.prompt_tokens)
+        ).filter(AIReplyJob.status == 'done').one()
+        oldest_due = db.query(func.min(AIReplyJob.run_after)).filter(AIReplyJob.status == 'pending').scalar()
+        lag = None
+        if isinstance(oldest_due, datetime):
+            lag = max(round((datetime.now() - oldest_due).total_seconds(), 1), 0)
+        with self._lock:
+            active = self._active
+        return {
+            "by_status": by_status,
+            "running_by_tenant": running_by_tenant,
+            "avg_duration_ms": int(avg_ms) if avg_ms is not None else None,
+            "avg_prompt_tokens": int(avg_tokens) if avg_tokens is not None else None,
+            "oldest_due_lag_seconds": lag,
+            "worker": {
+                "id": self.worker_id,
+                "running": self.running,
+                "active": active,
+                "workers": settings.AI_REPLY_WORKERS,
+                "max_per_tenant": settings.AI_REPLY_MAX_PER_TENANT,
+                "timeout_seconds": settings.AI_REPLY_TIMEOUT_SECONDS
+            }
+        }
+
+ai_reply_scheduler = AIReplyScheduler()
@@ -1,24 +1,194 @@
 import requests
 import logging
 import json
-from typing import List, Dict, Optional, Any
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from typing import Callable, List, Dict, Optional, Any
 from app.core.config import settings
+from app.services.context_builder import context_builder
+
+# Regras sempre anexadas ao prompt do sistema (tools)
+HIDDEN_RULES = """
+        
+[SISTEMA - REGRAS OCULTAS]:
+1. Se o usuário informar o nome dele, use a ferramenta 'update_contact_name'.
+2. Se o usuário quiser AGENDAR, falar com ATENDENTE/HUMANO ou se você não souber responder algo complexo, use a ferramenta 'transfer_to_human'. Ao usar essa ferramenta, avise o cliente que você está transferindo (ex: 'Vou transferir para nossa atendente humana').
+"""
+
+# Respostas que valem nova tentativa (limite de taxa / instabilidade da OpenAI)
+RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+
+
+class OpenAIError(Exception):
+    """
+    Falha ao gerar a resposta. Nunca vira texto para o lead: quem chama decide (nova tentativa ou 'failed').
+    retryable=False: tentar de novo não adianta (sem API key, requisição rejeitada).
+    """
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = True):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Espera pedida pela OpenAI: retry-after-ms, Retry-After em segundos ou data HTTP."""
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
 
 class AIService:
     def __init__(self):
         self.api_key = settings.OPENAI_API_KEY
         self.model = settings.AI_MODEL
-        self.api_url = "https://api.openai.com/v1/chat/completions"
+        self.api_url = settings.OPENAI_API_URL
+        self.session = self._build_session()
+
+    def _build_session(self) -> requests.Session:
+        """Sessão HTTP com pool keep-alive: sem handshake TLS novo a cada resposta da IA."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(settings.OPENAI_POOL_SIZE, 1))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        return session
+
+    def _complete(self, payload: dict, headers: dict, on_first_token: Optional[Callable[[], None]] = None) -> tuple:
+        """
+        Chama /chat/completions e devolve (message do assistente, usage).
+        - 429/5xx/falha de conexão: nova tentativa (até OPENAI_MAX_RETRIES), respeitando Retry-After;
+          sem o header, backoff exponencial com jitter. Espera limitada a OPENAI_RETRY_MAX_WAIT_SECONDS.
+        - OPENAI_STREAM: lê a resposta em SSE e chama on_first_token no primeiro pedaço.
+        """
+        stream = settings.OPENAI_STREAM
+        body = dict(payload, stream=True, stream_options={"include_usage": True}) if stream else payload
+        timeout = (settings.OPENAI_CONNECT_TIMEOUT, settings.OPENAI_READ_TIMEOUT)
+        attempt = 0
+        while True:
+            wait = None
+            try:
+                response = self.session.post(self.api_url, json=body, headers=headers, timeout=timeout, stream=stream)
+                try:
+                    if response.status_code == 200:
+                        if stream:
+                            return self._read_stream(response, on_first_token)
+                        data = response.json()
+                        return data['choices'][0]['message'], data.get('usage')
+                    retryable = response.status_code in RETRY_STATUSES
+                    error = OpenAIError(f"HTTP {response.status_code}: {response.text[:300]}", response.status_code, retryable)
+                    if not retryable:
+                        raise error
+                    wait = retry_after_seconds(response)
+                finally:
+                    response.close() # Devolve a conexão ao pool
+            except requests.RequestException as e:
+                error = OpenAIError(f"Conexão: {e}")
+
+            if attempt >= settings.OPENAI_MAX_RETRIES:
+                raise error
+            if wait is None:
+                wait = settings.OPENAI_RETRY_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.0)
+            wait = min(max(wait, 0), settings.OPENAI_RETRY_MAX_WAIT_SECONDS)
+            attempt += 1
+            logging.warning(f"⏳ OpenAI {error} — tentativa {attempt}/{settings.OPENAI_MAX_RETRIES} em {wait:.1f}s")
+            time.sleep(wait)
+
+    def _chat(self, payload: dict, headers: dict, on_first_token: Optional[Callable[[], None]] = None,
+              usage: Optional[dict] = None) -> dict:
+        """_complete + acumula os tokens informados pela OpenAI em `usage`."""
+        message, reported = self._complete(payload, headers, on_first_token)
+        if usage is not None:
+            usage["calls"] = usage.get("calls", 0) + 1
+            if reported:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + (reported.get("prompt_tokens") or 0)
+                usage["completion_tokens"] = usage.get("completion_tokens", 0) + (reported.get("completion_tokens") or 0)
+                logging.info(f"📏 OpenAI: prompt_tokens={reported.get('prompt_tokens')} completion_tokens={reported.get('completion_tokens')}")
+        return message
+
+    @staticmethod
+    def _read_stream(response: requests.Response, on_first_token: Optional[Callable[[], None]] = None) -> tuple:
+        """Remonta a 'message' a partir dos deltas SSE (texto e tool_calls em pedaços) + usage do último pedaço."""
+        content = []
+        tool_calls = {}  # index -> tool_call
+        usage = None
+        first = True
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if chunk.get('usage'):
+                usage = chunk['usage']
+            if not chunk.get('choices'):
+                continue
+            delta = chunk['choices'][0].get('delta') or {}
+            if first and (delta.get('content') or delta.get('tool_calls')):
+                first = False
+                if on_first_token:
+                    try:
+                        on_first_token()
+                    except Exception as e:
+                        logging.warning(f"⚠️ on_first_token falhou: {e}")
+            if delta.get('content'):
+                content.append(delta['content'])
+            for part in delta.get('tool_calls') or []:
+                call = tool_calls.setdefault(part.get('index', 0), {
+                    "id": None, "type": "function", "function": {"name": "", "arguments": ""}
+                })
+                if part.get('id'):
+                    call['id'] = part['id']
+                fn = part.get('function') or {}
+                call['function']['name'] += fn.get('name') or ""
+                call['function']['arguments'] += fn.get('arguments') or ""
+
+        message = {"role": "assistant", "content": "".join(content) or None}
+        if tool_calls:
+            message['tool_calls'] = [tool_calls[i] for i in sorted(tool_calls)]
+        return message, usage
 
     def generate_response(self, 
                           history: List[Dict[str, str]], 
                           system_prompt: str = "Você é um assistente útil.",
                           db: Any = None,
-                          contact_id: str = None) -> str:
-        
+                          contact_id: str = None,
+                          on_first_token: Optional[Callable[[], None]] = None,
+                          usage: Optional[dict] = None) -> Optional[str]:
+        """
+        Resposta da IA (com RAG e tools). on_first_token é chamado uma vez, quando a OpenAI
+        começa a responder (ex: mostrar 'digitando...' no WhatsApp).
+        Falha (sem API key, OpenAI fora após as tentativas) levanta OpenAIError: nada de texto de erro
+        para o lead. None = a IA não devolveu texto.
+        `usage` (opcional) recebe os tokens do prompt: estimativa do context_builder e o
+        informado pela OpenAI (somando as chamadas, se houver tool).
+        """
+        if on_first_token:
+            callback, fired = on_first_token, []
+            def on_first_token():
+                if not fired:
+                    fired.append(True)
+                    callback()
+
         if not self.api_key:
-            logging.warning("⚠️ OpenAI API Key ausente.")
-            return "Erro: IA não configurada."
+            raise OpenAIError("IA não configurada (OPENAI_API_KEY ausente).", retryable=False)
 
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -26,7 +196,7 @@ class AIService:
         }
         
         # RAG: BUSCA DE CONHECIMENTO
-        rag_context = ""
+        rag_results = []
         last_user_msg = next((m['content'] for m in reversed(history) if m.get('role') == 'user'), None)
         
         if last_user_msg and db and contact_id:
@@ -37,31 +207,10 @@ class AIService:
                 if contact and contact.tenant_id:
                     from app.services.knowledge_service import knowledge_service
                     # Busca chunks relevantes
-                    results = knowledge_service.search(db, last_user_msg, contact.tenant_id, limit=3, threshold=0.4)
-                    
-                    if results:
-                        rag_context = "\n\n### BASE DE CONHECIMENTO (Use estas informações para responder):\n"
-                        for item in results:
-                            rag_context += f"- (Fonte: {item['document_title']}): {item['chunk_text'][:500]}...\n"
-                        rag_context += "\n### FIM DO CONHECIMENTO\n"
-                        logging.info(f"🧠 RAG: Inserindo {len(results)} chunks no contexto.")
+                    rag_results = knowledge_service.search(db, last_user_msg, contact.tenant_id, limit=3, threshold=0.4)
             except Exception as e:
                 logging.error(f"RAG Error: {e}")
 
-        # INJECT RULES & CONTEXT
-        system_prompt_enhanced = system_prompt + rag_context + """
-        
-[SISTEMA - REGRAS OCULTAS]:
-1. Se o usuário informar o nome dele, use a ferramenta 'update_contact_name'.
-2. Se o usuário quiser AGENDAR, falar com ATENDENTE/HUMANO ou se você não souber responder algo complexo, use a ferramenta 'transfer_to_human'. Ao usar essa ferramenta, avise o cliente que você está transferindo (ex: 'Vou transferir para nossa atendente humana').
-"""
-        
-        messages = [{"role": "system", "content": system_prompt_enhanced}]
-        
-        for msg in history:
-            if msg.get('role') in ['user', 'assistant', 'system', 'tool']:
-                messages.append(msg)
-        
         # DEFINIÇÃO DAS TOOLS
         tools = [
             {
@@ -90,6 +239,21 @@ class AIService:
             }
         ]
 
+        # INJECT RULES & CONTEXT (dentro do orçamento de tokens do modelo)
+        context = context_builder.build(
+            self.model, system_prompt, HIDDEN_RULES,
+            history=history,
+            rag_chunks=rag_results,
+            reserved_tokens=context_builder.counter(self.model).count(json.dumps(tools, ensure_ascii=False))
+        )
+        messages = context.messages
+        if context.rag_used:
+            logging.info(f"🧠 RAG: Inserindo {context.rag_used} chunks no contexto.")
+        logging.info(f"📏 {context.summary()}")
+        if usage is not None:
+            usage.update(prompt_tokens_estimate=context.prompt_tokens, prompt_tokens=0, completion_tokens=0,
+                         calls=0, context=context.as_dict())
+
         payload = {
             "model": self.model,
             "messages": messages,
@@ -99,81 +263,66 @@ class AIService:
             "tool_choice": "auto"
         }
         
-        try:
-            logging.info(f"🤖 IA Check (Tools Enabled)...")
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=20)
+        logging.info(f"🤖 IA Check (Tools Enabled)...")
+        message = self._chat(payload, headers, on_first_token, usage)
+        
+        # CHECK TOOL CALLS
+        if message.get('tool_calls'):
+            tool_call = message['tool_calls'][0]
+            fn_name = tool_call['function']['name']
+            fn_args = json.loads(tool_call['function']['arguments'])
+            
+            logging.info(f"🛠️ IA solicitou função: {fn_name} com {fn_args}")
+            
+            tool_result = "Função executada com sucesso."
             
-            if response.status_code != 200:
-                logging.error(f"❌ Erro OpenAI: {response.text}")
-                return "Desculpe, instabilidade momentânea."
+            # --- UPDATE NAME ---
+            if fn_name == 'update_contact_name':
+                if db and contact_id:
+                    try:
+                        from app.models.models import Contact
+                        contact = db.query(Contact).filter(Contact.id == contact_id).first()
+                        if contact:
+                            contact.full_name = fn_args.get('name')
+                            db.commit()
+                            tool_result = f"Nome salvo: {contact.full_name}"
+                    except Exception as e:
+                        tool_result = f"Erro: {str(e)}"
+            
+            # --- TRANSFER TO HUMAN ---
+            elif fn_name == 'transfer_to_human':
+                if db and contact_id:
+                    try:
+                        from app.models.models import LeadPipeline
+                        import uuid
+                        cid = contact_id
+                        if isinstance(cid, str):
+                            try: cid = uuid.UUID(cid)
+                            except: pass
+
+                        pipeline = db.query(LeadPipeline).filter(LeadPipeline.contact_id == cid).first()
+                        if pipeline:
+                            pipeline.stage = 'agendado' # Mapeado para 'RESPONDER MANUAL' no frontend
+                            db.commit()
+                            tool_result = "Lead movido para 'Responder Manual' (agendado). A IA irá parar de responder agora."
+                            logging.info("✅ Lead transferido para HUMANO.")
+                    except Exception as e:
+                        tool_result = f"Erro ao transferir: {str(e)}"
 
-            data = response.json()
-            message = data['choices'][0]['message']
+            # Loop de resposta
+            messages.append(message)
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call['id'],
+                "content": tool_result
+            })
             
-            # CHECK TOOL CALLS
-            if message.get('tool_calls'):
-                tool_call = message['tool_calls'][0]
-                fn_name = tool_call['function']['name']
-                fn_args = json.loads(tool_call['function']['arguments'])
-                
-                logging.info(f"🛠️ IA solicitou função: {fn_name} com {fn_args}")
-                
-                tool_result = "Função executada com sucesso."
-                
-                # --- UPDATE NAME ---
-                if fn_name == 'update_contact_name':
-                    if db and contact_id:
-                        try:
-                            from app.models.models import Contact
-                            contact = db.query(Contact).filter(Contact.id == contact_id).first()
-                            if contact:
-                                contact.full_name = fn_args.get('name')
-                                db.commit()
-                                tool_result = f"Nome salvo: {contact.full_name}"
-                        except Exception as e:
-                            tool_result = f"Erro: {str(e)}"
-                
-                # --- TRANSFER TO HUMAN ---
-                elif fn_name == 'transfer_to_human':
-                    if db and contact_id:
-                        try:
-                            from app.models.models import LeadPipeline
-                            import uuid
-                            cid = contact_id
-                            if isinstance(cid, str):
-                                try: cid = uuid.UUID(cid)
-                                except: pass
-
-                            pipeline = db.query(LeadPipeline).filter(LeadPipeline.contact_id == cid).first()
-                            if pipeline:
-                                pipeline.stage = 'agendado' # Mapeado para 'RESPONDER MANUAL' no frontend
-                                db.commit()
-                                tool_result = "Lead movido para 'Responder Manual' (agendado). A IA irá parar de responder agora."
-                                logging.info("✅ Lead transferido para HUMANO.")
-                        except Exception as e:
-                            tool_result = f"Erro ao transferir: {str(e)}"
-
-                # Loop de resposta
-                messages.append(message)
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call['id'],
-                    "content": tool_result
-                })
-                
-                payload['messages'] = messages
-                logging.info("🤖 Re-enviando para IA gerar resposta final...")
-                
-                resp2 = requests.post(self.api_url, json=payload, headers=headers, timeout=20)
-                if resp2.status_code == 200:
-                    return resp2.json()['choices'][0]['message']['content']
-                else:
-                    return "Entendido. Transferindo."
-
-            return message['content']
-
-        except Exception as e:
-            logging.error(f"❌ Exception AI Service: {e}")
-            return "Ocorreu um erro ao processar sua solicitação."
+            payload['messages'] = messages
+            logging.info("🤖 Re-enviando para IA gerar resposta final...")
+            
+            # Falha aqui também sobe: a ação da tool já foi gravada e a nova tentativa revalida o lead
+            return self._chat(payload, headers, on_first_token, usage)['content']
+
+        return message['content']
 
 ai_service = AIService()
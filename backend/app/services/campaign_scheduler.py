@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import func
+from app.core.config import settings
+from app.core.dates import to_local_naive # scheduled_at pode vir com fuso do frontend
+from app.db.session import SessionLocal
+from app.models.models import Campaign
+from app.services.campaign_service import campaign_service
+from app.services.dispatcher_service import campaign_dispatcher
+
+# Só campanhas ainda não disparadas são agendáveis
+SCHEDULABLE_STATUS = ('draft', 'scheduled')
+
+# Marca inicial do sync (tabela vazia). Com fuso: o Postgres devolve updated_at com fuso
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class CampaignScheduler:
+    """
+    Agenda de Campaign.scheduled_at em um heap em memória.
+    Uma thread dorme exatamente até o próximo horário e então enfileira a campanha.
+    - Mesmo processo: create/update/delete chamam notify()/cancel() (incremental, sem varrer a tabela).
+    - Outro processo (API separada do worker): sync lê só campanhas com updated_at novo.
+    Exclusões feitas em outro processo são detectadas no disparo (campanha não existe mais).
+    """
+    def __init__(self):
+        self._heap = []       # (when, seq, campaign_id)
+        self._entries = {}    # campaign_id -> when vigente (entradas antigas no heap são ignoradas)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_sync_mark = None  # maior updated_at já visto (valor do banco, usado como parâmetro SQL)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.load()
+        self._thread = threading.Thread(target=self.run, name="campaign-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def load(self):
+        """Carga inicial: todas as campanhas agendadas ainda não disparadas."""
+        db = SessionLocal()
+        try:
+            campaigns = db.query(Campaign).filter(
+                Campaign.scheduled_at != None,
+                Campaign.status.in_(SCHEDULABLE_STATUS)
+            ).all()
+            for camp in campaigns:
+                self.notify(camp)
+            self._last_sync_mark = db.query(func.max(Campaign.updated_at)).scalar() or EPOCH
+            logging.info(f"⏰ Scheduler: {len(self._entries)} campanha(s) agendada(s).")
+        finally:
+            db.close()
+
+    def notify(self, campaign: Campaign):
+        """Chamado após criar/editar: (re)agenda ou remove conforme o estado atual."""
+        when = to_local_naive(campaign.scheduled_at)
+        if when and campaign.status in SCHEDULABLE_STATUS:
+            self.schedule(campaign.id, when)
+        else:
+            self.cancel(campaign.id)
+
+    def schedule(self, campaign_id, when: datetime):
+        with self._cond:
+            if self._entries.get(campaign_id) == when:
+                return
+            self._entries[campaign_id] = when
+            heapq.heappush(self._heap, (when, next(self._seq), campaign_id))
+            self._cond.notify()
+
+    def cancel(self, campaign_id):
+        with self._cond:
+            if self._entries.pop(campaign_id, None) is not None:
+                self._cond.notify()
+
+    def pending(self) -> list:
+        with self._cond:
+            return sorted((when, str(cid)) for cid, when in self._entries.items())
+
+    def run(self):
+        next_sync = datetime.now() + timedelta(seconds=settings.SCHEDULER_SYNC_SECONDS)
+        while not self._stop.is_set():
+            due = []
+            with self._cond:
+                now = datetime.now()
+                while self._heap:
+                    when, _, campaign_id = self._heap[0]
+                    if self._entries.get(campaign_id) != when:
+                        heapq.heappop(self._heap) # Entrada obsoleta (editada/cancelada)
+                        continue
+                    if when > now:
+                        break
+                    heapq.heappop(self._heap)
+                    del self._entries[campaign_id]
+                    due.append((campaign_id, when))
+
+                if not due:
+                    wake_at = next_sync
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._cond.wait(max((wake_at - now).total_seconds(), 0.05))
+
+            for campaign_id, when in due:
+                self._fire(campaign_id, when)
+
+            if datetime.now() >= next_sync:
+                self.sync_changes()
+                next_sync = datetime.now() + timedelta(seconds=settings.SCHEDULER_SYNC_SECONDS)
+
+    def sync_changes(self):
+        """Incremental: só campanhas alteradas desde o último sync (outro processo)."""
+        if self._last_sync_mark is None:
+            return self.load()
+        db = SessionLocal()
+        try:
+            # Margem de 1s: updated_at pode ter resolução de segundos (notify é idempotente)
+            since = self._last_sync_mark - timedelta(seconds=1)
+            changed = db.query(Campaign).filter(Campaign.updated_at > since).all()
+            mark = to_local_naive(self._last_sync_mark)
+            for camp in changed:
+                self.notify(camp)
+                # Compara normalizado (com/sem fuso conforme o banco); guarda o valor original
+                if camp.updated_at and to_local_naive(camp.updated_at) > mark:
+                    mark = to_local_naive(camp.updated_at)
+                    self._last_sync_mark = camp.updated_at
+        except Exception as e:
+            logging.error(f"Scheduler sync error: {e}")
+        finally:
+            db.close()
+
+    def _fire(self, campaign_id, when: datetime):
+        lateness = (datetime.now() - when).total_seconds()
+        db = SessionLocal()
+        try:
+            camp = db.query(Campaign).filter(Campaign.id == campaign_id).first()
+            # Revalida no banco: pode ter sido excluída/editada/disparada em outro processo
+            if not camp or camp.status not in SCHEDULABLE_STATUS or to_local_naive(camp.scheduled_at) != when:
+                return
+            if lateness > settings.SCHEDULER_MISFIRE_GRACE_SECONDS:
+                logging.warning(f"⏰ Campanha '{camp.name}' perdeu o horário ({when}) por {lateness:.0f}s. Ignorada.")
+                return
+
+            # Claim no banco: com vários workers, cada um tem o seu heap e só um enfileira
+            result = campaign_service.execute_campaign(db, str(campaign_id), from_status=SCHEDULABLE_STATUS)
+            if result.get("skipped"):
+                return
+            logging.info(f"⏰ Campanha agendada disparada: {result}")
+            campaign_dispatcher.wake()
+        except Exception as e:
+            logging.error(f"❌ Erro ao disparar campanha agendada {campaign_id}: {e}")
+        finally:
+            db.close()
+
+campaign_scheduler = CampaignScheduler()
@@ -1,15 +1,34 @@
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, not_, func
+from sqlalchemy import and_, or_, not_, func, select, insert, exists, literal, case, text, Uuid, DateTime
 from app.models.models import Contact, LeadPipeline, Procedure, Campaign, CampaignEvent, SystemSettings
 from app.schemas.campaign import AudienceRules, AudienceCondition
 from app.services.evolution_service import evolution_service
+from app.services.rate_limiter import send_rate_tracker
+from app.services.fair_queue import FairQueue
+from app.services.dispatch_lanes import lane_directory
+from app.services.instance_pool import instance_pool
+from app.services.template_service import template_service
+from app.services import retry_policy
+from app.core.config import settings as app_settings
+from app.core.dates import to_local_naive
 from datetime import datetime, timedelta
+from typing import Any, Optional
 import logging
 import uuid
 import random
 
 class CampaignService:
-    def execute_campaign(self, db: Session, campaign_id: str, force_resend: bool = False):
+    def __init__(self):
+        # Ordem justa entre tenants/campanhas ativas (compartilhada pelo dispatcher e pelo modo tick)
+        self.fair_queue = FairQueue()
+
+    def execute_campaign(self, db: Session, campaign_id: str, force_resend: bool = False, from_status: Optional[tuple] = None):
+        """
+        Enfileira a audiência e ativa a campanha.
+        `from_status`: só dispara se a campanha ainda estiver em um desses status (claim atômico no banco;
+        o scheduler roda em cada worker e só quem ativar a campanha enfileira).
+        """
         try:
             cid = uuid.UUID(str(campaign_id))
         except ValueError:
@@ -23,6 +42,18 @@ class CampaignService:
         if not campaign.audience_rules:
             return {"error": "Campanha sem regras definidas"}
 
+        if from_status:
+            # UPDATE condicional: a linha fica travada até o commit do enfileiramento (ou volta no rollback)
+            claimed = db.query(Campaign).filter(
+                Campaign.id == cid,
+                Campaign.status.in_(from_status)
+            ).update({Campaign.status: 'active'}, synchronize_session=False)
+            if claimed != 1:
+                result = {"campaign": campaign.name, "skipped": True,
+                          "message": "Campanha já disparada por outro processo."}
+                db.rollback()
+                return result
+
         # 2. Resovle Audiência
         rules_data = campaign.audience_rules
         if isinstance(rules_data, str):
@@ -30,60 +61,45 @@ class CampaignService:
             rules_data = json.loads(rules_data)
             
         rules_schema = AudienceRules(**rules_data)
-        query = self.build_query(db, rules_schema)
-        leads = query.all()
+        audience = self.build_query(db, rules_schema).with_entities(Contact.id.label("contact_id"))
 
         # Filtro de Exclusão Manual
-        if campaign.excluded_contacts:
-            exclusions = campaign.excluded_contacts if isinstance(campaign.excluded_contacts, list) else []
-            if isinstance(exclusions, str):
-                import json
-                try: exclusions = json.loads(exclusions)
-                except: exclusions = []
-            excluded_set = set(str(x) for x in exclusions)
-            leads = [l for l in leads if str(l.id) not in excluded_set]
-
-        queued_count = 0
-        skipped_count = 0
-        
-        logging.info(f"Enfileirando Campanha '{campaign.name}' com {len(leads)} leads.")
+        excluded_ids = self._parse_exclusions(campaign.excluded_contacts)
+        if excluded_ids:
+            audience = audience.filter(Contact.id.notin_(excluded_ids))
+
+        audience_ids = audience.subquery()
+        total_audience = db.query(func.count()).select_from(audience_ids).scalar()
+        now = datetime.now()  # Data de enfileiramento
 
-        # 3. Enfileirar (Não envia agora)
-        for lead in leads:
-            # Check se já existe evento para este lead nesta campanha
-            exists = db.query(CampaignEvent).filter(
+        logging.info(f"Enfileirando Campanha '{campaign.name}' com {total_audience} leads.")
+
+        # 3. Enfileirar (Não envia agora) - set-based, sem round-trip por lead
+        requeued_count = 0
+        if force_resend:
+            # Resend: reseta eventos já existentes da audiência para 'queued'
+            requeued_count = db.query(CampaignEvent).filter(
                 CampaignEvent.campaign_id == campaign.id,
-                CampaignEvent.contact_id == lead.id
-            ).first()
-            
-            should_queue = False
-            
-            if not exists:
-                should_queue = True
-            elif force_resend:
-                # Se for resend, podemos resetar o status para queued se foi erro ou sucesso anterior?
-                # Cuidado para não duplicar se já houver registro. Vamos atualizar.
-                exists.status = 'queued'
-                exists.sent_at = None
-                exists.processed_at = datetime.now()
-                queued_count += 1
-                should_queue = False # Já tratado
-            
-            if exists and not force_resend:
-                skipped_count += 1
-                continue
+                CampaignEvent.contact_id.in_(select(audience_ids.c.contact_id))
+            ).update({
+                CampaignEvent.status: 'queued',
+                CampaignEvent.sent_at: None,
+                CampaignEvent.processed_at: now,
+                CampaignEvent.attempts: 0,
+                CampaignEvent.next_attempt_at: None,
+                CampaignEvent.last_error: None
+            }, synchronize_session=False)
+
+        # INSERT ... SELECT com anti-join contra eventos já existentes nesta campanha
+        already_queued = exists().where(
+            CampaignEvent.campaign_id == campaign.id,
+            CampaignEvent.contact_id == audience_ids.c.contact_id
+        )
+        inserted_count = self._insert_missing_events(db, campaign.id, audience_ids, already_queued, now)
+
+        queued_count = inserted_count + requeued_count
+        skipped_count = total_audience - queued_count
 
-            if should_queue:
-                event = CampaignEvent(
-                    id=uuid.uuid4(),
-                    campaign_id=campaign.id,
-                    contact_id=lead.id,
-                    status="queued",
-                    processed_at=datetime.now() # Data de enfileiramento
-                )
-                db.add(event)
-                queued_count += 1
-        
         # Ativa campanha para o worker pegar
         campaign.status = 'active'
         campaign.last_run_at = datetime.now()
@@ -92,152 +108,457 @@ class CampaignService:
         
         return {
             "campaign": campaign.name,
-            "total_audience": len(leads),
+            "total_audience": total_audience,
             "queued_now": queued_count,
             "skipped": skipped_count,
             "message": "Campanha iniciada. As mensagens serão enviadas em segundo plano respeitando os limites."
         }
 
-    def process_queue(self, db: Session):
+    def _parse_exclusions(self, excluded_contacts) -> list:
+        exclusions = excluded_contacts or []
+        if isinstance(exclusions, str):
+            import json
+            try: exclusions = json.loads(exclusions)
+            except: exclusions = []
+        if not isinstance(exclusions, list):
+            return []
+
+        excluded_ids = []
+        for x in exclusions:
+            try: excluded_ids.append(uuid.UUID(str(x)))
+            except ValueError: pass
+        return excluded_ids
+
+    def _insert_missing_events(self, db: Session, campaign_id, audience_ids, already_queued, now: datetime) -> int:
         """
-        Processa UM item da fila se as regras permitirem.
-        Deve ser chamado em loop ou cron frequente.
+        Cria os CampaignEvents que faltam em um único INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+        O id é gerado no próprio banco (Postgres: gen_random_uuid / SQLite: randomblob).
         """
-        settings = db.query(SystemSettings).first()
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            new_id = func.gen_random_uuid()
+        elif dialect == "sqlite":
+            new_id = func.lower(func.hex(func.randomblob(16)))  # Uuid no SQLite = CHAR(32) hex
+        else:
+            new_id = None
+
+        if new_id is None:
+            # Fallback genérico: 1 SELECT + 1 INSERT em lote (executemany)
+            missing = db.execute(select(audience_ids.c.contact_id).where(~already_queued)).scalars().all()
+            inserted = 0
+            for contact_id in missing:
+                try:
+                    with db.begin_nested(): # Savepoint: duplicado de outro processo não derruba o lote
+                        db.execute(insert(CampaignEvent).values(
+                            id=uuid.uuid4(), campaign_id=campaign_id, contact_id=contact_id,
+                            status="queued", processed_at=now
+                        ))
+                    inserted += 1
+                except IntegrityError:
+                    pass
+            return inserted
+
+        rows = select(
+            new_id,
+            literal(campaign_id, Uuid(as_uuid=True)),
+            audience_ids.c.contact_id,
+            literal("queued"),
+            literal(now, DateTime(timezone=True))
+        ).where(~already_queued)
+
+        # ON CONFLICT: outro processo pode ter enfileirado o mesmo lead (índice único campanha + contato)
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        result = db.execute(dialect_insert(CampaignEvent).from_select(
+            ["id", "campaign_id", "contact_id", "status", "processed_at"], rows
+        ).on_conflict_do_nothing())
+        return result.rowcount
+
+    def get_settings(self, db: Session, tenant_id=None) -> SystemSettings:
+        """SystemSettings do tenant; sem linha própria, vale o global (tenant_id vazio)."""
+        if tenant_id is not None:
+            own = db.query(SystemSettings).filter(SystemSettings.tenant_id == tenant_id).first()
+            if own:
+                return own
+        settings = db.query(SystemSettings).filter(SystemSettings.tenant_id == None).first() \
+            or db.query(SystemSettings).order_by(SystemSettings.id.asc()).first()
         if not settings:
             # Cria default se não existir
             settings = SystemSettings()
             db.add(settings)
             db.commit()
-            
-        if not settings.is_active:
-            # logging.info("Disparos globais pausados.")
-            return
-
-        now = datetime.now()
+        return settings
 
-        # 1. Horário Comercial
+    def seconds_until_working_hours(self, settings: SystemSettings, now: datetime) -> float:
+        """0 se estiver dentro do horário comercial, senão segundos até a próxima abertura."""
         try:
             current_hm = now.strftime("%H:%M")
-            if not (settings.working_hours_start <= current_hm <= settings.working_hours_end):
-                return # Fora do horário
+            if settings.working_hours_start <= current_hm <= settings.working_hours_end:
+                return 0.0
+
+            h, m = (int(x) for x in settings.working_hours_start.split(":"))
+            opens_at = now.replace(hour=h, minute=m, second=0, microsecond=0)
+            if opens_at <= now:
+                opens_at += timedelta(days=1)
+            return (opens_at - now).total_seconds()
         except:
-            pass # Ignora erro de parse e segue (fail open ou close? open para testes)
+            return 0.0 # Ignora erro de parse e segue (fail open ou close? open para testes)
+
+    def get_lane_settings(self, db: Session, lane: str) -> SystemSettings:
+        """Limites de uma lane de disparo: os do tenant dono da instância (lane padrão = global)."""
+        return self.get_settings(db, lane_directory.owner_of(lane))
+
+    def seconds_until_lane_open(self, settings: SystemSettings, now: datetime) -> float:
+        """0 se a lane está ativa e dentro do horário comercial (os limites são por instância, ver instance_pool)."""
+        if not settings.is_active:
+            return float("inf")
+        return self.seconds_until_working_hours(settings, now)
+
+    def choose_instance(self, db: Session, pending: CampaignEvent, instances: list, ready: list, settings: SystemSettings, now: datetime) -> Optional[str]:
+        """
+        Instância para o envio (respeitando a atribuição fixa do contato).
+        Se o número do contato está saudável mas sem orçamento agora, o evento é adiado para ele.
+        """
+        instance, wait = instance_pool.select(instances, ready, pending.contact.assigned_instance, settings, now)
+        if instance is not None:
+            wait = self.reserve_instance(db, pending, instance, settings, now)
+            if wait > 0:
+                instance_pool.hold(instance, wait) # Outro dispatcher gastou o orçamento: contadores locais atrasados
+                instance = None
+        if instance is None:
+            self.defer_event(db, pending, wait)
+        return instance
 
-        # 2. Limites
-        # Contar envios HOJE
+    def reserve_instance(self, db: Session, pending: CampaignEvent, instance: str, settings: SystemSettings, now: datetime) -> float:
+        """
+        Reserva no banco um envio da instância para o evento (pending.instance/reserved_at) e confere
+        os limites do dia/hora e o intervalo contando envios feitos E reservados por TODOS os
+        dispatchers. Os contadores em memória (send_rate_tracker) só evitam ir ao banco à toa.
+        Intervalo aleatório: cada reserva sorteia random.uniform(min, max) e grava em next_allowed_at
+        quando a instância pode enviar de novo; a próxima reserva espera o maior next_allowed_at.
+        Serializado por instância: Postgres com advisory lock da transação; SQLite pelo lock de escrita
+        (a reserva é gravada antes da contagem). Retorna 0 se reservou, senão segundos para tentar de novo
+        (a reserva é desfeita por quem chama, em defer_event).
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"instance:{instance}"})
+        min_gap = settings.min_interval_seconds or 0
+        max_gap = max(settings.max_interval_seconds or 0, min_gap)
+        pending.instance = instance
+        pending.reserved_at = now
+        pending.next_allowed_at = now + timedelta(seconds=random.uniform(min_gap, max_gap))
+        db.flush()
+
+        hour_ago = now - timedelta(hours=1)
         start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        sent_today = db.query(func.count(CampaignEvent.id)).filter(
-            CampaignEvent.status == 'sent',
-            CampaignEvent.sent_at >= start_of_day
-        ).scalar()
-        
-        if sent_today >= settings.daily_limit:
-            return
-
-        # Contar envios NA ÚLTIMA HORA
-        one_hour_ago = now - timedelta(hours=1)
-        sent_last_hour = db.query(func.count(CampaignEvent.id)).filter(
-            CampaignEvent.status == 'sent',
-            CampaignEvent.sent_at >= one_hour_ago
-        ).scalar()
-
-        if sent_last_hour >= settings.hourly_limit:
-            return
-
-        # 3. Intervalo Aleatório
-        # Pega o ÚLTIMO envio feito
-        last_sent = db.query(CampaignEvent).filter(CampaignEvent.status == 'sent').order_by(CampaignEvent.sent_at.desc()).first()
-        
-        if last_sent and last_sent.sent_at:
-            delta = (now - last_sent.sent_at).total_seconds()
-            
-            # Intervalo dinâmico com aleatoriedade (Stateless Check)
-            # Sorteia um target entre Min e Max a cada check
-            target_wait = random.uniform(settings.min_interval_seconds, settings.max_interval_seconds)
-            
-            if delta < target_wait:
-                # logging.info(f"Aguardando intervalo seguro (Delta: {delta:.1f}s / Target: {target_wait:.1f}s)")
-                return
+        moment = func.coalesce(CampaignEvent.reserved_at, CampaignEvent.sent_at)
+        last_hour, today, oldest_in_hour, last, next_allowed = db.query(
+            func.count(case((moment >= hour_ago, 1))),
+            func.count(case((moment >= start_of_day, 1))),
+            func.min(case((moment >= hour_ago, moment))),
+            func.max(moment),
+            func.max(CampaignEvent.next_allowed_at)
+        ).filter(
+            CampaignEvent.instance == instance,
+            CampaignEvent.id != pending.id,
+            or_(CampaignEvent.status == 'sent',
+                and_(CampaignEvent.status == 'claimed', CampaignEvent.reserved_at != None)),
+            moment >= min(hour_ago, start_of_day)
+        ).one()
+
+        wait = 0.0
+        if today >= settings.daily_limit:
+            wait = (start_of_day + timedelta(days=1) - now).total_seconds()
+        elif last_hour >= settings.hourly_limit and oldest_in_hour is not None:
+            wait = (to_local_naive(oldest_in_hour) + timedelta(hours=1) - now).total_seconds()
+        else:
+            # Envios sem next_allowed_at (anteriores à coluna) valem pelo intervalo mínimo
+            if next_allowed is not None:
+                wait = (to_local_naive(next_allowed) - now).total_seconds()
+            if last is not None and min_gap:
+                wait = max(wait, (to_local_naive(last) + timedelta(seconds=min_gap) - now).total_seconds())
+        if wait > 0:
+            return max(wait, 1.0)
+        db.commit() # Reserva visível para os outros dispatchers (e libera o lock)
+        return 0.0
+
+    def defer_event(self, db: Session, pending: CampaignEvent, seconds: float):
+        """Devolve o evento para a fila sem contar tentativa (aguarda o número atribuído ao contato)."""
+        pending.status = 'queued'
+        pending.claimed_by = None
+        pending.claim_expires_at = None
+        pending.reserved_at = None
+        pending.next_allowed_at = None
+        pending.next_attempt_at = datetime.now() + timedelta(seconds=seconds)
+        db.commit()
+
+    def load_lanes(self, db: Session) -> dict:
+        """Lanes com backlog -> tenants. Atualiza mapa de instâncias e contadores se necessário."""
+        lane_directory.ensure_loaded(db, app_settings.FAIR_QUEUE_REFRESH_SECONDS)
+        send_rate_tracker.ensure_loaded(
+            db, app_settings.DISPATCH_TRACKER_RESYNC_SECONDS,
+            key_of=lambda tenant_id, instance: instance or lane_directory.primary_instance(tenant_id)
+        )
+        return lane_directory.group(self.backlog_tenants(db))
 
-        # 4. Pegar Próximo da Fila
-        # Prioridade: First In First Out
-        pending = db.query(CampaignEvent).join(Campaign).filter(
+    def backlog_tenants(self, db: Session) -> list:
+        """Tenants com eventos prontos para envio (recarrega o backlog se estiver velho)."""
+        if self.fair_queue.is_stale(app_settings.FAIR_QUEUE_REFRESH_SECONDS):
+            self.fair_queue.refresh(db, datetime.now())
+        return self.fair_queue.tenants()
+
+    def claim_next(self, db: Session, worker_id: str, tenant_ids=None) -> Optional[CampaignEvent]:
+        """
+        Reserva o próximo evento respeitando a ordem justa (DRR) entre tenants e campanhas.
+        `tenant_ids` limita aos tenants de uma lane de disparo.
+        Campanha sem eventos prontos sai da rodada; backlog vazio ou velho é recarregado do banco.
+        """
+        queue = self.fair_queue
+        refreshed = False
+        if queue.is_stale(app_settings.FAIR_QUEUE_REFRESH_SECONDS):
+            queue.refresh(db, datetime.now())
+            refreshed = True
+
+        while True:
+            pick = queue.next_campaign(tenant_ids)
+            if pick is None:
+                if refreshed or not queue.refresh(db, datetime.now()):
+                    return None
+                refreshed = True
+                continue
+            claimed = self.claim_events(db, worker_id, campaign_id=pick[1])
+            if claimed:
+                return claimed[0]
+            queue.exhausted(*pick)
+
+    def claim_events(self, db: Session, worker_id: str, limit: int = 1, campaign_id=None) -> list:
+        """
+        Reserva até `limit` eventos da fila (FIFO, opcionalmente de uma campanha) para este worker, com lease.
+        - Postgres: SELECT ... FOR UPDATE SKIP LOCKED (workers concorrentes pegam linhas diferentes).
+        - SQLite: UPDATE ... WHERE id IN (SELECT ...) AND status='queued' (atômico pelo lock de escrita).
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=app_settings.DISPATCH_LEASE_SECONDS)
+
+        # Retries entram junto com o trabalho novo assim que o backoff vence
+        candidates = select(CampaignEvent.id).join(Campaign).where(
             CampaignEvent.status == 'queued',
-            Campaign.status == 'active'
-        ).order_by(CampaignEvent.processed_at.asc()).first()
-        
-        if not pending:
-            return
+            Campaign.status == 'active',
+            or_(CampaignEvent.next_attempt_at == None, CampaignEvent.next_attempt_at <= now)
+        ).order_by(CampaignEvent.processed_at.asc()).limit(limit)
+        if campaign_id is not None:
+            candidates = candidates.where(CampaignEvent.campaign_id == campaign_id)
+
+        claim = {
+            CampaignEvent.status: 'claimed',
+            CampaignEvent.claimed_by: worker_id,
+            CampaignEvent.claim_expires_at: expires_at,
+            CampaignEvent.reserved_at: None # Reserva de orçamento só depois de escolher a instância
+        }
 
-        # 5. DISPARAR
+        if db.get_bind().dialect.name == "postgresql":
+            ids = db.execute(candidates.with_for_update(skip_locked=True, of=CampaignEvent)).scalars().all()
+            if ids:
+                db.query(CampaignEvent).filter(CampaignEvent.id.in_(ids)).update(claim, synchronize_session=False)
+        else:
+            db.query(CampaignEvent).filter(
+                CampaignEvent.id.in_(candidates.scalar_subquery()),
+                CampaignEvent.status == 'queued'
+            ).update(claim, synchronize_session=False)
+            ids = db.execute(select(CampaignEvent.id).where(
+                CampaignEvent.status == 'claimed',
+                CampaignEvent.claimed_by == worker_id,
+                CampaignEvent.claim_expires_at == expires_at
+            )).scalars().all()
+        db.commit()
+
+        if not ids:
+            return []
+        return db.query(CampaignEvent).filter(CampaignEvent.id.in_(ids)).order_by(CampaignEvent.processed_at.asc()).all()
+
+    def release_expired_claims(self, db: Session) -> int:
+        """Devolve para a fila claims cujo lease expirou (worker caiu no meio do envio)."""
+        released = db.query(CampaignEvent).filter(
+            CampaignEvent.status == 'claimed',
+            CampaignEvent.claim_expires_at < datetime.now()
+        ).update({
+            CampaignEvent.status: 'queued',
+            CampaignEvent.claimed_by: None,
+            CampaignEvent.claim_expires_at: None
+        }, synchronize_session=False)
+        db.commit()
+        if released:
+            logging.warning(f"♻️ {released} evento(s) com lease expirado voltaram para a fila.")
+        return released
+
+    def process_queue(self, db: Session, worker_id: str = "tick"):
+        """
+        Processa UM item da fila por lane de disparo, se as regras da lane permitirem.
+        Deve ser chamado em loop ou cron frequente.
+        (Modo legado 'tick'; o modo 'bucket' usa o CampaignDispatcher.)
+        """
+        self.release_expired_claims(db)
+
+        # Cada lane (pool de instâncias) tem seus limites: até 1 envio por lane a cada tick
+        for lane, tenant_ids in self.load_lanes(db).items():
+            settings = self.get_lane_settings(db, lane)
+            now = datetime.now()
+
+            # 1. Pausa e Horário Comercial
+            if self.seconds_until_lane_open(settings, now) > 0:
+                continue
+
+            # 2. Limites e Intervalo Aleatório (por instância saudável)
+            instances = lane_directory.instances_of(lane)
+            instance_pool.refresh_health(instances)
+            ready, _ = instance_pool.ready(instances, settings, now)
+            if not ready:
+                continue
+
+            # 3. Pegar Próximo da Fila (claim justo entre campanhas da lane, seguro com vários workers)
+            pending = self.claim_next(db, worker_id, tenant_ids)
+            if not pending:
+                continue
+
+            # 4. DISPARAR pelo número do contato (ou o menos usado)
+            instance = self.choose_instance(db, pending, instances, ready, settings, now)
+            if instance is None:
+                continue
+            self.send_event(db, pending, instance)
+
+    def send_event(self, db: Session, pending: CampaignEvent, instance: Optional[str] = None) -> str:
+        """
+        Dispara um CampaignEvent (já reservado via claim_events) de forma síncrona e persiste o resultado.
+        Retorna o status final ('sent', 'failed', 'skipped_optout').
+        """
         try:
-            lead = pending.contact
-            campaign = pending.campaign
-            
-            # Validação telefone
-            if not lead.phone_e164:
-                pending.status = 'failed'
-                db.commit()
-                return
-
-            # Check Opt-out (Anti-Ban)
-            if lead.is_opt_out:
-                logging.info(f"🚫 [SKIP] {lead.full_name} is marked as OPT-OUT/STOP.")
-                pending.status = 'skipped_optout'
-                # Remove do pipeline também? Não, já foi feito no webhook.
-                db.commit()
-                return
-
-            # Calcular Delay de Digitação (Typing Simulation)
-            full_text = campaign.message_template or ""
-            # Regra: ~60ms por caractere
-            typing_ms = len(full_text) * 60 
-            if typing_ms < 2000: typing_ms = 2000 # Min 2s digitando
-            if typing_ms > 15000: typing_ms = 15000 # Max 15s digitando
-            
-            # Jitter aleatório no typing (+- 20%)
-            jitter = random.uniform(0.8, 1.2)
-            typing_ms = int(typing_ms * jitter)
+            send = self.prepare_send(db, pending)
+            if send is None:
+                return pending.status
+        except Exception as e:
+            return self.complete_send(db, pending.id, error=e)
 
-            logging.info(f"🚀 [DISPARO SEGURO] {lead.full_name} (Typing: {typing_ms}ms)")
-            
-            # Personalização da Mensagem (Variáveis)
-            final_text = campaign.message_template or ""
-            if final_text and lead.full_name:
-                first_name = lead.full_name.split()[0].title() if lead.full_name else ""
-                final_text = final_text.replace("{nome}", first_name) \
-                                       .replace("{primeiro_nome}", first_name) \
-                                       .replace("{nome_completo}", lead.full_name) \
-                                       .replace("{telefone}", lead.phone_e164 or "") \
-                                       .replace("{email}", lead.email or "")
-
-            if final_text or campaign.media_url:
-                evolution_service.send_message(
-                    phone=lead.phone_e164,
-                    text=final_text,
-                    media_url=campaign.media_url,
-                    delay=typing_ms
-                )
-            
-            pending.status = 'sent'
-            pending.sent_at = datetime.now()
-            
-            # Atualizar Pipeline (Movimentação do Card)
-            pipeline_entry = db.query(LeadPipeline).filter(LeadPipeline.contact_id == lead.id).first()
-            if pipeline_entry:
-                if pipeline_entry.stage == 'novo':
-                    pipeline_entry.stage = 'contactado'
-                    logging.info(f"🔄 Movendo lead {lead.full_name} de 'novo' para 'contactado'")
+        if instance:
+            instance_pool.record_send(instance)
+        try:
+            result = evolution_service.send_message(instance=instance, **send)
+        except Exception as e:
+            return self.complete_send(db, pending.id, error=e, instance=instance)
+        return self.complete_send(db, pending.id, result=result, instance=instance)
 
+    def prepare_send(self, db: Session, pending: CampaignEvent) -> Optional[dict]:
+        """
+        Valida o evento e monta os argumentos de evolution_service.send_message.
+        Retorna None se o evento já foi finalizado aqui mesmo (sem telefone, opt-out, nada a enviar).
+        """
+        lead = pending.contact
+        campaign = pending.campaign
+        
+        # Validação telefone
+        if not lead.phone_e164:
+            pending.status = 'failed'
+            pending.claim_expires_at = None
             db.commit()
-            
-        except Exception as e:
-            logging.error(f"❌ Falha envio fila: {e}")
-            # Se quiser retry, mudar processed_at pra futuro?
-            # Por enquanto, fail hard.
+            return None
+
+        # Check Opt-out (Anti-Ban)
+        if lead.is_opt_out:
+            logging.info(f"🚫 [SKIP] {lead.full_name} is marked as OPT-OUT/STOP.")
+            pending.status = 'skipped_optout'
+            pending.claim_expires_at = None
+            # Remove do pipeline também? Não, já foi feito no webhook.
+            db.commit()
+            return None
+
+        # Calcular Delay de Digitação (Typing Simulation)
+        full_text = campaign.message_template or ""
+        # Regra: ~60ms por caractere
+        typing_ms = len(full_text) * 60 
+        if typing_ms < 2000: typing_ms = 2000 # Min 2s digitando
+        if typing_ms > 15000: typing_ms = 15000 # Max 15s digitando
+        
+        # Jitter aleatório no typing (+- 20%)
+        jitter = random.uniform(0.8, 1.2)
+        typing_ms = int(typing_ms * jitter)
+
+        logging.info(f"🚀 [DISPARO SEGURO] {lead.full_name} (Typing: {typing_ms}ms)")
+        
+        # Personalização da Mensagem (Variáveis) - template compilado e cacheado por campanha
+        final_text = template_service.render(db, campaign.message_template, lead)
+
+        if not (final_text or campaign.media_url):
+            # Nada saiu: não conta como envio (nem no orçamento da instância nem no send_rate_tracker)
+            logging.warning(f"⚠️ [SKIP] Mensagem vazia para {lead.full_name} (campanha {campaign.name}).")
             pending.status = 'failed'
+            pending.last_error = 'mensagem vazia'
+            pending.claim_expires_at = None
+            pending.reserved_at = None
             db.commit()
+            return None
+
+        return {
+            "phone": lead.phone_e164,
+            "text": final_text,
+            "media_url": campaign.media_url,
+            "delay": typing_ms
+        }
+
+    def complete_send(self, db: Session, event_id, result: Any = None, error: Optional[Exception] = None, instance: Optional[str] = None) -> str:
+        """
+        Persiste o resultado de um envio. Pode rodar em outra thread/sessão
+        (callback do envio assíncrono), por isso recarrega o evento pelo id.
+        Falhas transitórias voltam para a fila com backoff; permanentes viram 'failed'.
+        `instance` = número que fez o envio (alimenta saúde/orçamento do pool e a atribuição do contato).
+        """
+        failure = retry_policy.classify_exception(error) if error is not None else retry_policy.classify_result(result)
+        if instance:
+            # Sem status HTTP = não chegou na Evolution/instância (conexão/timeout)
+            instance_pool.record_result(instance, connection_failure=bool(failure and failure.retryable and failure.status is None))
+
+        pending = db.query(CampaignEvent).filter(CampaignEvent.id == event_id).first()
+        if not pending:
+            return 'missing'
+        pending.claim_expires_at = None # Lease encerrado junto com o status final
+
+        if failure is not None:
+            pending.attempts = (pending.attempts or 0) + 1
+            pending.last_error = str(failure)
+            if failure.retryable and pending.attempts < app_settings.CAMPAIGN_MAX_ATTEMPTS:
+                delay = retry_policy.backoff_seconds(pending.attempts)
+                pending.status = 'queued'
+                pending.claimed_by = None
+                pending.reserved_at = None
+                pending.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+                logging.warning(f"🔁 Falha transitória ({failure}). Tentativa {pending.attempts}/{app_settings.CAMPAIGN_MAX_ATTEMPTS} em {delay:.0f}s.")
+            else:
+                logging.error(f"❌ Falha envio fila: {failure}")
+                pending.status = 'failed'
+            db.commit()
+            return pending.status
+
+        pending.status = 'sent'
+        pending.sent_at = datetime.now()
+        pending.next_attempt_at = None
+        tenant_id = pending.campaign.tenant_id
+        pending.instance = instance or lane_directory.primary_instance(tenant_id)
+
+        # Atribuição fixa: o contato fica com o primeiro número que falou com ele
+        lead = pending.contact
+        if lead and (not lead.assigned_instance or lead.assigned_instance not in lane_directory.instances_for(tenant_id)):
+            lead.assigned_instance = pending.instance
+        
+        # Atualizar Pipeline (Movimentação do Card)
+        pipeline_entry = db.query(LeadPipeline).filter(LeadPipeline.contact_id == pending.contact_id).first()
+        if pipeline_entry:
+            if pipeline_entry.stage == 'novo':
+                pipeline_entry.stage = 'contactado'
+                logging.info(f"🔄 Movendo lead {pending.contact_id} de 'novo' para 'contactado'")
+
+        db.commit()
+        send_rate_tracker.record(pending.instance, pending.sent_at)
+        return pending.status
 
     def resolve_date_value(self, value: str) -> datetime:
         if not isinstance(value, str) or not value.startswith("NOW"):
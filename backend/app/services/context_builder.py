@@ -0,0 +1,218 @@
+import logging
+import math
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional
+from app.core.config import settings
+
+try:
+    import tiktoken # Opcional: contagem exata; sem ele, estimativa por caracteres
+except ImportError:
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # Formatação de cada mensagem do chat (role, separadores)
+REPLY_PRIMING_TOKENS = 3     # Início da resposta do assistente
+TOKEN_CACHE_SIZE = 20000     # Textos com contagem em cache (por modelo)
+TRUNCATION_MARK = " […]"
+LAST_MESSAGE_MIN_TOKENS = 16 # A mensagem a responder entra com pelo menos isto, mesmo com o orçamento estourado
+
+RAG_HEADER = "\n\n### BASE DE CONHECIMENTO (Use estas informações para responder):\n"
+RAG_FOOTER = "\n### FIM DO CONHECIMENTO\n"
+OMITTED_NOTE = "\n[HISTÓRICO: {n} mensagens anteriores omitidas por limite de contexto.]"
+
+ROLES = ('user', 'assistant', 'system', 'tool')
+
+
+class TokenCounter:
+    """
+    Tokens de um texto: tiktoken (se instalado) ou estimativa len/4.
+    A contagem fica em cache por texto: o histórico se repete a cada resposta da mesma conversa.
+    """
+    def __init__(self, model: str):
+        self.encoding = self._encoding_for(model)
+        self.name = f"tiktoken:{self.encoding.name}" if self.encoding else "estimativa"
+        self.count = lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._count)
+
+    @staticmethod
+    def _encoding_for(model: str):
+        if tiktoken is None:
+            return None
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # Ex: tabela do encoding não baixada (sem internet)
+            logging.warning(f"⚠️ tiktoken indisponível para {model}: {e}. Usando estimativa.")
+            return None
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Corta o texto para caber em max_tokens (mantém o começo)."""
+        if self.count(text) <= max_tokens:
+            return text
+        keep = max_tokens - self.count(TRUNCATION_MARK)
+        if keep <= 0:
+            return ""
+        if self.encoding:
+            cut = self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:keep])
+        else:
+            cut = text[:keep * CHARS_PER_TOKEN]
+        return cut.rstrip() + TRUNCATION_MARK
+
+
+class PromptContext:
+    """Mensagens prontas para a OpenAI + contagem de tokens por seção."""
+    __slots__ = ("messages", "prompt_tokens", "budget", "tokenizer", "sections",
+                 "history_used", "history_total", "rag_used", "rag_total", "truncated")
+
+    def summary(self) -> str:
+        parts = " ".join(f"{name}={tokens}" for name, tokens in self.sections.items())
+        return (f"Prompt ~{self.prompt_tokens}/{self.budget} tokens ({self.tokenizer}) | {parts} | "
+                f"histórico {self.history_used}/{self.history_total} | RAG {self.rag_used}/{self.rag_total} | "
+                f"truncadas {self.truncated}")
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if name != "messages"}
+
+
+class ContextBuilder:
+    """
+    Monta o prompt da IA dentro de um orçamento de tokens por modelo (AI_CONTEXT_BUDGETS).
+    Prioridade de preenchimento:
+      1. prompt do sistema, 2. regras e a última mensagem (sempre entram; a mensagem, truncada se preciso);
+      3. demais das últimas AI_CONTEXT_RECENT_TURNS mensagens; 4. trechos do RAG; 5. mensagens mais antigas.
+    O histórico que entra é sempre um sufixo contínuo da conversa; o que sobra vira uma nota
+    de mensagens omitidas. Mensagens e trechos longos são truncados.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, TokenCounter] = {}
+
+    def counter(self, model: str) -> TokenCounter:
+        with self._lock:
+            counter = self._counters.get(model)
+            if counter is None:
+                counter = self._counters[model] = TokenCounter(model)
+            return counter
+
+    def budget_for(self, model: str) -> int:
+        budgets = settings.AI_CONTEXT_BUDGETS or {}
+        if model in budgets:
+            return budgets[model]
+        # Variantes datadas (ex: gpt-4o-2024-08-06): maior prefixo conhecido
+        prefixes = [name for name in budgets if model and model.startswith(name)]
+        return budgets[max(prefixes, key=len)] if prefixes else settings.AI_CONTEXT_DEFAULT_BUDGET
+
+    def build(self, model: str, system_prompt: str, rules: str = "",
+              history: Optional[List[Dict[str, str]]] = None,
+              rag_chunks: Optional[List[dict]] = None,
+              reserved_tokens: int = 0) -> PromptContext:
+        """
+        history: mensagens em ordem cronológica ({"role", "content"}).
+        rag_chunks: resultados do knowledge_service.search (mais relevante primeiro).
+        reserved_tokens: o que vai no request fora das mensagens (ex: definição das tools).
+        """
+        counter = self.counter(model)
+        budget = self.budget_for(model)
+        turns = [m for m in (history or []) if m.get('role') in ROLES and m.get('content')]
+        rag_chunks = rag_chunks or []
+
+        sections = {
+            "system": counter.count(system_prompt) + MESSAGE_OVERHEAD_TOKENS,
+            "rules": counter.count(rules),
+            "recent": 0, "rag": 0, "older": 0
+        }
+        used = REPLY_PRIMING_TOKENS + reserved_tokens + sections["system"] + sections["rules"]
+        if len(turns) > settings.AI_CONTEXT_RECENT_TURNS:
+            used += counter.count(OMITTED_NOTE.format(n=len(turns))) # Reserva para a nota de omitidas
+        if used > budget:
+            logging.warning(f"⚠️ Prompt do sistema + regras ({used} tokens) já passam do orçamento ({budget}).")
+
+        chosen = {}  # índice em turns -> conteúdo (possivelmente truncado)
+        truncated = 0
+
+        def take(index: int, section: str, required: bool = False) -> bool:
+            nonlocal used, truncated
+            content = turns[index]['content']
+            room = budget - used - MESSAGE_OVERHEAD_TOKENS
+            limit = min(settings.AI_CONTEXT_MAX_MESSAGE_TOKENS, room)
+            if required:
+                limit = max(limit, LAST_MESSAGE_MIN_TOKENS)
+            if counter.count(content) > limit:
+                # Sem espaço, só a mensagem obrigatória (a que será respondida) entra truncada
+                if not required and limit < settings.AI_CONTEXT_MAX_MESSAGE_TOKENS:
+                    return False
+                content = counter.truncate(content, limit)
+                if not content:
+                    return False
+                truncated += 1
+            tokens = counter.count(content) + MESSAGE_OVERHEAD_TOKENS
+            chosen[index] = content
+            sections[section] += tokens
+            used += tokens
+            return True
+
+        # 2. A mensagem a responder entra antes de qualquer corte pelo orçamento
+        if turns:
+            take(len(turns) - 1, "recent", required=True)
+
+        # 3. Últimas mensagens (da mais nova para a mais antiga)
+        recent_start = max(len(turns) - max(settings.AI_CONTEXT_RECENT_TURNS, 1), 0)
+        complete = True
+        for index in range(len(turns) - 2, recent_start - 1, -1):
+            if not take(index, "recent"):
+                complete = False
+                break
+
+        # 4. Base de conhecimento
+        rag_lines = []
+        frame = counter.count(RAG_HEADER) + counter.count(RAG_FOOTER)
+        for item in rag_chunks:
+            text = counter.truncate(item.get('chunk_text') or "", settings.AI_CONTEXT_RAG_CHUNK_TOKENS)
+            line = f"- (Fonte: {item.get('document_title')}): {text}\n"
+            tokens = counter.count(line) + (0 if rag_lines else frame)
+            if used + tokens > budget:
+                break
+            rag_lines.append(line)
+            sections["rag"] += tokens
+            used += tokens
+
+        # 5. Mensagens mais antigas, enquanto couber (sem buracos no histórico)
+        if complete:
+            for index in range(recent_start - 1, -1, -1):
+                if not take(index, "older"):
+                    break
+
+        system_content = system_prompt
+        if rag_lines:
+            system_content += RAG_HEADER + "".join(rag_lines) + RAG_FOOTER
+        system_content += rules
+        omitted = len(turns) - len(chosen)
+        if omitted:
+            system_content += OMITTED_NOTE.format(n=omitted)
+
+        context = PromptContext()
+        context.messages = [{"role": "system", "content": system_content}] + [
+            {"role": turns[index]['role'], "content": chosen[index]} for index in sorted(chosen)
+        ]
+        context.prompt_tokens = (REPLY_PRIMING_TOKENS + reserved_tokens
+                                 + sum(counter.count(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in context.messages))
+        context.budget = budget
+        context.tokenizer = counter.name
+        context.sections = sections
+        context.history_used = len(chosen)
+        context.history_total = len(turns)
+        context.rag_used = len(rag_lines)
+        context.rag_total = len(rag_chunks)
+        context.truncated = truncated
+        return context
+
+context_builder = ContextBuilder()
@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Dict, List
+from sqlalchemy.orm import Session
+from app.models.models import Tenant
+from app.services.evolution_service import evolution_service
+
+# Lane compartilhada: tenants sem instância própria usam a instância padrão
+# (evolution_config.json / ENV) e dividem o orçamento do SystemSettings global.
+DEFAULT_LANE = "default"
+
+
+def parse_instances(config) -> List[str]:
+    """Instâncias do tenant: Tenant.config["evolution_instances"] (lista) e/ou ["evolution_instance"]."""
+    config = config or {}
+    names = []
+    raw = config.get("evolution_instances") or []
+    if isinstance(raw, str):
+        raw = [raw]
+    single = config.get("evolution_instance")
+    if single:
+        raw = [single] + list(raw)
+    for name in raw:
+        if isinstance(name, str) and name.strip() and name.strip() not in names:
+            names.append(name.strip())
+    return names
+
+
+class LaneDirectory:
+    """
+    Mapa tenant -> lane de disparo (pool de instâncias de WhatsApp).
+    Tenant com instâncias próprias (Tenant.config) tem lane própria: limites
+    (SystemSettings do tenant, com fallback para o global) e horário independentes,
+    e cada instância do pool tem seu orçamento (ver instance_pool).
+    Assim mais números = mais vazão, sem multiplicar o volume em cima do número compartilhado.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._instances_by_tenant = {}  # tenant_id -> [instâncias]
+        self._loaded_at = None
+
+    def ensure_loaded(self, db: Session, max_age: float):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= max_age:
+            self.refresh(db)
+
+    def refresh(self, db: Session):
+        rows = db.query(Tenant.id, Tenant.config).all()
+        mapping = {}
+        for tenant_id, config in rows:
+            instances = parse_instances(config)
+            if instances:
+                mapping[tenant_id] = instances
+        with self._lock:
+            self._instances_by_tenant = mapping
+            self._loaded_at = time.monotonic()
+
+    def lane_for(self, tenant_id) -> str:
+        with self._lock:
+            instances = self._instances_by_tenant.get(tenant_id)
+        return "|".join(instances) if instances else DEFAULT_LANE
+
+    def instances_for(self, tenant_id) -> List[str]:
+        """Pool de instâncias do tenant (sem configuração: a instância padrão)."""
+        with self._lock:
+            instances = self._instances_by_tenant.get(tenant_id)
+        return list(instances) if instances else [evolution_service.instance]
+
+    def instances_of(self, lane: str) -> List[str]:
+        return [evolution_service.instance] if lane == DEFAULT_LANE else lane.split("|")
+
+    def primary_instance(self, tenant_id) -> str:
+        """Instância usada para envios do tenant fora de campanha sem atribuição prévia."""
+        return self.instances_for(tenant_id)[0]
+
+    def owner_of(self, lane: str):
+        """Tenant dono da lane (cujo SystemSettings vale para ela). None = lane padrão."""
+        if lane == DEFAULT_LANE:
+            return None
+        with self._lock:
+            for tenant_id, instances in self._instances_by_tenant.items():
+                if "|".join(instances) == lane:
+                    return tenant_id
+        return None
+
+    def group(self, tenant_ids) -> Dict[str, List]:
+        """Agrupa tenants com backlog pelas suas lanes."""
+        lanes = {}
+        for tenant_id in tenant_ids:
+            lanes.setdefault(self.lane_for(tenant_id), []).append(tenant_id)
+        return lanes
+
+lane_directory = LaneDirectory()
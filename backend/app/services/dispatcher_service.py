@@ -0,0 +1,169 @@
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime
+from functools import partial
+from sqlalchemy.orm import Session
+from app.core.config import settings as app_settings
+from app.db.session import SessionLocal
+from app.services.campaign_service import campaign_service
+from app.services.evolution_service import evolution_service
+from app.services.dispatch_lanes import lane_directory
+from app.services.instance_pool import instance_pool
+
+
+# Eventos adiados (contato preso a um número sem orçamento agora) por lane em um mesmo ciclo
+MAX_DEFERS_PER_BATCH = 20
+
+
+class CampaignDispatcher:
+    """
+    Dispatcher em modo 'bucket'.
+    Cada lane de disparo (pool de instâncias de WhatsApp do tenant, ver dispatch_lanes)
+    tem limites e horário próprios, e cada instância do pool tem orçamento, ritmo e saúde
+    próprios (ver instance_pool). A cada despertar todas as lanes com backlog drenam o que
+    os seus números permitirem e o loop dorme até o próximo token mais próximo.
+    Os envios rodam em paralelo (até EVOLUTION_MAX_IN_FLIGHT por instância) e o resultado
+    é gravado pelo callback, então o typing delay não segura o loop.
+    """
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._in_flight = {}  # future -> instância
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        with self._in_flight_lock:
+            return len(self._in_flight)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="campaign-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """Acorda o loop antes do prazo (ex: campanha recém-enfileirada)."""
+        campaign_service.fair_queue.invalidate() # Nova campanha entra na rodada já
+        self._wake.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            db = SessionLocal()
+            try:
+                delay = self.dispatch_batch(db)
+            except Exception as e:
+                print(f"Worker Error: {e}")
+                delay = app_settings.DISPATCH_IDLE_SECONDS
+            finally:
+                db.close()
+
+            self._wake.wait(max(delay, 0.05))
+
+        self._wait_in_flight(app_settings.DISPATCH_LEASE_SECONDS)
+
+    def _wait_in_flight(self, timeout: float):
+        """Shutdown gracioso: espera os envios em andamento gravarem o resultado."""
+        with self._in_flight_lock:
+            pending = list(self._in_flight)
+        if pending:
+            print(f"⏳ Aguardando {len(pending)} envio(s) em andamento...")
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def _on_send_done(self, event_id, instance, future):
+        db = SessionLocal()
+        try:
+            error = future.exception()
+            result = future.result() if error is None else None
+            campaign_service.complete_send(db, event_id, result=result, error=error, instance=instance)
+        except Exception as e:
+            print(f"Worker Error (callback): {e}")
+        finally:
+            db.close()
+            with self._in_flight_lock:
+                self._in_flight.pop(future, None)
+            self._wake.set() # Slot liberado
+
+    def dispatch_batch(self, db: Session) -> float:
+        """
+        Envia tudo que o orçamento atual de cada lane permite.
+        Retorna quantos segundos dormir até a próxima oportunidade de envio (de qualquer lane).
+        """
+        idle = app_settings.DISPATCH_IDLE_SECONDS
+        campaign_service.release_expired_claims(db)
+
+        delay = idle
+        for lane, tenant_ids in campaign_service.load_lanes(db).items():
+            if self._stop.is_set():
+                break
+            delay = min(delay, self.dispatch_lane(db, lane, tenant_ids))
+        return delay
+
+    def dispatch_lane(self, db: Session, lane: str, tenant_ids: list) -> float:
+        """Drena uma lane até esbarrar em um limite. Retorna segundos até a próxima vaga dela."""
+        idle = app_settings.DISPATCH_IDLE_SECONDS
+        settings = campaign_service.get_lane_settings(db, lane)
+        instances = lane_directory.instances_of(lane)
+        instance_pool.refresh_health(instances)
+        defers = 0
+
+        while not self._stop.is_set():
+            now = datetime.now()
+
+            # 1. Pausa e Horário Comercial
+            wait = campaign_service.seconds_until_lane_open(settings, now)
+            if wait > 0:
+                return min(wait, idle)
+
+            # 2. Orçamento: alguma instância saudável com vaga (limites, token bucket, envios simultâneos)
+            ready, wait = instance_pool.ready(instances, settings, now)
+            if not ready:
+                return min(wait, idle)
+
+            # 3. Próximo da Fila (ordem justa entre campanhas da lane; claim com lease: seguro com N dispatchers)
+            event = campaign_service.claim_next(db, self.worker_id, tenant_ids)
+            if event is None:
+                return idle
+
+            # 4. Número do envio: o do contato (se saudável) ou o pronto menos usado
+            instance = campaign_service.choose_instance(db, event, instances, ready, settings, now)
+            if instance is None:
+                defers += 1
+                if defers >= MAX_DEFERS_PER_BATCH:
+                    return min(wait, 1.0) # Outros contatos ainda podem sair pelos números prontos
+                continue
+
+            # 5. DISPARAR sem bloquear (só consome token se realmente vai enviar)
+            try:
+                send = campaign_service.prepare_send(db, event)
+            except Exception as e:
+                campaign_service.complete_send(db, event.id, error=e)
+                continue
+            if send is None:
+                continue
+
+            instance_pool.record_send(instance)
+            future = evolution_service.send_message_async(instance=instance, **send)
+            with self._in_flight_lock:
+                self._in_flight[future] = instance
+            future.add_done_callback(partial(self._on_send_done, event.id, instance))
+
+        return idle
+
+campaign_dispatcher = CampaignDispatcher()
@@ -1,16 +1,83 @@
 import requests
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from typing import Dict, Any, Optional
 from app.core.config import settings
+from app.services.media_cache import media_cache
 
 import os
 import json
 
 CONFIG_FILE = "evolution_config.json"
 
+class EndpointStats:
+    """Contadores de latência/erro por endpoint da Evolution (thread-safe)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, endpoint: str, elapsed_ms: float, error: Optional[str] = None):
+        with self._lock:
+            item = self._data.setdefault(endpoint, {
+                "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_error": None
+            })
+            item["calls"] += 1
+            item["total_ms"] += elapsed_ms
+            item["max_ms"] = max(item["max_ms"], elapsed_ms)
+            if error:
+                item["errors"] += 1
+                item["last_error"] = error[:200]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: {
+                    "calls": item["calls"],
+                    "errors": item["errors"],
+                    "avg_ms": round(item["total_ms"] / item["calls"], 1) if item["calls"] else 0.0,
+                    "max_ms": round(item["max_ms"], 1),
+                    "last_error": item["last_error"]
+                }
+                for name, item in self._data.items()
+            }
+
 class EvolutionService:
     def __init__(self):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.session = self._build_session()
+        self.stats = EndpointStats()
         self.load_config()
 
+    def _build_session(self) -> requests.Session:
+        """Sessão HTTP com pool keep-alive: evita handshake TCP/TLS a cada mensagem."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(settings.EVOLUTION_POOL_SIZE, 1))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        return session
+
+    def _request(self, endpoint: str, method: str, url: str, extra_read_timeout: float = 0, **kwargs) -> requests.Response:
+        """Executa a chamada pelo pool, com timeouts e métricas por endpoint."""
+        timeout = (settings.EVOLUTION_CONNECT_TIMEOUT, settings.EVOLUTION_READ_TIMEOUT + extra_read_timeout)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, headers=self._get_headers(), timeout=timeout, **kwargs)
+        except Exception as e:
+            self.stats.record(endpoint, (time.perf_counter() - started) * 1000, error=str(e))
+            raise
+        error = None if response.status_code < 400 else f"HTTP {response.status_code}"
+        self.stats.record(endpoint, (time.perf_counter() - started) * 1000, error=error)
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.stats.snapshot()
+        stats["media_cache"] = media_cache.stats()
+        return stats
+
     def load_config(self):
         # Default from ENV
         self.base_url = settings.EVOLUTION_API_URL
@@ -53,10 +120,11 @@ class EvolutionService:
             "Content-Type": "application/json"
         }
 
-    def send_message(self, phone: str, text: str, media_url: Optional[str] = None, delay: int = 1200) -> Dict[str, Any]:
+    def send_message(self, phone: str, text: str, media_url: Optional[str] = None, delay: int = 1200, instance: Optional[str] = None) -> Dict[str, Any]:
         """
         Envia uma mensagem (Texto ou Mídia).
         Allow custom typing delay (in ms).
+        `instance` permite enviar por outra instância do mesmo servidor (lane do tenant).
         """
         if not self.base_url or not self.api_key:
             print("⚠️ Evolution API não configurada. Mensagem não enviada.")
@@ -64,6 +132,7 @@ class EvolutionService:
 
         import re
         numbers = re.sub(r'\D', '', phone)
+        instance = instance or self.instance
         
         # Decide endpoint baseado se tem mídia ou não
         if media_url:
@@ -73,31 +142,22 @@ class EvolutionService:
             # Isso resolve o problema da Evolution (Docker) não acessar localhost do host
             if "localhost:8000/static/uploads/" in media_url or "127.0.0.1:8000/static/uploads/" in media_url:
                 try:
-                    import base64
-                    import os
-                    import mimetypes
-                    
                     filename = media_url.split("/")[-1]
                     # Caminho absoluto ou relativo a partir da raiz do backend
                     filepath = os.path.join("app/static/uploads", filename)
                     
-                    if os.path.exists(filepath):
-                        mime_type, _ = mimetypes.guess_type(filepath)
-                        if not mime_type: mime_type = "image/jpeg"
-                        
-                        with open(filepath, "rb") as f:
-                            encoded = base64.b64encode(f.read()).decode('utf-8')
-                            media_content = encoded # Evolution API geralmente detecta ou aceita puro no campo media
-                            
-                            # Log para debug
-                            print(f"📸 Convertido arquivo local {filename} para Base64 ({len(media_content)} chars)")
+                    # Codificado uma vez e reaproveitado (cache LRU)
+                    cached = media_cache.get_base64(filepath)
+                    if cached:
+                        media_content, _ = cached # Evolution API geralmente detecta ou aceita puro no campo media
                 except Exception as e:
                     print(f"⚠️ Falha ao converter imagem local para Base64: {e}. Tentando URL original.")
 
             elif "base64," in media_url:
                 media_content = media_url.split("base64,")[1]
 
-            url = f"{self.base_url}/message/sendMedia/{self.instance}"
+            endpoint = "sendMedia"
+            url = f"{self.base_url}/message/sendMedia/{instance}"
             payload = {
                 "number": numbers,
                 "options": {
@@ -113,7 +173,8 @@ class EvolutionService:
             if media_url and (media_url.endswith('.mp4') or media_url.endswith('.webm')):
                  payload['mediatype'] = 'video'
         else:
-            url = f"{self.base_url}/message/sendText/{self.instance}"
+            endpoint = "sendText"
+            url = f"{self.base_url}/message/sendText/{instance}"
             payload = {
                 "number": numbers,
                 "options": {
@@ -126,7 +187,8 @@ class EvolutionService:
 
         try:
             print(f"📤 Enviando WhatsApp para {numbers}...")
-            response = requests.post(url, json=payload, headers=self._get_headers())
+            # A Evolution só responde depois do typing delay: soma ao read timeout
+            response = self._request(endpoint, "POST", url, extra_read_timeout=delay / 1000, json=payload)
             
             if response.status_code not in [200, 201]:
                 print(f"❌ Erro Evolution ({response.status_code}): {response.text}")
@@ -137,15 +199,53 @@ class EvolutionService:
             print(f"❌ Erro de Conexão Evolution: {e}")
             return {"error": str(e)}
 
-    def check_instance_status(self) -> Dict[str, Any]:
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(settings.EVOLUTION_SEND_THREADS, settings.EVOLUTION_MAX_IN_FLIGHT, 1),
+                    thread_name_prefix="evolution-send"
+                )
+            return self._executor
+
+    def send_message_async(self, phone: str, text: str, media_url: Optional[str] = None, delay: int = 1200, instance: Optional[str] = None) -> Future:
+        """
+        Igual a send_message, mas roda no pool de envio e retorna um Future.
+        Quem chama não fica bloqueado durante o typing delay da Evolution.
+        """
+        return self._get_executor().submit(self.send_message, phone, text, media_url, delay, instance)
+
+    def send_presence(self, phone: str, presence: str = "composing", delay: int = 5000, instance: Optional[str] = None) -> Dict[str, Any]:
+        """Mostra 'digitando...' (composing) para o contato por `delay` ms."""
+        if not self.base_url or not self.api_key:
+            return {"mock": True, "status": "simulated"}
+
+        import re
+        numbers = re.sub(r'\D', '', phone)
+        url = f"{self.base_url}/chat/sendPresence/{instance or self.instance}"
+        payload = {"number": numbers, "delay": delay, "presence": presence}
+        try:
+            # A Evolution segura a resposta durante o delay da presença
+            response = self._request("sendPresence", "POST", url, extra_read_timeout=delay / 1000, json=payload)
+            if response.status_code not in [200, 201]:
+                return {"error": response.text, "status": response.status_code}
+            return response.json()
+        except requests.RequestException as e:
+            return {"error": str(e)}
+
+    def send_presence_async(self, phone: str, presence: str = "composing", delay: int = 5000, instance: Optional[str] = None) -> Future:
+        """Igual a send_presence, no pool de envio (não segura quem chamou)."""
+        return self._get_executor().submit(self.send_presence, phone, presence, delay, instance)
+
+    def check_instance_status(self, instance: Optional[str] = None) -> Dict[str, Any]:
         """
         Verifica se a instância está conectada.
         """
         if not self.base_url: return {"status": "not_configured"}
         
-        url = f"{self.base_url}/instance/connectionState/{self.instance}"
+        url = f"{self.base_url}/instance/connectionState/{instance or self.instance}"
         try:
-            response = requests.get(url, headers=self._get_headers())
+            response = self._request("connectionState", "GET", url)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -177,7 +277,7 @@ class EvolutionService:
         try:
             print(f"🔍 Buscando histórico no Evolution para {remote_jid}...")
             # print(f"Payload: {payload}")
-            response = requests.post(url, json=payload, headers=self._get_headers())
+            response = self._request("findMessages", "POST", url, json=payload)
             
             if response.status_code == 200:
                 data = response.json()
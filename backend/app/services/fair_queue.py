@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.models.models import Campaign, CampaignEvent, Tenant
+
+# Peso padrão de tenant (Tenant.config["dispatch_weight"]) e de campanha (Campaign.priority)
+DEFAULT_WEIGHT = 1.0
+
+
+def _weight(value) -> float:
+    try:
+        return max(float(value), 0.1)
+    except (TypeError, ValueError):
+        return DEFAULT_WEIGHT
+
+
+class DeficitRoundRobin:
+    """
+    Deficit Round-Robin com custo unitário (1 envio = 1 crédito).
+    Cada fluxo ativo recebe `peso` créditos por rodada e é servido enquanto tiver crédito.
+    Fluxos que saem do backlog perdem o crédito acumulado (não guardam "vez" para depois).
+    """
+    def __init__(self):
+        self._flows = OrderedDict()  # key -> [peso, déficit]
+
+    def sync(self, weights: Dict[object, float]):
+        for key in list(self._flows):
+            if key not in weights:
+                del self._flows[key]
+        for key, weight in weights.items():
+            if key in self._flows:
+                self._flows[key][0] = weight
+            else:
+                self._flows[key] = [weight, 0.0]
+
+    def remove(self, key):
+        self._flows.pop(key, None)
+
+    def __len__(self):
+        return len(self._flows)
+
+    def keys(self) -> list:
+        return list(self._flows)
+
+    def next(self, allowed=None) -> Optional[object]:
+        """Próximo fluxo a servir. `allowed` restringe a disputa a um subconjunto (ex: tenants de uma lane)."""
+        if allowed is not None and not any(key in allowed for key in self._flows):
+            return None
+        if not self._flows:
+            return None
+        while True:
+            key, flow = next(iter(self._flows.items()))
+            if allowed is not None and key not in allowed:
+                self._flows.move_to_end(key) # Fora da disputa: passa a vez sem ganhar crédito
+                continue
+            if flow[1] >= 1:
+                flow[1] -= 1
+                return key
+            # Sem crédito: ganha o quantum e vai para o fim da rodada
+            flow[1] += flow[0]
+            self._flows.move_to_end(key)
+
+
+class FairQueue:
+    """
+    Escolhe de qual campanha sai o próximo envio, em dois níveis de DRR:
+    tenants (Tenant.config["dispatch_weight"]) e, dentro do tenant, campanhas (Campaign.priority).
+    Um disparo de 40k leads não segura mais as campanhas enfileiradas depois dele:
+    uma campanha de prioridade 5 recebe 5 envios para cada 1 da de prioridade 1.
+    Só decide a ORDEM; os limites globais continuam no dispatcher.
+    """
+    def __init__(self):
+        self._tenants = DeficitRoundRobin()
+        self._campaigns = {}  # tenant_id -> DeficitRoundRobin
+        self._lock = threading.Lock()
+        self._refreshed_at = None
+
+    def is_stale(self, max_age: float) -> bool:
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at >= max_age
+
+    def invalidate(self):
+        """Força recarregar o backlog no próximo claim (ex: campanha recém-executada)."""
+        self._refreshed_at = None
+
+    def refresh(self, db: Session, now) -> int:
+        """Recarrega o backlog: campanhas ativas com eventos prontos para envio. Retorna quantas."""
+        rows = db.query(Campaign.id, Campaign.tenant_id, Campaign.priority).join(
+            CampaignEvent, CampaignEvent.campaign_id == Campaign.id
+        ).filter(
+            CampaignEvent.status == 'queued',
+            Campaign.status == 'active',
+            or_(CampaignEvent.next_attempt_at == None, CampaignEvent.next_attempt_at <= now)
+        ).group_by(Campaign.id, Campaign.tenant_id, Campaign.priority).all()
+
+        # Pesos dos tenants à parte (coluna JSON não entra no GROUP BY do Postgres)
+        tenant_ids = {tenant_id for _, tenant_id, _ in rows if tenant_id is not None}
+        configs = dict(db.query(Tenant.id, Tenant.config).filter(Tenant.id.in_(tenant_ids)).all()) if tenant_ids else {}
+
+        tenant_weights, campaign_weights = {}, {}
+        for campaign_id, tenant_id, priority in rows:
+            tenant_weights[tenant_id] = _weight((configs.get(tenant_id) or {}).get("dispatch_weight", DEFAULT_WEIGHT))
+            campaign_weights.setdefault(tenant_id, {})[campaign_id] = _weight(priority if priority is not None else DEFAULT_WEIGHT)
+
+        with self._lock:
+            self._tenants.sync(tenant_weights)
+            for tenant_id in list(self._campaigns):
+                if tenant_id not in campaign_weights:
+                    del self._campaigns[tenant_id]
+            for tenant_id, weights in campaign_weights.items():
+                self._campaigns.setdefault(tenant_id, DeficitRoundRobin()).sync(weights)
+            self._refreshed_at = time.monotonic()
+        return len(rows)
+
+    def tenants(self) -> list:
+        """Tenants com campanhas no backlog."""
+        with self._lock:
+            return self._tenants.keys()
+
+    def next_campaign(self, tenant_ids=None) -> Optional[Tuple[object, object]]:
+        """Próximo (tenant_id, campaign_id) a servir (opcionalmente só entre `tenant_ids`), ou None se não houver."""
+        with self._lock:
+            tenant_id = self._tenants.next(tenant_ids)
+            if tenant_id is None:
+                return None
+            return tenant_id, self._campaigns[tenant_id].next()
+
+    def exhausted(self, tenant_id, campaign_id):
+        """A campanha não tem mais eventos prontos: sai do backlog até o próximo refresh."""
+        with self._lock:
+            flows = self._campaigns.get(tenant_id)
+            if flows is None:
+                return
+            flows.remove(campaign_id)
+            if not flows:
+                del self._campaigns[tenant_id]
+                self._tenants.remove(tenant_id)
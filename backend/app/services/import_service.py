@@ -1,32 +1,11 @@
 import pandas as pd
-import re
 import os
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from app.models.models import Contact, LeadPipeline
+from app.core.phone import normalize_phone, phone_key
 import logging
 
-def clean_phone(phone_raw):
-    """
-    Padroniza telefones para o formato E.164 (+55DDDxxxxxxxxx)
-    """
-    if not phone_raw:
-        return None
-    
-    # Converte para string e remove tudo que não é número
-    phone_str = str(phone_raw)
-    digits = re.sub(r'\D', '', phone_str)
-    
-    # Se não tiver dígitos suficientes, descarta
-    if len(digits) < 10:
-        return None
-        
-    # Assume Brasil (+55) se não começar com 55 e tiver 10 ou 11 dígitos
-    if len(digits) in [10, 11]:
-        digits = '55' + digits
-        
-    return f"+{digits}"
-
 def process_excel_import(db: Session, file_path: str):
     print(f"📖 Lendo arquivo para importação: {file_path}")
     
@@ -68,7 +47,7 @@ def process_excel_import(db: Session, file_path: str):
                 # Validação Telefone
                 if not raw_phone:
                     continue
-                phone = clean_phone(raw_phone)
+                phone = normalize_phone(raw_phone)
                 if not phone:
                     # Telefone inválido
                     continue
@@ -95,7 +74,7 @@ def process_excel_import(db: Session, file_path: str):
                             break
 
                 # Verifica Duplicidade e Atualiza
-                existing_contact = db.query(Contact).filter(Contact.phone_e164 == phone).first()
+                existing_contact = db.query(Contact).filter(Contact.phone_key == phone_key(phone)).first()
                 if existing_contact:
                     pipeline = db.query(LeadPipeline).filter(LeadPipeline.contact_id == existing_contact.id).first()
                     if pipeline:
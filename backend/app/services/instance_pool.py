@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings as app_settings
+from app.services.evolution_service import evolution_service
+from app.services.rate_limiter import SendPacer, send_rate_tracker
+
+
+def is_connected(status: Dict) -> bool:
+    """Interpreta o retorno de evolution_service.check_instance_status."""
+    if not isinstance(status, dict):
+        return False
+    if status.get("status") == "not_configured":
+        return True # Evolution não configurada: envios são simulados
+    if "error" in status:
+        return False
+    state = (status.get("instance") or {}).get("state") or status.get("state")
+    return state == "open"
+
+
+class InstanceState:
+    """Saúde e orçamento de UMA instância (número de WhatsApp)."""
+    def __init__(self, name: str):
+        self.name = name
+        self.healthy = True      # Otimista até a primeira checagem
+        self.state = "unknown"
+        self.checked_at = None   # time.monotonic()
+        self.checking = False
+        self.failures = 0        # Falhas de envio consecutivas
+        self.pacer = SendPacer()
+        self.seeded = False
+        self.in_flight = 0
+
+
+class InstancePool:
+    """
+    Pool de instâncias da Evolution usado pelo dispatcher.
+    - Saúde: connectionState checado em segundo plano (cache de INSTANCE_HEALTH_TTL_SECONDS)
+      e falhas de conexão consecutivas nos envios derrubam a instância até a próxima checagem.
+    - Orçamento por instância: limites diário/hora e ritmo (SystemSettings da lane) valem
+      para CADA número, então N números = N vezes o teto por hora. A triagem aqui é local;
+      o envio só sai depois da reserva no banco (campaign_service.reserve_instance).
+    - Atribuição fixa: o contato fica com o número que falou com ele primeiro
+      (Contact.assigned_instance); se esse número cair, o envio vai por outro (failover).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}  # nome -> InstanceState
+        self._executor = None
+
+    def get(self, name: str) -> InstanceState:
+        with self._lock:
+            state = self._states.get(name)
+            if state is None:
+                state = self._states[name] = InstanceState(name)
+            return state
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="instance-health")
+            return self._executor
+
+    def refresh_health(self, names: List[str]):
+        """Agenda checagens vencidas sem bloquear quem chama (o dispatcher)."""
+        now = time.monotonic()
+        for name in names:
+            state = self.get(name)
+            with self._lock:
+                stale = not state.checking and (
+                    state.checked_at is None or now - state.checked_at >= app_settings.INSTANCE_HEALTH_TTL_SECONDS
+                )
+                if stale:
+                    state.checking = True
+            if stale:
+                self._get_executor().submit(self._check, state)
+
+    def _check(self, state: InstanceState):
+        try:
+            status = evolution_service.check_instance_status(state.name)
+            healthy = is_connected(status)
+            label = (status.get("instance") or {}).get("state") or status.get("status") or status.get("error") or "?"
+        except Exception as e:
+            healthy, label = False, str(e)
+        with self._lock:
+            changed = healthy != state.healthy
+            state.healthy = healthy
+            state.state = str(label)[:100]
+            state.checked_at = time.monotonic()
+            state.checking = False
+            if healthy:
+                state.failures = 0
+        if changed:
+            if healthy:
+                logging.info(f"📶 Instância {state.name} conectada novamente.")
+            else:
+                logging.warning(f"📵 Instância {state.name} fora do ar ({state.state}). Envios vão para as demais.")
+
+    def record_result(self, name: str, connection_failure: bool):
+        """Resultado de um envio: N falhas de conexão seguidas tiram a instância do pool até a próxima checagem."""
+        state = self.get(name)
+        with self._lock:
+            state.in_flight = max(state.in_flight - 1, 0)
+            if not connection_failure:
+                state.failures = 0
+                return
+            state.failures += 1
+            if state.healthy and state.failures >= app_settings.INSTANCE_MAX_FAILURES:
+                state.healthy = False
+                state.state = "send_failures"
+                state.checked_at = time.monotonic() # Rechecagem só após o TTL
+                logging.warning(f"📵 Instância {name} com {state.failures} falhas seguidas. Failover para as demais.")
+
+    def healthy(self, names: List[str]) -> List[str]:
+        return [name for name in names if self.get(name).healthy]
+
+    def seconds_until_ready(self, name: str, settings, now: datetime) -> float:
+        """0 se a instância pode enviar agora (limites do dia/hora, ritmo e envios simultâneos)."""
+        state = self.get(name)
+        state.pacer.configure(settings)
+        if not state.seeded:
+            state.pacer.seed_last_send(send_rate_tracker.last_sent_at(name))
+            state.seeded = True
+
+        with self._lock:
+            in_flight = state.in_flight
+        if in_flight >= app_settings.EVOLUTION_MAX_IN_FLIGHT:
+            return app_settings.DISPATCH_IDLE_SECONDS # Callback acorda o loop quando um slot libera
+
+        # Envios em andamento já contam contra os limites
+        if send_rate_tracker.sent_today(name, now=now) + in_flight >= settings.daily_limit:
+            tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            return (tomorrow - now).total_seconds()
+
+        wait = send_rate_tracker.seconds_until_hour_slot(settings.hourly_limit - in_flight, name, now=now)
+        if wait > 0:
+            return wait
+        return state.pacer.seconds_until_ready()
+
+    def ready(self, names: List[str], settings, now: datetime) -> Tuple[List[str], float]:
+        """Instâncias saudáveis prontas agora e, se nenhuma estiver, quanto esperar pela primeira."""
+        ready, wait = [], float("inf")
+        for name in self.healthy(names):
+            seconds = self.seconds_until_ready(name, settings, now)
+            if seconds <= 0:
+                ready.append(name)
+            else:
+                wait = min(wait, seconds)
+        return ready, wait
+
+    def select(self, names: List[str], ready: List[str], sticky: Optional[str], settings, now: datetime) -> Tuple[Optional[str], float]:
+        """
+        Escolhe a instância de um envio: (nome, 0) ou (None, segundos para adiar o evento).
+        Contato atribuído a um número saudável espera por ele; sem atribuição (ou número fora do ar)
+        vai pelo número pronto menos usado na última hora.
+        """
+        if sticky in names and self.get(sticky).healthy:
+            if sticky in ready:
+                return sticky, 0.0
+            return None, max(self.seconds_until_ready(sticky, settings, now), 1.0)
+        if not ready:
+            return None, app_settings.DISPATCH_IDLE_SECONDS
+        return min(ready, key=lambda name: send_rate_tracker.sent_last_hour(name, now=now)), 0.0
+
+    def hold(self, name: str, seconds: float):
+        """Instância sem orçamento no banco (envios de outros dispatchers): não tenta antes de `seconds`."""
+        self.get(name).pacer.hold(seconds)
+
+    def record_send(self, name: str):
+        state = self.get(name)
+        state.pacer.record_send()
+        with self._lock:
+            state.in_flight += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            states = list(self._states.values())
+        return {
+            state.name: {
+                "healthy": state.healthy,
+                "state": state.state,
+                "failures": state.failures,
+                "in_flight": state.in_flight,
+                "sent_last_hour": send_rate_tracker.sent_last_hour(state.name),
+                "sent_today": send_rate_tracker.sent_today(state.name),
+            }
+            for state in states
+        }
+
+instance_pool = InstancePool()
@@ -0,0 +1,101 @@
+import base64
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.core.config import settings
+
+
+class MediaCache:
+    """
+    Cache LRU (limitado em bytes) de mídias locais já convertidas para Base64.
+    A chave é (caminho, mtime, tamanho): o arquivo é lido e codificado UMA vez
+    e reaproveitado para todos os destinatários da campanha.
+    - Leitura e codificação fora do lock global, com single-flight por chave: envios simultâneos
+      da mesma mídia esperam a primeira codificação; mídias diferentes não se bloqueiam.
+    - Mídia maior que max_bytes não entra no LRU, mas a mais recente fica num slot à parte
+      (campanha com vídeo grande também codifica uma vez só).
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (base64, mime_type)
+        self._oversized = None       # (key, (base64, mime_type)) da última mídia acima do limite
+        self._loading = {}           # key -> threading.Event (codificação em andamento)
+        self._lock = threading.Lock()
+
+    def get_base64(self, filepath: str) -> Optional[Tuple[str, str]]:
+        """Retorna (conteúdo em Base64, mime type) ou None se o arquivo não existir."""
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        key = (os.path.abspath(filepath), st.st_mtime_ns, st.st_size)
+
+        while True:
+            with self._lock:
+                item = self._lookup(key)
+                if item is not None:
+                    self.hits += 1
+                    return item
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Outro envio já está codificando esta mídia (se ele falhar, a volta do loop tenta de novo)
+            loading.wait()
+
+        try:
+            item = self._encode(filepath)
+            with self._lock:
+                self._store(key, item)
+            return item
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+
+    def _lookup(self, key) -> Optional[Tuple[str, str]]:
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+            return item
+        if self._oversized is not None and self._oversized[0] == key:
+            return self._oversized[1]
+        return None
+
+    def _encode(self, filepath: str) -> Tuple[str, str]:
+        mime_type, _ = mimetypes.guess_type(filepath)
+        with open(filepath, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode('utf-8')
+        print(f"📸 Convertido arquivo local {os.path.basename(filepath)} para Base64 ({len(encoded)} chars)")
+        return encoded, mime_type or "image/jpeg"
+
+    def _store(self, key, item: Tuple[str, str]):
+        size = len(item[0])
+        if size > self.max_bytes:
+            self._oversized = (key, item)
+            return
+        self._items[key] = item
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (old, _) = self._items.popitem(last=False)
+            self.total_bytes -= len(old)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "oversized_bytes": len(self._oversized[1][0]) if self._oversized else 0,
+                "loading": len(self._loading),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+media_cache = MediaCache(settings.MEDIA_CACHE_MAX_MB * 1024 * 1024)
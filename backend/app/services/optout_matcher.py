@@ -0,0 +1,154 @@
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.models.models import Tenant
+
+# Padrões globais. Tenant pode substituir em Tenant.config["optout_keywords"] / ["optout_phrases"].
+# Keyword = a mensagem inteira (ex: "SAIR"); frase = em qualquer ponto do texto, palavra inteira.
+DEFAULT_KEYWORDS = ['SAIR', 'STOP', 'PARAR', 'CANCELAR', 'UNSUBSCRIBE']
+DEFAULT_PHRASES = [
+    'NAO QUERO MAIS',
+    'PARAR DE RECEBER', 'PARAR DE ENVIAR',
+    'ME TIRA DA LISTA', 'ME REMOVE',
+    'REMOVER DA LISTA', 'NAO TENHO INTERESSE'
+]
+
+# Recompila a configuração do tenant no máximo a cada N segundos (alteração feita em outro processo)
+TENANT_CONFIG_TTL_SECONDS = 60
+
+EXACT = 0
+PHRASE = 1
+
+_NON_WORD = re.compile(r'[^A-Z0-9]+')
+
+
+def fold(text: str) -> str:
+    """Maiúsculas, sem acento, pontuação vira espaço e espaços colapsados: 'Não, quero!' -> 'NAO QUERO'."""
+    if not text:
+        return ""
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _NON_WORD.sub(' ', text.upper()).strip()
+
+
+class OptOutMatcher:
+    """
+    Keywords e frases compiladas num único autômato Aho-Corasick sobre o texto normalizado (fold).
+    Uma passada linear pela mensagem, independente do número de padrões.
+    - Frase: casa só em fronteira de palavra ('ME REMOVE' não casa em 'ME REMOVENDO').
+    - Keyword: casa só se for a mensagem inteira ('Sair!' sim, 'vou sair cedo' não).
+    """
+    def __init__(self, keywords: Iterable[str] = DEFAULT_KEYWORDS, phrases: Iterable[str] = DEFAULT_PHRASES):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, int, str]]] = [[]]  # (tamanho, tipo, padrão)
+        for pattern in keywords or []:
+            self._add(fold(pattern), EXACT)
+        for pattern in phrases or []:
+            self._add(fold(pattern), PHRASE)
+        self._build()
+
+    def _add(self, pattern: str, kind: int):
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), kind, pattern))
+
+    def _build(self):
+        # BFS: link de falha = maior sufixo próprio que também é prefixo de algum padrão
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                if node:
+                    fallback = self._fail[node]
+                    while fallback and ch not in self._goto[fallback]:
+                        fallback = self._fail[fallback]
+                    self._fail[child] = self._goto[fallback].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def match(self, text: str) -> Optional[str]:
+        """Padrão que disparou o opt-out (normalizado) ou None."""
+        folded = fold(text)
+        size = len(folded)
+        goto, fail, out = self._goto, self._fail, self._out
+        root = goto[0]
+        node = 0
+        for end, ch in enumerate(folded, 1):
+            if not node and ch not in root:
+                continue # Caminho comum: caractere que não inicia nenhum padrão
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            for length, kind, pattern in out[node]:
+                start = end - length
+                if kind == EXACT:
+                    if start == 0 and end == size:
+                        return pattern
+                elif (start == 0 or folded[start - 1] == ' ') and (end == size or folded[end] == ' '):
+                    return pattern
+        return None
+
+    def is_opt_out(self, text: str) -> bool:
+        return self.match(text) is not None
+
+
+class OptOutRegistry:
+    """Matcher compilado por tenant (Tenant.config), em cache; padrões globais para quem não configurou."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._default = OptOutMatcher()
+        self._by_tenant = {}  # tenant_id -> (expira_em, matcher)
+
+    @staticmethod
+    def patterns_of(config) -> Tuple[List[str], List[str]]:
+        config = config or {}
+        keywords = config.get("optout_keywords")
+        phrases = config.get("optout_phrases")
+        return (
+            list(keywords) if isinstance(keywords, list) else list(DEFAULT_KEYWORDS),
+            list(phrases) if isinstance(phrases, list) else list(DEFAULT_PHRASES)
+        )
+
+    def for_tenant(self, db: Session, tenant_id=None) -> OptOutMatcher:
+        if not tenant_id:
+            return self._default
+        now = time.monotonic()
+        with self._lock:
+            cached = self._by_tenant.get(tenant_id)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        tenant = db.get(Tenant, tenant_id)
+        config = tenant.config if tenant else None
+        if not config or ("optout_keywords" not in config and "optout_phrases" not in config):
+            matcher = self._default
+        else:
+            matcher = OptOutMatcher(*self.patterns_of(config))
+        with self._lock:
+            self._by_tenant[tenant_id] = (now + TENANT_CONFIG_TTL_SECONDS, matcher)
+        return matcher
+
+    def invalidate(self, tenant_id=None):
+        with self._lock:
+            if tenant_id is None:
+                self._by_tenant.clear()
+            else:
+                self._by_tenant.pop(tenant_id, None)
+
+
+optout_registry = OptOutRegistry()
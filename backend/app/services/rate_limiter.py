@@ -0,0 +1,224 @@
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket clássico: recarrega `rate` tokens por segundo até `capacity`.
+    Thread-safe; usa relógio monotônico para não sofrer com ajustes de hora.
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = max(rate, 0.0)
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def reconfigure(self, rate: float, capacity: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(rate, 0.0)
+            self.capacity = max(capacity, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def consume(self, amount: float = 1.0) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    def seconds_until_available(self, amount: float = 1.0) -> float:
+        """Tempo exato (em segundos) até existir `amount` tokens no balde."""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = amount - self.tokens
+            if missing <= 0:
+                return 0.0
+            if self.rate <= 0:
+                return float("inf")
+            return missing / self.rate
+
+
+class SendPacer:
+    """
+    Ritmo de disparo derivado do SystemSettings.
+    - Token bucket com taxa hourly_limit/3600 (rajada máx. de 1 minuto de tokens).
+    - Intervalo aleatório anti-ban (min/max_interval_seconds) entre envios.
+    O dispatcher consulta `seconds_until_ready` e dorme exatamente esse tempo.
+    """
+    def __init__(self):
+        self.bucket: Optional[TokenBucket] = None
+        self.signature = None
+        self.min_interval = 0.0
+        self.max_interval = 0.0
+        self.next_send_at = 0.0  # time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, settings):
+        signature = (settings.hourly_limit, settings.min_interval_seconds, settings.max_interval_seconds)
+        if signature == self.signature:
+            return
+
+        rate = (settings.hourly_limit or 0) / 3600.0
+        capacity = max(1.0, rate * 60)
+        if self.bucket is None:
+            self.bucket = TokenBucket(rate, capacity)
+        else:
+            self.bucket.reconfigure(rate, capacity)
+
+        self.min_interval = float(settings.min_interval_seconds or 0)
+        self.max_interval = float(max(settings.max_interval_seconds or 0, self.min_interval))
+        self.signature = signature
+
+    def seed_last_send(self, last_sent_at: Optional[datetime]):
+        """Respeita o intervalo do último envio persistido (ex: após restart)."""
+        if not last_sent_at:
+            return
+        elapsed = (datetime.now() - last_sent_at).total_seconds()
+        wait = random.uniform(self.min_interval, self.max_interval) - elapsed
+        if wait > 0:
+            with self._lock:
+                self.next_send_at = max(self.next_send_at, time.monotonic() + wait)
+
+    def seconds_until_ready(self) -> float:
+        if self.bucket is None:
+            return float("inf")
+        with self._lock:
+            gap = self.next_send_at - time.monotonic()
+        return max(gap, self.bucket.seconds_until_available(), 0.0)
+
+    def hold(self, seconds: float):
+        """Adia o próximo envio (ex: orçamento já gasto por outro dispatcher)."""
+        with self._lock:
+            self.next_send_at = max(self.next_send_at, time.monotonic() + seconds)
+
+    def record_send(self) -> bool:
+        """Consome um token e sorteia o próximo intervalo. False se não havia token."""
+        if self.bucket is None or not self.bucket.consume():
+            return False
+        with self._lock:
+            self.next_send_at = time.monotonic() + random.uniform(self.min_interval, self.max_interval)
+        return True
+
+
+ALL_TENANTS = "*"
+
+
+class SendRateTracker:
+    """
+    Contadores de envio em memória, por instância de WhatsApp (ver instance_pool):
+    janela deslizante da última hora, total do dia e timestamp do último envio.
+    Reconstruído do banco no startup (e a cada DISPATCH_TRACKER_RESYNC_SECONDS) e atualizado a cada envio,
+    para que a triagem de instâncias prontas seja O(1) e não toque o banco. É a visão deste processo:
+    o limite de fato vale pela reserva no banco (campaign_service.reserve_instance), que conta
+    os envios de todos os dispatchers.
+    A chave ALL_TENANTS agrega todas as instâncias (limite global).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hour = {}   # instância -> deque[datetime] (ordem cronológica)
+        self._day = {}    # instância -> [date, count]
+        self._last = {}   # instância -> datetime
+        self.loaded = False
+        self.loaded_at = 0.0
+
+    def ensure_loaded(self, db, max_age: float = 0, key_of: Optional[Callable] = None):
+        """
+        Reconstrói do banco só se ainda não carregou.
+        `max_age` > 0 força ressincronização periódica (vários dispatchers em processos distintos).
+        `key_of(tenant_id, instance)` define a chave de cada envio (padrão: a instância gravada no evento).
+        """
+        if not self.loaded or (max_age > 0 and time.monotonic() - self.loaded_at > max_age):
+            self.rebuild(db, key_of)
+
+    def rebuild(self, db, key_of: Optional[Callable] = None):
+        from sqlalchemy import func
+        from app.models.models import Campaign, CampaignEvent
+
+        key_of = key_of or (lambda tenant_id, instance: instance)
+        now = datetime.now()
+        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        since = min(start_of_day, now - timedelta(hours=1))
+
+        recent = db.query(Campaign.tenant_id, CampaignEvent.instance, CampaignEvent.sent_at).join(Campaign).filter(
+            CampaignEvent.status == 'sent',
+            CampaignEvent.sent_at >= since
+        ).order_by(CampaignEvent.sent_at.asc()).all()
+
+        last_by_key = db.query(Campaign.tenant_id, CampaignEvent.instance, func.max(CampaignEvent.sent_at)).join(Campaign).filter(
+            CampaignEvent.status == 'sent'
+        ).group_by(Campaign.tenant_id, CampaignEvent.instance).all()
+
+        with self._lock:
+            self._hour.clear()
+            self._day.clear()
+            self._last.clear()
+            for tenant_id, instance, sent_at in recent:
+                self._add(key_of(tenant_id, instance), sent_at)
+            for tenant_id, instance, sent_at in last_by_key:
+                if sent_at:
+                    for key in (key_of(tenant_id, instance), ALL_TENANTS):
+                        if sent_at > self._last.get(key, datetime.min):
+                            self._last[key] = sent_at
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def _add(self, instance, sent_at: datetime):
+        for key in (instance, ALL_TENANTS):
+            self._hour.setdefault(key, deque()).append(sent_at)
+            day = self._day.setdefault(key, [sent_at.date(), 0])
+            if day[0] != sent_at.date():
+                day[0], day[1] = sent_at.date(), 0
+            day[1] += 1
+            if sent_at > self._last.get(key, datetime.min):
+                self._last[key] = sent_at
+
+    def record(self, instance, sent_at: Optional[datetime] = None):
+        with self._lock:
+            self._add(instance, sent_at or datetime.now())
+
+    def sent_last_hour(self, instance=ALL_TENANTS, now: Optional[datetime] = None) -> int:
+        cutoff = (now or datetime.now()) - timedelta(hours=1)
+        with self._lock:
+            window = self._hour.get(instance)
+            if not window:
+                return 0
+            while window and window[0] < cutoff:
+                window.popleft()
+            return len(window)
+
+    def seconds_until_hour_slot(self, limit: int, instance=ALL_TENANTS, now: Optional[datetime] = None) -> float:
+        """Segundos até a janela da última hora ter vaga para mais um envio."""
+        now = now or datetime.now()
+        if self.sent_last_hour(instance, now) < limit:
+            return 0.0
+        with self._lock:
+            window = self._hour.get(instance)
+            if not window or limit <= 0:
+                return float("inf")
+            expires_at = window[len(window) - limit] + timedelta(hours=1)
+        return max((expires_at - now).total_seconds(), 0.0)
+
+    def sent_today(self, instance=ALL_TENANTS, now: Optional[datetime] = None) -> int:
+        today = (now or datetime.now()).date()
+        with self._lock:
+            day = self._day.get(instance)
+            return day[1] if day and day[0] == today else 0
+
+    def last_sent_at(self, instance=ALL_TENANTS) -> Optional[datetime]:
+        with self._lock:
+            return self._last.get(instance)
+
+send_rate_tracker = SendRateTracker()
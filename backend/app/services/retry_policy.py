@@ -0,0 +1,46 @@
+import random
+from typing import Any, Optional
+import requests
+from app.core.config import settings
+
+# Status HTTP transitórios da Evolution (vale tentar de novo)
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class SendFailure:
+    """Falha de envio classificada: retryable (transitória) ou permanente."""
+    def __init__(self, message: str, retryable: bool, status: Optional[int] = None):
+        self.message = message
+        self.retryable = retryable
+        self.status = status
+
+    def __str__(self):
+        kind = "retryable" if self.retryable else "permanent"
+        prefix = f"HTTP {self.status} " if self.status else ""
+        return f"[{kind}] {prefix}{self.message}"[:500]
+
+
+def classify_result(result: Any) -> Optional[SendFailure]:
+    """Interpreta o dict retornado por evolution_service.send_message. None = sucesso."""
+    if not isinstance(result, dict) or "error" not in result:
+        return None
+    status = result.get("status")
+    if status is None:
+        # Sem status = erro de conexão/timeout (RequestException)
+        return SendFailure(str(result["error"]), retryable=True)
+    return SendFailure(str(result["error"]), retryable=status in RETRYABLE_STATUS or status >= 500, status=status)
+
+
+def classify_exception(error: Exception) -> SendFailure:
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return SendFailure(str(error), retryable=True)
+    # ValueError = configuração ausente/inválida; demais: não insistir
+    return SendFailure(str(error), retryable=False)
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Backoff exponencial com jitter (metade fixa + metade aleatória)."""
+    base = settings.CAMPAIGN_RETRY_BASE_SECONDS * (2 ** max(attempt - 1, 0))
+    capped = min(base, settings.CAMPAIGN_RETRY_MAX_SECONDS)
+    return capped / 2 + random.uniform(0, capped / 2)
+
@@ -0,0 +1,103 @@
+import re
+from datetime import date
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from app.models.models import Contact, Procedure
+
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+# Variáveis que dependem de procedimentos (exigem consulta extra, só quando usadas)
+PROCEDURE_VARIABLES = {"ultimo_procedimento", "data_ultimo_procedimento", "proxima_manutencao"}
+
+TEMPLATE_VARIABLES = {
+    "nome": "Primeiro nome",
+    "primeiro_nome": "Primeiro nome",
+    "nome_completo": "Nome completo",
+    "telefone": "Telefone",
+    "email": "E-mail",
+    "ultimo_procedimento": "Último procedimento realizado",
+    "data_ultimo_procedimento": "Data do último procedimento (dd/mm/aaaa)",
+    "proxima_manutencao": "Próxima manutenção agendada (dd/mm/aaaa)",
+}
+
+
+class CompiledTemplate:
+    """
+    Plano de renderização: lista de (texto literal, variável) montada uma única vez.
+    Renderizar = um único join, sem uma passada de str.replace por variável.
+    """
+    def __init__(self, source: str, parts: Tuple[Tuple[str, Optional[str]], ...]):
+        self.source = source
+        self.parts = parts
+        self.variables = frozenset(var for _, var in parts if var)
+        self.unknown = sorted(v for v in self.variables if v not in TEMPLATE_VARIABLES)
+        self.needs_procedures = bool(self.variables & PROCEDURE_VARIABLES)
+
+    def render(self, values: Dict[str, str]) -> str:
+        out = []
+        for literal, var in self.parts:
+            out.append(literal)
+            if var:
+                # Placeholder desconhecido fica como está (campanhas antigas)
+                out.append(values[var] if var in values else "{" + var + "}")
+        return "".join(out)
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> CompiledTemplate:
+    parts = []
+    pos = 0
+    for match in PLACEHOLDER_RE.finditer(source):
+        parts.append((source[pos:match.start()], match.group(1)))
+        pos = match.end()
+    parts.append((source[pos:], None))
+    return CompiledTemplate(source, tuple(parts))
+
+
+def _fmt_date(value) -> str:
+    return value.strftime("%d/%m/%Y") if value else ""
+
+
+class TemplateService:
+    def unknown_placeholders(self, template: Optional[str]) -> List[str]:
+        """Valida o template na criação da campanha: retorna variáveis não suportadas."""
+        if not template:
+            return []
+        return compile_template(template).unknown
+
+    def render(self, db: Session, template: Optional[str], contact: Contact) -> str:
+        """Renderiza o template (compilado e cacheado) para um contato; procedimentos só se o template usar."""
+        if not template:
+            return ""
+        plan = compile_template(template)
+        full_name = contact.full_name or ""
+        first_name = full_name.split()[0].title() if full_name.split() else ""
+        values = {
+            "nome": first_name,
+            "primeiro_nome": first_name,
+            "nome_completo": full_name,
+            "telefone": contact.phone_e164 or "",
+            "email": contact.email or "",
+        }
+        if plan.needs_procedures:
+            values.update(self._load_procedure_values(db, contact.id))
+        return plan.render(values)
+
+    def _load_procedure_values(self, db: Session, contact_id) -> Dict[str, str]:
+        today = date.today()
+        rows = db.query(
+            Procedure.procedure_name, Procedure.performed_at, Procedure.next_maintenance_date
+        ).filter(Procedure.contact_id == contact_id).order_by(Procedure.performed_at.desc()).all()
+
+        values = dict.fromkeys(PROCEDURE_VARIABLES, "")
+        if rows:
+            # Primeira linha = procedimento mais recente
+            values["ultimo_procedimento"] = rows[0].procedure_name or ""
+            values["data_ultimo_procedimento"] = _fmt_date(rows[0].performed_at)
+        upcoming = [r.next_maintenance_date for r in rows if r.next_maintenance_date and r.next_maintenance_date >= today]
+        if upcoming:
+            values["proxima_manutencao"] = _fmt_date(min(upcoming))
+        return values
+
+template_service = TemplateService()
@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.phone import phone_key
+from app.models.models import Contact, Conversation, LeadPipeline, AIConfig
+
+
+class LRUCache:
+    """Dicionário limitado (LRU) com TTL por item. Thread-safe."""
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # chave -> (expira_em, valor)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ContactContext:
+    """
+    Só os ids do remoteJid (contato + conversa aberta) e a chave do telefone: dispensam a busca pelo telefone.
+    Estado mutável (opt-out, estágio, temperatura, não lidas) é sempre relido do banco: pode ter sido
+    alterado pela API em outro processo (worker separado) e o cache daqui não fica sabendo.
+    """
+    __slots__ = ("contact_id", "conversation_id", "phone_key")
+
+    @classmethod
+    def capture(cls, contact: Contact, conversation: Conversation) -> "ContactContext":
+        ctx = cls()
+        ctx.contact_id = contact.id
+        ctx.conversation_id = conversation.id
+        ctx.phone_key = contact.phone_key
+        return ctx
+
+    def attach(self, db: Session) -> Optional[Tuple[Contact, Conversation, Optional[LeadPipeline]]]:
+        """
+        Contato + conversa + pipeline atuais em UMA consulta por chave primária.
+        None se a conversa não está mais aberta, o contato sumiu ou trocou de telefone
+        (o chamador refaz a busca completa). Por isso o cache não precisa de invalidação.
+        """
+        row = db.query(Contact, Conversation, LeadPipeline).join(
+            Conversation, Conversation.contact_id == Contact.id
+        ).outerjoin(
+            LeadPipeline, LeadPipeline.contact_id == Contact.id
+        ).filter(
+            Contact.id == self.contact_id,
+            Contact.phone_key == self.phone_key,
+            Conversation.id == self.conversation_id,
+            Conversation.status == 'open'
+        ).first()
+        return tuple(row) if row else None
+
+
+@lru_cache(maxsize=256)
+def _whitelist_keys(numbers: tuple) -> frozenset:
+    return frozenset(k for k in (phone_key(x) for x in numbers) if k)
+
+
+class AIConfigSnapshot:
+    """Configuração da IA já com a whitelist normalizada (normalização em cache pela lista)."""
+    __slots__ = ("is_active", "system_prompt", "model_name", "whitelist_numbers", "whitelist_keys")
+
+    def __init__(self, config: AIConfig):
+        self.is_active = config.is_active
+        self.system_prompt = config.system_prompt
+        self.model_name = config.model_name
+        self.whitelist_numbers = list(config.whitelist_numbers or [])
+        self.whitelist_keys = _whitelist_keys(tuple(str(x) for x in self.whitelist_numbers))
+
+
+class WebhookCache:
+    """
+    Cache por processo do webhook: remoteJid -> ids do contato e da conversa aberta.
+    Conversa movimentada não repete a busca pelo telefone nem a da conversa.
+    - LRU limitado (WEBHOOK_CACHE_MAX_ENTRIES) + TTL (WEBHOOK_CACHE_TTL_SECONDS).
+    - Nada mutável fica em cache (nem a configuração da IA): alterações feitas pela API em outro
+      processo valem já na próxima mensagem. Conversa fechada, contato removido ou telefone alterado
+      caem na busca completa (attach confere), então nenhuma escrita precisa invalidar o cache.
+    """
+    def __init__(self):
+        self.contacts = LRUCache(settings.WEBHOOK_CACHE_MAX_ENTRIES, settings.WEBHOOK_CACHE_TTL_SECONDS)
+
+    def lookup(self, remote_jid: str) -> Optional[ContactContext]:
+        return self.contacts.get(remote_jid)
+
+    def remember(self, remote_jid: str, contact: Contact, conversation: Conversation):
+        if not remote_jid or conversation is None:
+            return
+        self.contacts.put(remote_jid, ContactContext.capture(contact, conversation))
+
+    def forget(self, remote_jid: str):
+        """Descarta o retrato de um remoteJid (ex: falha ao processar com dados do cache)."""
+        self.contacts.pop(remote_jid)
+
+    def invalidate_all(self):
+        self.contacts.clear()
+
+    def ai_config(self, db: Session, tenant_id=None) -> Optional[AIConfigSnapshot]:
+        """
+        Configuração da IA do tenant (ou a global, tenant_id NULL), lida a cada mensagem (liga/desliga e whitelist).
+        Nunca cai na configuração de outro tenant.
+        """
+        config = None
+        if tenant_id:
+            config = db.query(AIConfig).filter(AIConfig.tenant_id == tenant_id).first()
+        if not config:
+            config = db.query(AIConfig).filter(AIConfig.tenant_id == None).first()
+        if not config:
+            return None
+        return AIConfigSnapshot(config)
+
+    def stats(self) -> dict:
+        return {
+            "contacts": len(self.contacts),
+            "hits": self.contacts.hits,
+            "misses": self.contacts.misses
+        }
+
+webhook_cache = WebhookCache()
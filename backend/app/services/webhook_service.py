@@ -0,0 +1,313 @@
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+from app.core.phone import normalize_phone, phone_key
+from app.models.models import Contact, Conversation, Message, LeadPipeline, Campaign, CampaignEvent
+from app.services.ai_reply_scheduler import ai_reply_scheduler
+from app.services.evolution_service import evolution_service
+from app.services.optout_matcher import optout_registry
+from app.services.webhook_cache import webhook_cache
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def insert_ignoring_duplicate(db: Session, model, values: dict) -> bool:
+    """INSERT ... ON CONFLICT DO NOTHING. Retorna False se a linha já existia (violação de índice único)."""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        result = db.execute(dialect_insert(model).values(**values).on_conflict_do_nothing())
+        return result.rowcount > 0
+
+    # Outros bancos: savepoint + IntegrityError
+    try:
+        with db.begin_nested():
+            db.execute(insert(model).values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+def remote_jid_of(payload: dict) -> str:
+    """Chave de ordenação do inbox: mensagens do mesmo contato são processadas em ordem."""
+    data = payload.get('data') or {}
+    return ((data.get('key') or {}).get('remoteJid') or '')[:100]
+
+
+class WebhookService:
+    def process_payload(self, db: Session, payload: dict) -> dict:
+        """
+        Processa um evento da Evolution (mensagem recebida/enviada):
+        contato, conversa, opt-out, pipeline, rastreio de campanha e resposta da IA.
+        Roda no worker do inbox (webhook_worker), fora da requisição do webhook.
+
+        Uma única transação: tudo é gravado com um flush e um commit. Efeitos externos
+        (envio pela Evolution, aviso ao worker da IA) vão para o outbox e só rodam depois do commit,
+        então um erro não deixa estado parcial nem mensagem enviada sem registro.
+        Exceções antes do commit sobem para o worker decidir retry/falha.
+        """
+        # 1. Identificar Evento (Flexível: aceita 'type' ou 'event', Upper ou Lower)
+        event = payload.get('type') or payload.get('event')
+
+        # Se não for MESSAGES_UPSERT, loga warning mas tenta processar sem bloquear rigidamente
+        if not event or 'MESSAGES_UPSERT' not in event.upper():
+            pass 
+
+        # 2. Extrair Dados Principais
+        data = payload.get('data', {})
+        key = data.get('key', {})
+        content_obj = data.get('message', {})
+
+        if not content_obj:
+            return {"status": "ignored_no_content"}
+
+        remote_jid = key.get('remoteJid', '')
+        from_me = key.get('fromMe', False)
+        push_name = data.get('pushName', 'Desconhecido')
+        msg_id = key.get('id')
+        instance_name = payload.get('instance') # Número (instância) que recebeu/enviou a mensagem
+
+        outbox = [] # Efeitos externos: executados só depois do commit
+
+        # 3. Telefone -> chave canônica (com/sem 9º dígito caem na mesma chave)
+        phone_raw = remote_jid.split('@')[0]
+        conversation = pipeline = contact = None
+
+        # Cache: ids do contato + conversa aberta; estado atual relido em 1 consulta por chave primária
+        cached = webhook_cache.lookup(remote_jid)
+        found = cached.attach(db) if cached else None
+        if found:
+            contact, conversation, pipeline = found
+        else:
+            if cached:
+                webhook_cache.forget(remote_jid) # Conversa fechada / contato removido em outro processo
+            # Busca contato no BD (1 consulta indexada)
+            contact_key = phone_key(f"+{phone_raw.lstrip('+')}")
+            contact = db.query(Contact).filter(Contact.phone_key == contact_key).first() if contact_key else None
+
+        # 4. Auto-Create Contact (Se não achar, cria na hora para garantir persistência)
+        if not contact:
+            print(f"👤 Novo Contato Detectado: {push_name} ({phone_raw})")
+            new_phone = normalize_phone(f"+{phone_raw.lstrip('+')}") or f"+{phone_raw.lstrip('+')}"
+            contact = Contact(
+                full_name=push_name,
+                phone_e164=new_phone,
+                type='lead',
+                source='whatsapp_inbound'
+            )
+            db.add(contact)
+            db.flush() # Gera o id (sem commit)
+
+        # Atribuição fixa: o contato fica com o primeiro número que conversou com ele
+        if instance_name and not contact.assigned_instance:
+            contact.assigned_instance = instance_name
+
+        # 5. Garantir Conversa Aberta
+        if not conversation:
+            conversation = db.query(Conversation).filter(
+                Conversation.contact_id == contact.id,
+                Conversation.status == 'open'
+            ).first()
+
+        if not conversation:
+            conversation = Conversation(contact_id=contact.id)
+            db.add(conversation)
+            db.flush()
+
+        # 6. Processar Conteúdo da Mensagem
+        text_content = ""
+        msg_type = "text"
+
+        if 'conversation' in content_obj:
+            text_content = content_obj['conversation']
+        elif 'extendedTextMessage' in content_obj:
+            text_content = content_obj['extendedTextMessage'].get('text', '')
+        elif 'imageMessage' in content_obj:
+            text_content = content_obj['imageMessage'].get('caption', '<Imagem>')
+            msg_type = "image"
+        elif 'audioMessage' in content_obj:
+            text_content = "<Áudio>"
+            msg_type = "audio"
+        else:
+            # Fallback para debug
+            text_content = f"[{list(content_obj.keys())[0]}]"
+            msg_type = "media"
+
+        # 7. Evitar Duplicidade de ID: grava a mensagem primeiro (ON CONFLICT DO NOTHING).
+        # Reentrega/retry da Evolution para aqui: sem unread, sem pipeline, sem IA.
+        inserted = insert_ignoring_duplicate(db, Message, {
+            "id": uuid.uuid4(),
+            "tenant_id": contact.tenant_id,
+            "conversation_id": conversation.id,
+            "external_id": msg_id,
+            "direction": 'outbound' if from_me else 'inbound',
+            "content": text_content,
+            "content_type": msg_type,
+            "status": 'received',
+            "timestamp": func.now()
+        })
+        if not inserted:
+            db.rollback()
+            print(f"♻️ Mensagem duplicada ignorada: {msg_id}")
+            return {"status": "duplicate", "id": msg_id}
+
+        # ATUALIZAÇÃO INTELIGENTE DE PIPELINE
+        # Buscar ou criar pipeline se não existir
+        if not pipeline:
+            pipeline = db.query(LeadPipeline).filter(LeadPipeline.contact_id == contact.id).first()
+        if not pipeline:
+            pipeline = LeadPipeline(contact_id=contact.id, stage="novo", temperature="frio", unread_count=0)
+            db.add(pipeline)
+            db.flush() # Já persistido: o incremento abaixo é um UPDATE
+
+        if not from_me: # Inbound (Cliente mandou)
+            # --- STOP/OPT-OUT Logic (Anti-Ban) ---
+            # Keywords/frases do tenant compiladas num autômato (sem acento, palavra inteira)
+            opt_out_trigger = optout_registry.for_tenant(db, contact.tenant_id).match(text_content)
+            is_opt_out_trigger = opt_out_trigger is not None
+
+            if is_opt_out_trigger:
+                 print(f"⛔ Lead {contact.full_name} solicitou OPT-OUT (Trigger: {opt_out_trigger}).")
+                 contact.is_opt_out = True
+                 # Move para Bloqueado
+                 pipeline.stage = 'bloqueado' 
+                 pipeline.temperature = 'frio'
+
+                 # Save Outbound message (Confirmation)
+                 cfm_msg = Message(conversation_id=conversation.id, direction='outbound', content="[SYSTEM] Remoção confirmada (OPT-OUT).", status='sent')
+                 db.add(cfm_msg)
+                 db.commit()
+                 webhook_cache.remember(remote_jid, contact, conversation)
+
+                 # Send confirmation (depois do commit)
+                 phone = contact.phone_e164
+                 outbox.append(lambda: evolution_service.send_message(phone, "Entendido. Você foi removido da nossa lista e não receberá mais mensagens. ✅", instance=instance_name))
+                 self._flush_outbox(db, outbox)
+                 return {"status": "opt_out_processed"}
+
+            # ------------------------------------
+
+            # --- COMANDO DE RESET PARA TESTES ---
+            if text_content and text_content.strip().lower() == '/reset':
+                print(f"🧹 RESET RECEBIDO DE {contact.full_name}. Limpando histórico...")
+                conversation_ids = select(Conversation.id).where(Conversation.contact_id == contact.id)
+                db.query(Message).filter(Message.conversation_id.in_(conversation_ids)).delete(synchronize_session=False)
+                pipeline.stage = 'novo'
+                pipeline.temperature = 'frio'
+                pipeline.unread_count = 0
+                db.commit()
+                webhook_cache.remember(remote_jid, contact, conversation)
+                return {"status": "reset_performed"}
+            # ------------------------------------
+
+            # Atualiza stage se for Novo, pois já houve interação
+            if pipeline.stage == 'novo' or pipeline.stage is None:
+                print(f"🚀 DEBUG: Movendo Lead {contact.full_name} de NOVO -> CONTACTADO")
+                pipeline.stage = 'contactado'
+
+            # NÃO mover para 'nao_lido' forçadamente. Manter no estágio atual.
+            # Apenas incrementar contador.
+            # No SQL (unread_count + 1): outro processo/tela pode ter mudado o valor desde a leitura
+            pipeline.unread_count = func.coalesce(LeadPipeline.unread_count, 0) + 1
+            db.flush() # Valor resultante é relido do banco na regra da IA abaixo
+
+            # --- CAMPAIGN TRACKING ---
+            try:
+                from datetime import datetime, timedelta
+                # Busca evento de campanha recente (ultimas 72h) que ainda não foi respondido
+                # Assim sabemos que esta mensagem é uma REAÇÃO à campanha
+                limit_date = datetime.now() - timedelta(hours=72)
+
+                recent_event = db.query(CampaignEvent).filter(
+                    CampaignEvent.contact_id == contact.id,
+                    CampaignEvent.status == 'sent',
+                    CampaignEvent.replied_at == None,
+                    CampaignEvent.processed_at >= limit_date
+                ).order_by(CampaignEvent.processed_at.desc()).first()
+
+                if recent_event:
+                    recent_event.replied_at = func.now()
+                    print(f"🎯 Resposta vinculada à campanha: {recent_event.campaign_id}")
+            except Exception as e:
+                print(f"⚠️ Erro ao rastrear campanha: {e}")
+            # -------------------------
+        else: # Outbound (Eu mandei)
+            if ai_reply_scheduler.is_sending(db, conversation.id):
+                # Eco da resposta da IA chegando antes dela ser gravada (depois, cai na deduplicação):
+                # não é atendente, não cancela o próximo job nem zera as não lidas
+                print(f"🤖 Eco da resposta da IA para {contact.full_name}.")
+            else:
+                pipeline.unread_count = 0
+                # Atendente respondeu: cancela a IA pendente
+                ai_reply_scheduler.cancel(db, conversation.id)
+            # Se eu respondi, e ele estava em Novo ou Não Lido -> Move para Contactado
+            if pipeline.stage in ['novo', 'nao_lido']:
+                pipeline.stage = 'contactado'
+                print(f"🔄 Lead {contact.full_name} movido para CONTACTADO (Resposta Enviada)")
+
+        # 8. Mensagem já gravada no passo 7
+        contact.last_interaction_at = func.now()
+
+        # 9. IA AUTOMATION
+        # Executar lógica de BOT se habilitado (decide agora; a chamada da IA vai para o outbox)
+        ai_config = webhook_cache.ai_config(db, contact.tenant_id)
+        should_reply = False
+
+        print(f"🔍 DEBUG: Pipeline Stage={pipeline.stage} Temp={pipeline.temperature} Unread={pipeline.unread_count}")
+
+        if ai_config and ai_config.is_active:
+            # 1. Whitelist Check (Prioridade Máxima para Testes)
+            # Mesma chave canônica do contato (ignora formatação e 9º dígito)
+            c_clean = contact.phone_key or phone_key(contact.phone_e164)
+            w_clean = ai_config.whitelist_keys
+
+            is_whitelisted = c_clean in w_clean
+
+            # Debug Fail
+            if not is_whitelisted:
+                 print(f"🔍 DEBUG: Whitelist falhou. Clean={c_clean} List={w_clean}")
+
+            # CORREÇÃO CRÍTICA: Só responde se mensagem vier do CLIENTE (not from_me)
+            if is_whitelisted and not from_me:
+                # Respeitar parada se já foi finalizado (agendado/perdido), mesmo na whitelist
+                if pipeline.stage in ['agendado', 'perdido']:
+                    print(f"🛡️ Whitelist: Lead finalizado ({pipeline.stage}). IA Pausada.")
+                    should_reply = False
+                else:
+                    print(f"🛡️ Whitelist MATCH: Respondendo {contact.full_name} (Modo Teste)")
+                    should_reply = True
+
+            # 2. Regra Padrão (SÓ QUENTES na Homologação)
+            elif pipeline.temperature == 'quente' and (pipeline.unread_count or 0) > 0:
+                if pipeline.stage not in ['agendado', 'perdido']:
+                    should_reply = True
+
+        if should_reply:
+            # Job da IA na mesma transação; rajada de mensagens do lead = 1 resposta (ai_reply_scheduler)
+            ai_reply_scheduler.schedule(db, conversation.id, contact.tenant_id, contact.id, instance_name)
+            outbox.append(ai_reply_scheduler.notify)
+
+        # Único commit da mensagem
+        db.commit()
+        webhook_cache.remember(remote_jid, contact, conversation)
+        print(f"✅ Recebido: {contact.full_name} diz: {text_content[:30]}...")
+
+        self._flush_outbox(db, outbox)
+        return {"status": "saved", "id": msg_id}
+
+    def _flush_outbox(self, db: Session, outbox: list):
+        """Efeitos externos depois do commit. Uma falha aqui não desfaz nem reprocessa a mensagem (já gravada)."""
+        for effect in outbox:
+            try:
+                effect()
+            except Exception as e:
+                db.rollback()
+                logger.exception(f"⚠️ Erro pós-commit no webhook: {e}")
+
+webhook_service = WebhookService()
@@ -0,0 +1,237 @@
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import select, exists, or_, and_
+from sqlalchemy.orm import Session, aliased
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.models import WebhookInbox
+from app.services.webhook_cache import webhook_cache
+from app.services.webhook_service import webhook_service, remote_jid_of
+
+# Limpeza de itens processados antigos (no máximo a cada 10 min)
+PURGE_INTERVAL_SECONDS = 600
+
+
+class WebhookWorker:
+    """
+    Processa o inbox do webhook em background.
+    - O endpoint só grava o payload (WebhookInbox) e responde: latência estável sob rajada.
+    - Um feeder reserva itens pendentes (claim com lease, seguro com N processos) e distribui
+      entre WEBHOOK_WORKERS threads por hash do remote_jid: o mesmo contato cai sempre na mesma
+      thread, então suas mensagens são processadas em ordem de chegada.
+    - Só o item mais antigo não processado de cada contato é reservado (nem outro processo pega o seguinte).
+    - Falha: volta para pending até WEBHOOK_MAX_ATTEMPTS, depois 'failed'.
+    """
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._feeder = None
+        self._threads = []
+        self._queues = []
+        self._last_purge = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._feeder and self._feeder.is_alive())
+
+    def start(self):
+        if self.running or settings.WEBHOOK_WORKERS <= 0:
+            return
+        self._stop.clear()
+        self._queues = [queue.Queue() for _ in range(settings.WEBHOOK_WORKERS)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"webhook-worker-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self._feeder = threading.Thread(target=self.run, name="webhook-feeder", daemon=True)
+        self._feeder.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._feeder:
+            self._feeder.join(timeout)
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        # O que ficou reservado e não foi processado volta para a fila
+        db = SessionLocal()
+        try:
+            self.release(db, claimed_by=self.worker_id)
+        finally:
+            db.close()
+
+    def notify(self):
+        """Chamado pelo endpoint: item novo no inbox."""
+        self._wake.set()
+
+    def enqueue(self, db: Session, payload: dict) -> WebhookInbox:
+        """Grava o payload no inbox durável (uma única escrita, sem lookup)."""
+        item = WebhookInbox(
+            remote_jid=remote_jid_of(payload),
+            event=str(payload.get('type') or payload.get('event') or '')[:50],
+            payload=payload,
+            status='pending'
+        )
+        db.add(item)
+        db.commit()
+        self.notify()
+        return item
+
+    # ---------- Feeder ----------
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            db = SessionLocal()
+            claimed = []
+            try:
+                self.release(db)
+                self._purge(db)
+                free = sum(1 for q in self._queues if q.empty())
+                if free:
+                    claimed = self.claim(db, limit=free * 8)
+                for item_id, remote_jid in claimed:
+                    self._queues[zlib.crc32(remote_jid.encode()) % len(self._queues)].put(item_id)
+            except Exception as e:
+                print(f"Webhook Worker Error: {e}")
+            finally:
+                db.close()
+
+            if not claimed:
+                self._wake.wait(settings.WEBHOOK_POLL_SECONDS)
+
+    def claim(self, db: Session, limit: int) -> list:
+        """
+        Reserva itens pendentes em ordem de chegada, só o mais antigo não processado de cada contato:
+        item com outro anterior ainda pendente (ex: falhou e aguarda nova tentativa) ou em processamento
+        espera a vez, então o mesmo contato nunca é processado fora de ordem nem em paralelo.
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=settings.WEBHOOK_LEASE_SECONDS)
+        busy = aliased(WebhookInbox)
+        candidates = select(WebhookInbox.id).where(
+            WebhookInbox.status == 'pending',
+            ~exists().where(
+                busy.remote_jid == WebhookInbox.remote_jid,
+                or_(busy.status == 'processing', and_(busy.status == 'pending', busy.id < WebhookInbox.id))
+            )
+        ).order_by(WebhookInbox.id.asc()).limit(limit)
+
+        claim = {
+            WebhookInbox.status: 'processing',
+            WebhookInbox.claimed_by: self.worker_id,
+            WebhookInbox.claim_expires_at: expires_at
+        }
+        if db.get_bind().dialect.name == "postgresql":
+            ids = db.execute(candidates.with_for_update(skip_locked=True, of=WebhookInbox)).scalars().all()
+            if ids:
+                db.query(WebhookInbox).filter(WebhookInbox.id.in_(ids)).update(claim, synchronize_session=False)
+        else:
+            db.query(WebhookInbox).filter(
+                WebhookInbox.id.in_(candidates.scalar_subquery()),
+                WebhookInbox.status == 'pending'
+            ).update(claim, synchronize_session=False)
+            ids = db.execute(select(WebhookInbox.id).where(
+                WebhookInbox.status == 'processing',
+                WebhookInbox.claimed_by == self.worker_id,
+                WebhookInbox.claim_expires_at == expires_at
+            )).scalars().all()
+        db.commit()
+
+        if not ids:
+            return []
+        return db.query(WebhookInbox.id, WebhookInbox.remote_jid).filter(
+            WebhookInbox.id.in_(ids)
+        ).order_by(WebhookInbox.id.asc()).all()
+
+    def release(self, db: Session, claimed_by: str = None) -> int:
+        """Devolve para pending itens com lease vencido (processo caiu) ou, no stop, os deste worker."""
+        query = db.query(WebhookInbox).filter(WebhookInbox.status == 'processing')
+        if claimed_by:
+            query = query.filter(WebhookInbox.claimed_by == claimed_by)
+        else:
+            query = query.filter(WebhookInbox.claim_expires_at < datetime.now())
+        released = query.update({
+            WebhookInbox.status: 'pending',
+            WebhookInbox.claimed_by: None,
+            WebhookInbox.claim_expires_at: None
+        }, synchronize_session=False)
+        db.commit()
+        if released:
+            logging.warning(f"♻️ {released} item(ns) do inbox do webhook voltaram para a fila.")
+        return released
+
+    def _purge(self, db: Session):
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = datetime.now() - timedelta(hours=settings.WEBHOOK_RETENTION_HOURS)
+        deleted = db.query(WebhookInbox).filter(
+            WebhookInbox.status == 'done',
+            WebhookInbox.processed_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        if deleted:
+            logging.info(f"🧹 {deleted} item(ns) antigos removidos do inbox do webhook.")
+
+    # ---------- Processamento ----------
+
+    def _work(self, q: queue.Queue):
+        while True:
+            item_id = q.get()
+            if item_id is None:
+                break
+            if self._stop.is_set():
+                continue # Sobra da fila: stop() devolve para pending
+            self.process(item_id)
+            self._wake.set() # Libera o próximo item deste contato
+
+    def process(self, item_id: int):
+        # Sem expirar no commit: o processamento relê contato/pipeline depois de cada commit parcial
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            item = db.get(WebhookInbox, item_id)
+            if not item or item.status != 'processing':
+                return
+            payload = item.payload
+            try:
+                webhook_service.process_payload(db, payload)
+            except Exception as e:
+                traceback.print_exc()
+                db.rollback()
+                webhook_cache.forget(remote_jid_of(payload)) # Retrato pode estar desatualizado
+                item = db.get(WebhookInbox, item_id)
+                item.attempts = (item.attempts or 0) + 1
+                item.last_error = str(e)[:500]
+                item.status = 'failed' if item.attempts >= settings.WEBHOOK_MAX_ATTEMPTS else 'pending'
+                item.claimed_by = None
+                item.claim_expires_at = None
+                db.commit()
+                print(f"❌ Erro Webhook (item {item_id}, tentativa {item.attempts}): {e}")
+                return
+
+            item = db.get(WebhookInbox, item_id)
+            item.status = 'done'
+            item.processed_at = datetime.now()
+            item.claimed_by = None
+            item.claim_expires_at = None
+            db.commit()
+        except Exception as e:
+            print(f"Webhook Worker Error (item {item_id}): {e}")
+        finally:
+            db.close()
+
+webhook_worker = WebhookWorker()
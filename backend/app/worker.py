@@ -0,0 +1,63 @@
+"""
+Worker de Disparos standalone (fora do processo da API).
+
+Uso:
+    python -m app.worker
+
+Na API, defina RUN_EMBEDDED_WORKER=false para não subir o worker embutido.
+Este processo também drena o inbox do webhook (webhook_worker) e os jobs de resposta da IA (ai_reply_scheduler).
+Assim API e capacidade de disparo escalam de forma independente
+(vários workers podem drenar a mesma fila graças ao claim com lease).
+"""
+import signal
+import threading
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.campaign_service import campaign_service
+from app.services.dispatcher_service import campaign_dispatcher
+from app.services.campaign_scheduler import campaign_scheduler
+from app.services.webhook_worker import webhook_worker
+from app.services.ai_reply_scheduler import ai_reply_scheduler
+
+
+def run_tick_loop(stop_event: threading.Event):
+    # Modo legado: 1 item da fila a cada 10 segundos
+    while not stop_event.is_set():
+        db = SessionLocal()
+        try:
+            campaign_service.process_queue(db, worker_id=campaign_dispatcher.worker_id)
+        except Exception as e:
+            print(f"Worker Error: {e}")
+        finally:
+            db.close()
+        stop_event.wait(10)
+
+
+def main():
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        print(f"🛑 Sinal {signum} recebido. Finalizando envio atual e encerrando...")
+        stop_event.set()
+        webhook_worker.stop()
+        ai_reply_scheduler.stop()
+        campaign_scheduler.stop()
+        campaign_dispatcher.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    print(f"🚀 Worker de Disparos {campaign_dispatcher.worker_id} (modo {settings.CAMPAIGN_DISPATCH_MODE})")
+    campaign_scheduler.start() # Campanhas com scheduled_at
+    webhook_worker.start() # Inbox do webhook (ACK imediato na API)
+    ai_reply_scheduler.start() # Respostas da IA (jobs com limite por tenant)
+    if settings.CAMPAIGN_DISPATCH_MODE == "tick":
+        run_tick_loop(stop_event)
+    else:
+        campaign_dispatcher.run()
+    print("✅ Worker encerrado.")
+
+
+if __name__ == "__main__":
+    main()
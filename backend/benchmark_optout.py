@@ -0,0 +1,80 @@
+"""
+Benchmark do detector de opt-out: loop antigo do webhook x autômato (app.services.optout_matcher).
+
+Uso (dentro de backend/):
+    python benchmark_optout.py
+
+extra_phrases simula tenant com lista maior (o loop cresce com o nº de frases; o autômato não).
+Com as 7 frases padrão o loop (busca 'in' em C) ainda é mais rápido em números absolutos;
+ambos ficam na casa dos microssegundos, bem abaixo de uma ida ao banco.
+"""
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from app.services.optout_matcher import DEFAULT_KEYWORDS, DEFAULT_PHRASES, OptOutMatcher
+
+SAMPLES = [
+    "Oi, tudo bem? Gostaria de saber o valor da consulta",
+    "Pode ser amanhã às 15h?",
+    "Não quero mais receber mensagens",
+    "sair",
+    "Obrigada pelo retorno! Vou ver com meu marido e te aviso",
+    "me tira da lista por favor",
+    "Qual o endereço da clínica? Tem estacionamento?",
+    "Ok",
+]
+
+
+def legacy_is_opt_out(text: str) -> bool:
+    """Lógica antiga do webhook (referência do benchmark)."""
+    msg_upper = text.strip().upper() if text else ""
+    exact_keywords = ['SAIR', 'STOP', 'PARAR', 'CANCELAR', 'UNSUBSCRIBE']
+    phrases = [
+        'NAO QUERO MAIS', 'NÃO QUERO MAIS',
+        'PARAR DE RECEBER', 'PARAR DE ENVIAR',
+        'ME TIRA DA LISTA', 'ME REMOVE',
+        'REMOVER DA LISTA', 'NÃO TENHO INTERESSE',
+        'NAO TENHO INTERESSE'
+    ]
+    if msg_upper in exact_keywords:
+        return True
+    for ph in phrases:
+        if ph in msg_upper:
+            return True
+    return False
+
+
+def benchmark(messages: int = 20000, extra_phrases: int = 0) -> dict:
+    """Compara o loop antigo com o autômato no mesmo corpus de mensagens."""
+    corpus = [SAMPLES[i % len(SAMPLES)] + (" " * (i % 3)) for i in range(messages)]
+    phrases = list(DEFAULT_PHRASES) + [f"FRASE EXTRA {i}" for i in range(extra_phrases)]
+    matcher = OptOutMatcher(DEFAULT_KEYWORDS, phrases)
+
+    def legacy(text):
+        if legacy_is_opt_out(text):
+            return True
+        upper = text.upper()
+        return any(ph in upper for ph in phrases[len(DEFAULT_PHRASES):])
+
+    results = {}
+    for name, fn in (("loop", legacy), ("automato", matcher.is_opt_out)):
+        started = time.perf_counter()
+        hits = sum(1 for text in corpus if fn(text))
+        elapsed = time.perf_counter() - started
+        results[name] = {"seconds": round(elapsed, 4), "us_per_msg": round(elapsed / messages * 1e6, 2), "hits": hits}
+    return results
+
+
+def main():
+    for extra in (0, 200):
+        result = benchmark(extra_phrases=extra)
+        print(f"📊 {len(DEFAULT_PHRASES) + extra} frases:")
+        for name, row in result.items():
+            print(f"   {name:9s} {row['us_per_msg']:8.2f} µs/msg  ({row['hits']} opt-outs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,10 @@ if [ ! -d "/app/dados" ]; then
     mkdir -p /app/dados
 fi
 
-# 3. Setup Banco
-echo "🛠️  Configurando Banco de Dados..."
-python setup_database.py
+# 3. Banco: migrations do Alembic criam/atualizam tudo (tabelas, colunas, índices)
+# (setup_database.py fica para desenvolvimento local)
+echo "🗂️  Aplicando migrations (Alembic)..."
+alembic upgrade head || exit 1
 
 # 4. Criar Admin
 echo "👤 Criando Admin..."
@@ -9,6 +9,86 @@ from app.db.session import engine
 from app.db.base import Base
 # Import all models so Base knows them
 from app.models import models
+from app.core.phone import phone_key
+
+def add_column(table: str, column_ddl: str):
+    """ALTER TABLE idempotente em transação própria (no Postgres um erro aborta a transação inteira)."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_ddl};"))
+        print(f"✅ Coluna '{column_ddl.split()[0]}' adicionada em '{table}'.")
+    except Exception:
+        pass # Already exists
+
+def create_indexes():
+    """Índices declarados nos models (create_all só cria em tabelas novas). Cada um em transação própria."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                with engine.begin() as conn:
+                    index.create(bind=conn, checkfirst=True)
+            except Exception as e:
+                # Ex: duplicados impedem o índice único (tenant_id, phone_e164)
+                print(f"⚠️ Índice '{index.name}' não criado: {str(e).splitlines()[0]}")
+
+def backfill_phone_keys(batch_size: int = 1000):
+    """Preenche contacts.phone_key dos contatos antigos (novos já gravam pelo model)."""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, phone_e164 FROM contacts WHERE phone_key IS NULL AND phone_e164 IS NOT NULL LIMIT :n"
+            ), {"n": batch_size}).fetchall()
+            # Telefone inválido fica com chave '' para não voltar no próximo lote
+            updates = [{"id": row[0], "key": phone_key(row[1]) or ""} for row in rows]
+            if updates:
+                conn.execute(text("UPDATE contacts SET phone_key = :key WHERE id = :id"), updates)
+        total += len(updates)
+        if len(rows) < batch_size:
+            break
+    if total:
+        print(f"✅ phone_key preenchido em {total} contato(s).")
+
+def dedupe_messages():
+    """Remove mensagens duplicadas (mesmo tenant + external_id) antes dos índices únicos do webhook."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE messages SET external_id = NULL WHERE external_id = 'ai-now()'"))
+            deleted = conn.execute(text("""
+                DELETE FROM messages WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY tenant_id, external_id ORDER BY timestamp, id
+                        ) AS rn
+                        FROM messages WHERE external_id IS NOT NULL
+                    ) ranked WHERE rn > 1
+                )
+            """)).rowcount
+        if deleted:
+            print(f"✅ {deleted} mensagem(ns) duplicada(s) removida(s).")
+    except Exception as e:
+        print(f"⚠️ Deduplicação de mensagens falhou: {str(e).splitlines()[0]}")
+
+def dedupe_campaign_events():
+    """Remove eventos duplicados (mesma campanha + contato) antes do índice único do enfileiramento."""
+    try:
+        with engine.begin() as conn:
+            deleted = conn.execute(text("""
+                DELETE FROM campaign_events WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY campaign_id, contact_id
+                            ORDER BY CASE status WHEN 'sent' THEN 0 WHEN 'claimed' THEN 1 WHEN 'queued' THEN 3 ELSE 2 END,
+                                     processed_at, id
+                        ) AS rn
+                        FROM campaign_events WHERE campaign_id IS NOT NULL AND contact_id IS NOT NULL
+                    ) ranked WHERE rn > 1
+                )
+            """)).rowcount
+        if deleted:
+            print(f"✅ {deleted} evento(s) de campanha duplicado(s) removido(s).")
+    except Exception as e:
+        print(f"⚠️ Deduplicação de eventos de campanha falhou: {str(e).splitlines()[0]}")
 
 def setup_db():
     print("🚀 Inicializando Banco de Dados...")
@@ -42,6 +122,28 @@ def setup_db():
             except Exception:
                 pass
 
+        # 3. Colunas do dispatcher de campanhas
+        add_column("campaign_events", "claimed_by VARCHAR(100)")
+        add_column("campaign_events", "claim_expires_at TIMESTAMP WITH TIME ZONE")
+        add_column("campaign_events", "attempts INTEGER DEFAULT 0")
+        add_column("campaign_events", "next_attempt_at TIMESTAMP WITH TIME ZONE")
+        add_column("campaign_events", "last_error VARCHAR(500)")
+        add_column("campaigns", "updated_at TIMESTAMP WITH TIME ZONE")
+        add_column("campaigns", "priority INTEGER DEFAULT 1")
+        add_column("campaign_events", "instance VARCHAR(100)")
+        add_column("campaign_events", "reserved_at TIMESTAMP WITH TIME ZONE")
+        add_column("campaign_events", "next_allowed_at TIMESTAMP WITH TIME ZONE")
+        add_column("contacts", "assigned_instance VARCHAR(100)")
+        add_column("contacts", "phone_key VARCHAR(20)")
+        add_column("ai_reply_jobs", "prompt_tokens INTEGER")
+        backfill_phone_keys()
+
+        # 4. Índices dos caminhos quentes (mesmos das migrations Alembic)
+        dedupe_messages()
+        dedupe_campaign_events()
+        create_indexes()
+        print("✅ Índices verificados/criados.")
+
     except Exception as e:
         print(f"❌ Erro no setup_db: {e}")
 
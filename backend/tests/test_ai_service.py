@@ -0,0 +1,156 @@
+"""
+AIService contra um servidor OpenAI falso (local): retry em 429/5xx e remontagem do streaming SSE.
+
+Uso (dentro de backend/):
+    python -m pytest tests          (ou: python -m unittest discover tests)
+"""
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://") # Settings exige; o AIService não usa o banco aqui
+
+from app.core.config import settings
+from app.services.ai_service import AIService, OpenAIError
+
+
+class StubOpenAI(BaseHTTPRequestHandler):
+    """Responde conforme o roteiro da classe: 'text', 'tool' ou 'errNNN' (429 com Retry-After)."""
+    protocol_version = "HTTP/1.1"
+    script = []
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubOpenAI.requests.append((time.monotonic(), body))
+        kind = StubOpenAI.script.pop(0) if StubOpenAI.script else "text"
+
+        if kind.startswith("err"):
+            code = int(kind[3:])
+            self._send(code, b'{"error": {"message": "stub"}}', {"Retry-After": "0.3"} if code == 429 else {})
+            return
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": "resposta inteira"}
+            self._send(200, json.dumps({"choices": [{"message": message}]}).encode())
+            return
+
+        if kind == "tool":
+            # Nome e argumentos da tool chegam quebrados em vários pedaços
+            deltas = [
+                {"role": "assistant"},
+                {"tool_calls": [{"index": 0, "id": "call_1", "function": {"name": "update_contact_", "arguments": '{"na'}}]},
+                {"tool_calls": [{"index": 0, "function": {"name": "name", "arguments": 'me": "Ana"}'}}]},
+            ]
+        else:
+            deltas = [{"role": "assistant"}, {"content": "Olá"}, {"content": ", Ana!"}]
+        chunks = [{"choices": [{"delta": d}]} for d in deltas]
+        chunks.append({"choices": [], "usage": {"prompt_tokens": 321, "completion_tokens": 7}})
+        out = b"".join(b"data: " + json.dumps(c).encode() + b"\n\n" for c in chunks) + b"data: [DONE]\n\n"
+        self._send(200, out, {"Content-Type": "text/event-stream"})
+
+    def _send(self, code: int, data: bytes, headers: dict = None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class AIServiceStubTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAI)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubOpenAI.script = []
+        StubOpenAI.requests = []
+        patches = {
+            "OPENAI_API_URL": f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions",
+            "OPENAI_STREAM": True,
+            "OPENAI_MAX_RETRIES": 3,
+            "OPENAI_RETRY_BACKOFF_SECONDS": 0.01,
+            "OPENAI_RETRY_MAX_WAIT_SECONDS": 5.0,
+        }
+        for name, value in patches.items():
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.service = AIService()
+        self.service.api_key = "sk-test"
+
+    def ask(self, **kwargs):
+        return self.service.generate_response([{"role": "user", "content": "oi"}], **kwargs)
+
+    def test_429_respects_retry_after(self):
+        StubOpenAI.script = ["err429", "text"]
+        self.assertEqual(self.ask(), "Olá, Ana!")
+        (first, _), (second, _) = StubOpenAI.requests
+        self.assertGreaterEqual(second - first, 0.3)
+
+    def test_5xx_is_retried(self):
+        StubOpenAI.script = ["err503", "err500", "text"]
+        self.assertEqual(self.ask(), "Olá, Ana!")
+        self.assertEqual(len(StubOpenAI.requests), 3)
+
+    def test_retry_exhaustion_raises_instead_of_error_text(self):
+        StubOpenAI.script = ["err503"] * 4
+        with self.assertRaises(OpenAIError) as ctx:
+            self.ask()
+        self.assertTrue(ctx.exception.retryable)
+        self.assertEqual(len(StubOpenAI.requests), 4)
+
+    def test_client_error_is_not_retried(self):
+        StubOpenAI.script = ["err400"]
+        with self.assertRaises(OpenAIError) as ctx:
+            self.ask()
+        self.assertFalse(ctx.exception.retryable)
+        self.assertEqual(len(StubOpenAI.requests), 1)
+
+    def test_missing_api_key_raises(self):
+        self.service.api_key = None
+        with self.assertRaises(OpenAIError) as ctx:
+            self.ask()
+        self.assertFalse(ctx.exception.retryable)
+        self.assertEqual(StubOpenAI.requests, [])
+
+    def test_stream_reassembles_content_and_usage(self):
+        first_token, usage = [], {}
+        self.assertEqual(self.ask(on_first_token=lambda: first_token.append(1), usage=usage), "Olá, Ana!")
+        self.assertEqual(first_token, [1])
+        self.assertEqual(usage["prompt_tokens"], 321)
+        self.assertEqual(usage["completion_tokens"], 7)
+        self.assertTrue(StubOpenAI.requests[0][1]["stream"])
+
+    def test_stream_reassembles_tool_calls(self):
+        StubOpenAI.script = ["tool", "text"]
+        usage = {}
+        self.assertEqual(self.ask(usage=usage), "Olá, Ana!")
+        followup = StubOpenAI.requests[1][1]["messages"]
+        call = followup[-2]["tool_calls"][0]
+        self.assertEqual(call["id"], "call_1")
+        self.assertEqual(call["function"]["name"], "update_contact_name")
+        self.assertEqual(json.loads(call["function"]["arguments"]), {"name": "Ana"})
+        self.assertEqual(followup[-1], {"role": "tool", "tool_call_id": "call_1", "content": "Função executada com sucesso."})
+        self.assertEqual(usage["calls"], 2)
+
+    def test_without_stream(self):
+        with mock.patch.object(settings, "OPENAI_STREAM", False):
+            self.assertEqual(self.ask(), "resposta inteira")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+ContextBuilder: ordem de prioridade do orçamento de tokens e a última mensagem sempre presente.
+
+Uso (dentro de backend/):
+    python -m pytest tests          (ou: python -m unittest discover tests)
+"""
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://") # Settings exige; o ContextBuilder não usa o banco
+
+from app.core.config import settings
+from app.services.context_builder import (
+    ContextBuilder, OMITTED_NOTE, REPLY_PRIMING_TOKENS, TRUNCATION_MARK
+)
+
+MODEL = "modelo-teste"
+RECENT = 2
+
+
+class ContextBuilderTest(unittest.TestCase):
+    def setUp(self):
+        patches = {
+            "AI_CONTEXT_BUDGETS": {MODEL: 100000},
+            "AI_CONTEXT_RECENT_TURNS": RECENT,
+            "AI_CONTEXT_MAX_MESSAGE_TOKENS": 400,
+            "AI_CONTEXT_RAG_CHUNK_TOKENS": 200,
+        }
+        for name, value in patches.items():
+            patcher = mock.patch.object(settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.builder = ContextBuilder()
+        self.history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"mensagem {i} " + "palavra " * 30}
+            for i in range(6)
+        ]
+        self.rag = [{"document_title": "Preços", "chunk_text": "Limpeza de pele custa R$ 150. " * 3}]
+
+    def build(self, budget: int, **kwargs):
+        settings.AI_CONTEXT_BUDGETS[MODEL] = budget
+        params = {"system_prompt": "Você é a assistente da clínica.", "rules": "\nREGRAS: seja breve.",
+                  "history": self.history, "rag_chunks": self.rag}
+        params.update(kwargs)
+        return self.builder.build(MODEL, **params)
+
+    def sections(self) -> dict:
+        """Custo de cada seção com orçamento de sobra (vale para tiktoken ou estimativa)."""
+        return self.build(100000).sections
+
+    def note_tokens(self) -> int:
+        return self.builder.counter(MODEL).count(OMITTED_NOTE.format(n=len(self.history)))
+
+    def test_last_message_survives_tiny_budget(self):
+        long_question = "Quero saber o preço " + "e os horários " * 200
+        self.history.append({"role": "user", "content": long_question})
+        context = self.build(10, system_prompt="Prompt do sistema bem comprido. " * 20)
+        last = context.messages[-1]
+        self.assertEqual(last["role"], "user")
+        self.assertTrue(last["content"].startswith("Quero saber o preço"))
+        self.assertTrue(last["content"].endswith(TRUNCATION_MARK))
+        self.assertEqual(context.history_used, 1)
+        self.assertEqual(context.truncated, 1)
+
+    def test_short_last_message_never_truncated(self):
+        self.history.append({"role": "user", "content": "Tem horário amanhã?"})
+        context = self.build(10)
+        self.assertEqual(context.messages[-1]["content"], "Tem horário amanhã?")
+        self.assertEqual(context.history_used, 1)
+
+    def test_recent_turns_before_rag_before_older(self):
+        sections = self.sections()
+        budget = (REPLY_PRIMING_TOKENS + sections["system"] + sections["rules"]
+                  + sections["recent"] + sections["rag"] + self.note_tokens())
+        context = self.build(budget)
+        self.assertEqual(context.history_used, RECENT)
+        self.assertEqual(context.rag_used, 1)
+        self.assertEqual([m["content"] for m in context.messages[1:]], [m["content"] for m in self.history[-RECENT:]])
+        self.assertIn(OMITTED_NOTE.format(n=len(self.history) - RECENT), context.messages[0]["content"])
+
+    def test_rag_dropped_before_recent_turns(self):
+        sections = self.sections()
+        budget = REPLY_PRIMING_TOKENS + sections["system"] + sections["rules"] + sections["recent"] + self.note_tokens()
+        context = self.build(budget)
+        self.assertEqual(context.history_used, RECENT)
+        self.assertEqual(context.rag_used, 0)
+        self.assertNotIn("BASE DE CONHECIMENTO", context.messages[0]["content"])
+
+    def test_older_messages_fill_leftover_budget(self):
+        context = self.build(100000)
+        self.assertEqual(context.history_used, len(self.history))
+        self.assertEqual(context.rag_used, 1)
+        self.assertNotIn("omitidas", context.messages[0]["content"])
+
+
+if __name__ == "__main__":
+    unittest.main()
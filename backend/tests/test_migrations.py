@@ -0,0 +1,82 @@
+"""
+Cadeia do Alembic sozinha (sem setup_database.py) monta o mesmo esquema dos models.
+
+Uso (dentro de backend/):
+    python -m pytest tests
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://") # Settings exige; cada teste usa o próprio arquivo
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, text
+
+from app.core.config import settings
+from app.db.base import Base
+from app.models import models  # noqa: F401
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class AlembicChainTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.url = f"sqlite:///{self.path}"
+        self.addCleanup(os.remove, self.path)
+        # env.py lê a URL das settings
+        patcher = mock.patch.object(settings, "DATABASE_URL", self.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+        self.config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+
+    def schema_diff(self) -> list:
+        engine = create_engine(self.url)
+        try:
+            with engine.connect() as conn:
+                return compare_metadata(MigrationContext.configure(conn), Base.metadata)
+        finally:
+            engine.dispose()
+
+    def test_upgrade_head_on_empty_database_matches_models(self):
+        command.upgrade(self.config, "head")
+        self.assertEqual(self.schema_diff(), [])
+
+    def test_downgrade_and_upgrade_again(self):
+        command.upgrade(self.config, "head")
+        command.downgrade(self.config, "0000")
+        command.upgrade(self.config, "head")
+        self.assertEqual(self.schema_diff(), [])
+
+    def test_upgrade_existing_baseline_database(self):
+        # Banco criado pelo setup_database antigo (sem colunas novas), com duplicados a limpar
+        command.upgrade(self.config, "0000")
+        engine = create_engine(self.url)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE alembic_version"))
+            conn.execute(text("INSERT INTO campaigns (id, name) VALUES ('c1', 'C')"))
+            conn.execute(text("INSERT INTO contacts (id, phone_e164) VALUES ('p1', '+5511999999999')"))
+            for event_id, status in (("e1", "queued"), ("e2", "sent")):
+                conn.execute(text(
+                    "INSERT INTO campaign_events (id, campaign_id, contact_id, status) VALUES (:id, 'c1', 'p1', :status)"
+                ), {"id": event_id, "status": status})
+        engine.dispose()
+
+        command.upgrade(self.config, "head")
+        self.assertEqual(self.schema_diff(), [])
+        engine = create_engine(self.url)
+        with engine.connect() as conn:
+            kept = conn.execute(text("SELECT id FROM campaign_events")).scalars().all()
+        engine.dispose()
+        self.assertEqual(kept, ["e2"]) # Mantém o que já foi enviado
+
+
+if __name__ == "__main__":
+    unittest.main()
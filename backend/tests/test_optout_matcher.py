@@ -0,0 +1,102 @@
+"""
+Detector de opt-out: fronteira de palavra nas frases, keyword exata depois de tirar a pontuação
+e padrões por tenant (Tenant.config) com cache por TTL.
+
+Uso (dentro de backend/):
+    python -m pytest tests          (ou: python -m unittest discover tests)
+"""
+import os
+import unittest
+import uuid
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://") # Settings exige; o registro usa um banco em memória próprio
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.models import Tenant
+from app.services import optout_matcher
+from app.services.optout_matcher import OptOutMatcher, OptOutRegistry, TENANT_CONFIG_TTL_SECONDS
+
+
+class OptOutMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = OptOutMatcher()
+
+    def test_phrase_matches_whole_words_only(self):
+        self.assertEqual(self.matcher.match("Por favor, me remove da lista"), "ME REMOVE")
+        self.assertIsNone(self.matcher.match("ME REMOVENDO do grupo da família"))
+        self.assertIsNone(self.matcher.match("vocês não querem maisena?"))
+
+    def test_phrase_ignores_accents_and_punctuation(self):
+        self.assertEqual(self.matcher.match("Não... quero MAIS!!"), "NAO QUERO MAIS")
+
+    def test_keyword_matches_whole_message_after_punctuation(self):
+        self.assertEqual(self.matcher.match("Sair!"), "SAIR")
+        self.assertEqual(self.matcher.match("  stop.  "), "STOP")
+        self.assertIsNone(self.matcher.match("vou sair cedo hoje"))
+        self.assertIsNone(self.matcher.match("Sair?? Não, só queria o endereço"))
+
+    def test_empty_message(self):
+        self.assertIsNone(self.matcher.match(""))
+        self.assertIsNone(self.matcher.match(None))
+
+
+class OptOutRegistryTest(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Tenant.__table__.create(engine)
+        self.addCleanup(engine.dispose)
+        self.Session = sessionmaker(bind=engine)
+        self.db = self.Session()
+        self.addCleanup(self.db.close)
+        self.tenant_id = uuid.uuid4()
+        self.db.add(Tenant(id=self.tenant_id, name="Clínica", config={
+            "optout_keywords": ["Tchau"], "optout_phrases": ["pode me excluir"]
+        }))
+        self.db.commit()
+        self.registry = OptOutRegistry()
+        self.clock = 1000.0
+        patcher = mock.patch.object(optout_matcher.time, "monotonic", lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def set_config(self, config: dict):
+        other = self.Session()
+        other.get(Tenant, self.tenant_id).config = config
+        other.commit()
+        other.close()
+
+    def test_tenant_override_replaces_defaults(self):
+        matcher = self.registry.for_tenant(self.db, self.tenant_id)
+        self.assertEqual(matcher.match("tchau!"), "TCHAU")
+        self.assertEqual(matcher.match("Pode me EXCLUIR, obrigado"), "PODE ME EXCLUIR")
+        self.assertIsNone(matcher.match("cancelar"))
+
+    def test_without_tenant_or_config_uses_defaults(self):
+        self.assertEqual(self.registry.for_tenant(self.db, None).match("cancelar"), "CANCELAR")
+        self.set_config({"dispatch_weight": 2})
+        self.assertEqual(self.registry.for_tenant(self.db, self.tenant_id).match("cancelar"), "CANCELAR")
+
+    def test_config_change_applies_after_ttl(self):
+        self.assertIsNone(self.registry.for_tenant(self.db, self.tenant_id).match("cancelar"))
+        self.set_config({"optout_keywords": ["CANCELAR"]})
+        self.db.expire_all()
+
+        self.clock += TENANT_CONFIG_TTL_SECONDS - 1
+        self.assertIsNone(self.registry.for_tenant(self.db, self.tenant_id).match("cancelar")) # Ainda em cache
+        self.clock += 2
+        self.assertEqual(self.registry.for_tenant(self.db, self.tenant_id).match("cancelar"), "CANCELAR")
+
+    def test_invalidate_applies_immediately(self):
+        self.assertIsNone(self.registry.for_tenant(self.db, self.tenant_id).match("cancelar"))
+        self.set_config({"optout_keywords": ["CANCELAR"]})
+        self.db.expire_all()
+        self.registry.invalidate(self.tenant_id)
+        self.assertEqual(self.registry.for_tenant(self.db, self.tenant_id).match("cancelar"), "CANCELAR")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Plano das consultas quentes das filas: roda o código real dos serviços (claim do dispatcher, leases,
+contadores de envio, reserva de orçamento da instância, refresh da fila justa, claim do inbox do webhook
+e dos jobs da IA) num banco montado pelo Alembic, captura o SQL emitido e falha se alguma consulta
+varrer a tabela inteira. As consultas simples de verificar_indices.py também são conferidas aqui.
+
+Uso (dentro de backend/):
+    python -m pytest tests
+"""
+import os
+import tempfile
+import unittest
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
+
+os.environ.setdefault("DATABASE_URL", "sqlite://") # Settings exige; cada teste usa o próprio arquivo
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.models.models import (
+    AIReplyJob, Campaign, CampaignEvent, Contact, Conversation, SystemSettings, Tenant, WebhookInbox
+)
+from app.services.ai_reply_scheduler import AIReplyScheduler
+from app.services.campaign_service import CampaignService
+from app.services.fair_queue import FairQueue
+from app.services.rate_limiter import SendRateTracker
+from app.services.webhook_worker import WebhookWorker
+from verificar_indices import hot_queries, seq_scans_sqlite
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tabelas das filas: nelas, varredura completa vira gargalo com o histórico crescendo
+HOT_TABLES = {"campaign_events", "webhook_inbox", "ai_reply_jobs", "contacts", "conversations", "messages"}
+
+
+class QueryPlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        url = f"sqlite:///{cls.path}"
+        config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+        config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+        with mock.patch.object(settings, "DATABASE_URL", url):
+            command.upgrade(config, "head")
+        cls.engine = create_engine(url)
+        cls.Session = sessionmaker(bind=cls.engine)
+        cls.seed()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        os.remove(cls.path)
+
+    @classmethod
+    def seed(cls):
+        db = cls.Session()
+        tenant = Tenant(id=uuid.uuid4(), name="T")
+        contact = Contact(id=uuid.uuid4(), tenant_id=tenant.id, phone_e164="+5511999999999", phone_key="551199999999")
+        conversation = Conversation(id=uuid.uuid4(), tenant_id=tenant.id, contact_id=contact.id, status="open")
+        campaign = Campaign(id=uuid.uuid4(), tenant_id=tenant.id, name="C", status="active")
+        db.add_all([tenant, contact, conversation, campaign])
+        db.flush()
+        db.add(CampaignEvent(id=uuid.uuid4(), campaign_id=campaign.id, contact_id=contact.id, status="queued"))
+        db.add(WebhookInbox(event="messages.upsert", remote_jid="5511999999999@s.whatsapp.net", payload={}))
+        db.add(AIReplyJob(tenant_id=tenant.id, conversation_id=conversation.id, contact_id=contact.id,
+                          run_after=datetime.now() - timedelta(seconds=1)))
+        db.commit()
+        cls.campaign_id = campaign.id
+        db.close()
+
+    def setUp(self):
+        self.db = self.Session()
+        self.addCleanup(self.db.close)
+        self.statements = []
+        listener = lambda conn, cursor, statement, params, context, executemany: \
+            self.statements.append((statement, params))
+        event.listen(self.engine, "before_cursor_execute", listener)
+        self.addCleanup(event.remove, self.engine, "before_cursor_execute", listener)
+
+    def assertIndexed(self, label: str):
+        """Toda consulta capturada usa índice nas tabelas quentes (EXPLAIN QUERY PLAN)."""
+        checked = 0
+        with self.engine.connect() as conn:
+            for statement, params in self.statements:
+                if not statement.lstrip().upper().startswith(("SELECT", "UPDATE")):
+                    continue
+                scans = set(seq_scans_sqlite(conn, statement, params)) & HOT_TABLES
+                self.assertFalse(scans, f"{label}: varredura completa em {scans}\n{statement}")
+                checked += 1
+        self.assertGreater(checked, 0, f"{label}: nenhuma consulta capturada")
+
+    def test_dispatcher_claim_events(self):
+        CampaignService().claim_events(self.db, "plan-test", campaign_id=self.campaign_id)
+        self.assertIndexed("dispatcher: claim_events")
+
+    def test_dispatcher_release_expired_claims(self):
+        CampaignService().release_expired_claims(self.db)
+        self.assertIndexed("dispatcher: leases expirados")
+
+    def test_send_rate_tracker_rebuild(self):
+        SendRateTracker().rebuild(self.db)
+        self.assertIndexed("dispatcher: contadores de envio")
+
+    def test_reserve_instance_budget(self):
+        pending = self.db.query(CampaignEvent).first()
+        limits = SystemSettings(daily_limit=500, hourly_limit=50, min_interval_seconds=0, max_interval_seconds=0)
+        self.statements.clear()
+        CampaignService().reserve_instance(self.db, pending, "inst-a", limits, datetime.now())
+        self.assertIndexed("dispatcher: reserve_instance")
+        self.db.rollback()
+
+    def test_fair_queue_refresh(self):
+        FairQueue().refresh(self.db, datetime.now())
+        self.assertIndexed("fila justa: refresh")
+
+    def test_webhook_inbox_claim(self):
+        worker = WebhookWorker()
+        worker.claim(self.db, limit=8)
+        self.assertIndexed("webhook: claim do inbox")
+
+    def test_ai_reply_job_claim(self):
+        AIReplyScheduler().claim(self.db, limit=4)
+        self.assertIndexed("IA: claim dos jobs")
+
+    def test_simple_hot_queries(self):
+        with self.engine.connect() as conn:
+            for name, stmt in hot_queries().items():
+                sql = str(stmt.compile(dialect=self.engine.dialect, compile_kwargs={"literal_binds": True}))
+                scans = set(seq_scans_sqlite(conn, sql)) & HOT_TABLES
+                self.assertFalse(scans, f"{name}: varredura completa em {scans}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Regressão de plano de consulta: falha (exit 1) se alguma consulta quente
+cair em varredura sequencial da tabela em vez de usar índice.
+
+Uso (dentro de backend/, com DATABASE_URL apontando para o banco):
+    python verificar_indices.py
+
+- Postgres: EXPLAIN (FORMAT JSON) com enable_seqscan=off. Assim, com tabela pequena ou vazia,
+  só aparece "Seq Scan" quando realmente não existe índice utilizável.
+- SQLite: EXPLAIN QUERY PLAN; "SCAN <tabela>" sem índice = varredura completa.
+
+As consultas das filas (claim do dispatcher, reserva de orçamento, fila justa, inbox do webhook,
+jobs da IA) são conferidas com o SQL real dos serviços em tests/test_query_plans.py.
+"""
+import json
+import sys
+import os
+import uuid
+from datetime import datetime
+
+sys.path.append(os.getcwd())
+
+from sqlalchemy import select, exists, and_  # type: ignore
+
+from app.db.session import engine
+from app.models.models import Contact, Conversation, Message, Procedure, Campaign, CampaignEvent
+
+SAMPLE_ID = uuid.UUID(int=1)
+SINCE = datetime(2026, 1, 1)
+
+
+def hot_queries():
+    """As mesmas formas de consulta do webhook, do enfileiramento e das telas (valores fictícios)."""
+    return {
+        "webhook: contato pelo telefone": select(Contact.id).where(Contact.phone_key == "551199999999"),
+        "import: contato por tenant+telefone": select(Contact.id).where(
+            Contact.tenant_id == SAMPLE_ID, Contact.phone_e164 == "+5511999999999"),
+        "webhook: contato sem tenant": select(Contact.id).where(
+            Contact.tenant_id == None, Contact.phone_e164 == "+5511999999999"),
+        "webhook: conversa aberta": select(Conversation.id).where(
+            Conversation.contact_id == SAMPLE_ID, Conversation.status == "open"),
+        "webhook: mensagem duplicada": select(Message.id).where(
+            Message.tenant_id == SAMPLE_ID, Message.external_id == "ABC123"),
+        "chat: histórico da conversa": select(Message.id).where(
+            Message.conversation_id == SAMPLE_ID).order_by(Message.timestamp.desc()).limit(15),
+        "webhook: resposta -> campanha": select(CampaignEvent.id).where(
+            CampaignEvent.contact_id == SAMPLE_ID, CampaignEvent.status == "sent",
+            CampaignEvent.replied_at == None, CampaignEvent.processed_at >= SINCE),
+        "enfileirar: já está na fila": select(Contact.id).where(
+            Contact.tenant_id == SAMPLE_ID,
+            ~exists().where(and_(CampaignEvent.campaign_id == SAMPLE_ID, CampaignEvent.contact_id == Contact.id))),
+        "template: procedimentos do contato": select(Procedure.id).where(
+            Procedure.contact_id == SAMPLE_ID).order_by(Procedure.performed_at.desc()),
+        "campanhas do tenant": select(Campaign.id).where(
+            Campaign.tenant_id == SAMPLE_ID).order_by(Campaign.created_at.desc()),
+    }
+
+
+def compile_sql(stmt) -> str:
+    return str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def seq_scans_postgres(conn, sql: str) -> list:
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    found = []
+
+    def walk(node):
+        if node.get("Node Type") == "Seq Scan":
+            found.append(node.get("Relation Name"))
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return found
+
+
+def seq_scans_sqlite(conn, sql: str, params=()) -> list:
+    found = []
+    for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+        detail = row[-1]
+        # "SCAN contacts" = varredura completa; "SCAN x USING INDEX ..." / "SEARCH ..." usam índice
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            found.append(detail[5:].split()[0])
+    return found
+
+
+def main() -> int:
+    dialect = engine.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        print(f"⚠️ Dialeto {dialect} não suportado pela verificação.")
+        return 0
+
+    failures = 0
+    with engine.connect() as conn:
+        if dialect == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+        for name, stmt in hot_queries().items():
+            sql = compile_sql(stmt)
+            scans = seq_scans_postgres(conn, sql) if dialect == "postgresql" else seq_scans_sqlite(conn, sql)
+            if scans:
+                failures += 1
+                print(f"❌ {name}: varredura sequencial em {', '.join(scans)}")
+            else:
+                print(f"✅ {name}")
+
+    if failures:
+        print(f"\n❌ {failures} consulta(s) sem índice. Rode 'alembic upgrade head' (ou setup_database.py).")
+        return 1
+    print("\n✅ Todas as consultas quentes usam índice.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
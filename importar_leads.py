@@ -1,7 +1,6 @@
 import sys
 import os
 import pandas as pd
-import re
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 import uuid
@@ -11,27 +10,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 
 from app.db.session import SessionLocal
 from app.models.models import Contact, LeadPipeline
-
-def clean_phone(phone_raw):
-    """
-    Padroniza telefones para o formato E.164 (+55DDDxxxxxxxxx)
-    """
-    if not phone_raw:
-        return None
-    
-    # Converte para string e remove tudo que não é número
-    phone_str = str(phone_raw)
-    digits = re.sub(r'\D', '', phone_str)
-    
-    # Se não tiver dígitos suficientes, descarta
-    if len(digits) < 10:
-        return None
-        
-    # Assume Brasil (+55) se não começar com 55 e tiver 10 ou 11 dígitos
-    if len(digits) in [10, 11]:
-        digits = '55' + digits
-        
-    return f"+{digits}"
+from app.core.phone import normalize_phone, phone_key
 
 def import_excel(file_path):
     print(f"📖 Lendo arquivo: {file_path}")
@@ -68,13 +47,18 @@ def import_excel(file_path):
                     
                 # Sanitiza
                 name = str(raw_name).strip() if not pd.isna(raw_name) else "Sem Nome"
-                phone = clean_phone(raw_phone)
+                phone = normalize_phone(raw_phone)
                 
                 if not phone:
                     # print(f"      ⚠️ Telefone inválido na linha {index}: {raw_phone}")
                     total_errors += 1
                     continue
                 
+                # Duplicado (com/sem 9º dígito é o mesmo contato)
+                if db.query(Contact.id).filter(Contact.phone_key == phone_key(phone)).first():
+                    total_duplicates += 1
+                    continue
+
                 # Tenta inserir
                 contact = Contact(
                     full_name=name,